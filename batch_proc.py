@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+
+from opencv_func import ImageFunc
+from dir_scanner import iter_img_paths
+from img_cache import imread
+from preprocess import PreprocParams, img_preproc
+
+STAGES = ('read', 'crop', 'color', 'threshold', 'proc', 'trim', 'save')
+
+
+def proc_file(img_path: str, out_path: str, params: PreprocParams, use_proc: bool = True) -> dict:
+    """
+    1枚分の処理: 読込 -> 前処理 -> image_proc.img_proc -> 保存。ワーカープロセスで実行
+
+    :param img_path: 入力画像
+    :param out_path: 出力画像
+    :param params: 前処理条件
+    :param use_proc: image_proc.img_procを実行するか
+    :return: 各処理の時間[sec]とエラー
+    """
+    res = {"path": img_path, "error": None, "timings": {}}
+    _timings = res["timings"]
+
+    try:
+        _t0 = time.perf_counter()
+        img = imread(img_path, cv2.IMREAD_COLOR)
+        _timings['read'] = time.perf_counter() - _t0
+        if img is None:
+            raise ValueError('cannot read image')
+
+        img = img_preproc(img, params, timings=_timings)
+
+        if use_proc:
+            from image_proc import img_proc
+
+            _t0 = time.perf_counter()
+            img = img_proc(img)
+            _timings['proc'] = time.perf_counter() - _t0
+            if img is None:
+                raise ValueError('img_proc returned None')
+
+        _t0 = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+        ImageFunc.save_img_file(img, out_path)
+        _timings['save'] = time.perf_counter() - _t0
+
+    except Exception as err:
+        res["error"] = str(err)
+
+    return res
+
+
+def run_batch(dir: str, out_dir: str, params: PreprocParams,
+              img_key: str = '*.*', use_proc: bool = True,
+              workers: int = None, max_inflight: int = None, log_every: int = 100) -> dict:
+    """
+    ホルダ以下の全画像を並列に処理
+
+    :param dir: 入力ホルダ
+    :param out_dir: 出力ホルダ。入力ホルダからの相対パスで保存
+    :param params: 前処理条件
+    :param img_key: ファイル名のパターン
+    :param use_proc: image_proc.img_procを実行するか
+    :param workers: プロセス数
+    :param max_inflight: 同時に投入する最大の処理数
+    :param log_every: 進捗を表示する間隔(枚)
+    :return: 処理結果のレポート
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_inflight is None:
+        max_inflight = workers * 4
+
+    _totals = {_stage: 0.0 for _stage in STAGES}
+    _failures = []
+    _num = 0
+
+    def _collect(futures):
+        nonlocal _num
+        for _future in futures:
+            _res = _future.result()
+            _num += 1
+            if _res["error"] is not None:
+                _failures.append({"path": _res["path"], "error": _res["error"]})
+            for _stage, _sec in _res["timings"].items():
+                _totals[_stage] = _totals.get(_stage, 0.0) + _sec
+
+            if log_every > 0 and _num % log_every == 0:
+                _elapsed = time.perf_counter() - _t0
+                print(f'{_num} images, {_num / _elapsed:.1f} images/s, {len(_failures)} failures')
+
+    _t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        _inflight = set()
+        for _img_path in iter_img_paths(dir, img_key):
+            # bounded in-flight work
+            if len(_inflight) >= max_inflight:
+                _done, _inflight = wait(_inflight, return_when=FIRST_COMPLETED)
+                _collect(_done)
+
+            _out_path = os.path.join(out_dir, os.path.relpath(_img_path, dir))
+            _inflight.add(executor.submit(proc_file, _img_path, _out_path, params, use_proc))
+
+        _collect(wait(_inflight).done)
+
+    _elapsed = time.perf_counter() - _t0
+
+    res = {"dir": dir,
+           "out_dir": out_dir,
+           "images": _num,
+           "failures": _failures,
+           "elapsed_sec": _elapsed,
+           "images_per_sec": _num / _elapsed if _elapsed > 0 else 0.0,
+           "stage_total_sec": _totals,
+           "stage_mean_msec": {_stage: _sec / _num * 1000 if _num > 0 else 0.0
+                               for _stage, _sec in _totals.items()},
+           }
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='image_proc.img_procをホルダ内の全画像に実行(GUIなし)')
+    parser.add_argument('dir', help='入力ホルダ')
+    parser.add_argument('out_dir', help='出力ホルダ')
+    parser.add_argument('--key', default='*.*', help='ファイル名のパターン')
+    parser.add_argument('--color', default='color',
+                        choices=['color', 'gray', 'blue', 'green', 'red', 'h', 's', 'v'])
+    parser.add_argument('--thres', type=int, nargs=2, metavar=('LOWER', 'UPPER'), help='二値化の閾値')
+    parser.add_argument('--zoom', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'), help='切り出し範囲')
+    parser.add_argument('--no-proc', action='store_true', help='img_procを実行しない(前処理のみ)')
+    parser.add_argument('--workers', type=int, default=None, help='プロセス数')
+    parser.add_argument('--max-inflight', type=int, default=None, help='同時に投入する最大の処理数')
+    parser.add_argument('--report', default=None, help='レポートの出力先(JSON)')
+    args = parser.parse_args()
+
+    params = PreprocParams(color=args.color)
+    if args.thres is not None:
+        params.thres_flg = True
+        params.thres = {"mode": 'single',
+                        "value_inverse": False,
+                        "value_lower": args.thres[0],
+                        "value_upper": args.thres[1],
+                        }
+    if args.zoom is not None:
+        params.zoom = True
+        params.pos0 = (args.zoom[0], args.zoom[1])
+        params.pos1 = (args.zoom[2], args.zoom[3])
+
+    res = run_batch(args.dir, args.out_dir, params,
+                    img_key=args.key,
+                    use_proc=not args.no_proc,
+                    workers=args.workers,
+                    max_inflight=args.max_inflight)
+
+    print(f'images: {res["images"]}, failures: {len(res["failures"])}')
+    print(f'elapsed: {res["elapsed_sec"]:.2f} sec, {res["images_per_sec"]:.1f} images/s')
+    for _stage, _msec in res["stage_mean_msec"].items():
+        print(f'  {_stage}: {_msec:.2f} msec/image')
+    for _failure in res["failures"]:
+        print(f'  failed: {_failure["path"]}: {_failure["error"]}')
+
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(res, f, indent=2)
+
+    return 0 if len(res["failures"]) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,462 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+import cv2
+import numpy as np
+
+from main import ImageViewer, ImageCvData, ImageInfo, img_cv2pil, img_cv2tk
+from gui_params import GuiParams
+from img_cache import ImageCache
+from opencv_func import ImageFunc
+from preprocess import PreprocParams, PreprocPipeline, img_preproc
+from tile_grid import TileGrid, to_pil_buffer
+from display_lut import DisplayWindow, apply_window
+
+COLOR_MODES = ('color', 'gray', 'blue', 'green', 'red', 'h', 's', 'v')
+CORPUS_SIZES_MP = (1, 4, 16, 100)
+CORPUS_DEPTHS = (8, 16)
+CORPUS_CHANNELS = (1, 3)
+CORPUS_FORMATS = ('png', 'jpg', 'tif')
+
+
+def time_func(func, repeat=100):
+    """
+    関数の実行時間を計測
+
+    :param func: 引数なしの関数
+    :param repeat: 繰り返し回数
+    :return: 1回あたりの実行時間[sec]
+    """
+    func()
+
+    _t0 = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - _t0) / repeat
+
+
+def time_stats(func, repeat=20, max_sec=2.0, setup=None, warmup=True) -> dict:
+    """
+    関数の実行時間を1回ずつ計測し、統計量を算出
+
+    :param func: 引数なしの関数
+    :param repeat: 最大の繰り返し回数
+    :param max_sec: 計測時間の上限[sec]。最低1回は計測する
+    :param setup: 毎回の計測前に呼ぶ関数(計測に含めない)
+    :param warmup: 計測前に1回実行するか
+    :return: 実行時間[msec]の中央値、最小、平均と回数
+    """
+    if warmup:
+        if setup is not None: setup()
+        func()
+
+    _times = []
+    _start = time.perf_counter()
+    while len(_times) < repeat:
+        if setup is not None: setup()
+        _t0 = time.perf_counter()
+        func()
+        _times.append(time.perf_counter() - _t0)
+        if time.perf_counter() - _start > max_sec:
+            break
+
+    _times = np.array(_times) * 1000
+    res = {"median_msec": float(np.median(_times)),
+           "min_msec": float(_times.min()),
+           "mean_msec": float(_times.mean()),
+           "num": len(_times),
+           }
+    return res
+
+
+def bench_mouse_info(img_h=700, img_w=1000, repeat=200):
+    """
+    show_info_mouseの1イベントあたりの処理時間: 画像全体のHSV変換 vs 1画素のみ変換
+    """
+    img = np.random.randint(0, 256, (img_h, img_w, 3), dtype=np.uint8)
+
+    def _before():
+        _img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        return _img_hsv[img_h // 2, img_w // 2]
+
+    def _after():
+        info = ImageInfo()
+        info.img = img
+        info.fit_ratio = 1.0
+        info.gui_x = img_w // 2
+        info.gui_y = img_h // 2
+        info.calc_params()
+        return info.hsv
+
+    res = {"img_size": [img_h, img_w],
+           "before_usec": time_func(_before, repeat) * 1e6,
+           "after_usec": time_func(_after, repeat) * 1e6,
+           }
+    return res
+
+
+def make_image(img_h: int, img_w: int, depth: int = 8, num_ch: int = 3, seed: int = 0) -> np.array:
+    """
+    合成画像: グラデーション + 円 + ノイズ(圧縮率が実画像に近くなるように)
+
+    :param depth: 8 or 16[bit]
+    :param num_ch: 1 or 3
+    """
+    _rng = np.random.default_rng(seed)
+    _max = 255 if depth == 8 else 65535
+    _dtype = np.uint8 if depth == 8 else np.uint16
+
+    _y = np.linspace(0.0, 1.0, img_h, dtype=np.float32)[:, np.newaxis]
+    _x = np.linspace(0.0, 1.0, img_w, dtype=np.float32)[np.newaxis, :]
+    chs = []
+    for _ch in range(num_ch):
+        _img = (0.3 + 0.4 * (_x * (_ch + 1) / num_ch + _y * (num_ch - _ch) / num_ch) / 2) * _max
+        chs.append(np.broadcast_to(_img, (img_h, img_w)).astype(_dtype))
+    img = cv2.merge(chs) if num_ch > 1 else chs[0]
+
+    # blobs: objects for threshold/histogram
+    for _ in range(50):
+        _cx = int(_rng.integers(0, img_w))
+        _cy = int(_rng.integers(0, img_h))
+        _r = int(_rng.integers(5, max(min(img_h, img_w) // 20, 6)))
+        _val = float(_rng.integers(0, _max))
+        cv2.circle(img, (_cx, _cy), _r, (_val,) * num_ch, -1)
+
+    _noise = _rng.normal(0, _max * 0.02, size=img.shape[:2]).astype(np.float32)
+    if num_ch > 1:
+        _noise = _noise[:, :, np.newaxis]
+    img = np.clip(img + _noise, 0, _max).astype(_dtype)
+    return img
+
+
+def make_corpus(out_dir: str, sizes_mp=CORPUS_SIZES_MP, depths=CORPUS_DEPTHS,
+                channels=CORPUS_CHANNELS, formats=CORPUS_FORMATS) -> list:
+    """
+    合成画像のコーパスを作成。作成済みのファイルは再利用する。JPEGは8bitのみ
+
+    :param out_dir: 出力ホルダ
+    :param sizes_mp: 画素数[MP]
+    :param depths: ビット深度
+    :param channels: チャンネル数
+    :param formats: 形式(拡張子)
+    :return: 画像ごとの条件({"path", "mp", "depth", "ch", "fmt", "shape"})のリスト
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    res = []
+    for _mp in sizes_mp:
+        # 4:3
+        _h = int(round((_mp * 1e6 * 3 / 4) ** 0.5))
+        _w = int(round(_mp * 1e6 / _h))
+        for _depth in depths:
+            for _ch in channels:
+                _img = None
+                for _fmt in formats:
+                    if _fmt == 'jpg' and _depth != 8:
+                        continue
+
+                    _path = os.path.join(out_dir, f'synth_{_mp}mp_{_depth}bit_{_ch}ch.{_fmt}')
+                    if not os.path.isfile(_path):
+                        if _img is None:
+                            _img = make_image(_h, _w, _depth, _ch)
+                        cv2.imwrite(_path, _img)
+
+                    res.append({"path": _path, "mp": _mp, "depth": _depth, "ch": _ch, "fmt": _fmt,
+                                "shape": [_h, _w]})
+    return res
+
+
+def make_viewer(img_paths, img_h: int = 700, img_w: int = 1000, color: str = 'color', thres: dict = None):
+    """
+    GUIなしのImageViewer。読込/前処理の関数のみ使用し、Tkのウィジェットは作成しない
+    """
+    viewer = ImageViewer.__new__(ImageViewer)
+    viewer.param_gui = GuiParams()
+    viewer.img_paths = list(img_paths)
+    viewer.img_h = img_h
+    viewer.img_w = img_w
+
+    viewer.preproc1_color = color
+    viewer.preproc2_thres_flg = thres is not None
+    viewer.preproc2_thres = thres if thres is not None else {}
+    viewer.preproc3_zoom = False
+    viewer.preproc3_pos0 = None
+    viewer.preproc3_pos1 = None
+    viewer.func_proc = None
+
+    viewer.thumb_cache = None
+    viewer.img_cache = ImageCache(max_bytes=viewer.param_gui.cache_max_mb * 1024 * 1024)
+    viewer.preproc_pipeline = PreprocPipeline(max_bytes=viewer.param_gui.preproc_cache_mb * 1024 * 1024)
+    return viewer
+
+
+def _get_tk_root():
+    # PhotoImage needs a Tk root: None without a display
+    try:
+        import tkinter
+        root = tkinter.Tk()
+        root.withdraw()
+        return root
+    except Exception:
+        return None
+
+
+def bench_image(entry: dict, img_h: int = 700, img_w: int = 1000,
+                repeat: int = 20, max_sec: float = 2.0, tk_root=None) -> dict:
+    """
+    1枚分の計測: 読込(キャッシュなし/あり)、前処理(各単一チャンネル化、二値化)、フィット、
+    マウス情報、プロファイル、ヒストグラム、Tk変換
+
+    :param entry: make_corpusの要素
+    :return: 計測項目ごとの実行時間(time_statsの結果)
+    """
+    _path = entry["path"]
+    _kwargs = {"repeat": repeat, "max_sec": max_sec}
+    res = {}
+
+    # read: decode + preprocess, cold(empty caches) and warm
+    viewer = make_viewer([_path], img_h, img_w)
+
+    def _clear():
+        viewer.img_cache.clear()
+        viewer.preproc_pipeline.memo.clear()
+
+    res['load_img_with_preprocess(cold)'] = time_stats(lambda: viewer.load_img_with_preprocess(0),
+                                                       setup=_clear, **_kwargs)
+    res['load_img_with_preprocess(warm)'] = time_stats(lambda: viewer.load_img_with_preprocess(0), **_kwargs)
+    res['load_tile(cold)'] = time_stats(lambda: viewer.load_tile(0), setup=_clear, **_kwargs)
+
+    img = viewer.load_img_with_preprocess(0)
+    img = np.asarray(img)
+
+    # preprocess: each color mode, threshold
+    for _mode in COLOR_MODES:
+        _params = PreprocParams(color=_mode)
+        res[f'img_preproc({_mode})'] = time_stats(lambda: img_preproc(img, _params), **_kwargs)
+    _params = PreprocParams(color='gray', thres_flg=True,
+                            thres={"mode": 'single', "value_inverse": False,
+                                   "value_lower": 125, "value_upper": 255})
+    res['img_preproc(gray+thres)'] = time_stats(lambda: img_preproc(img, _params), **_kwargs)
+    if img.dtype == np.uint8:
+        res['convert_intensity'] = time_stats(lambda: ImageFunc.convert_intensity(img, coeff=1.3), **_kwargs)
+
+    # fit window
+    img_data = ImageCvData(img, img_h, img_w)
+
+    def _fit():
+        img_data._img_src = img
+        img_data._fit_window()
+
+    res['ImageCvData._fit_window'] = time_stats(_fit, **_kwargs)
+
+    # mouse readout
+    def _info():
+        info = ImageInfo()
+        info.img = img_data.img_fit
+        info.fit_ratio = img_data.fit_ratio
+        info.gui_x = img_data.img_fit.shape[1] // 2
+        info.gui_y = img_data.img_fit.shape[0] // 2
+        info.calc_params()
+
+    res['ImageInfo.calc_params'] = time_stats(_info, **_kwargs)
+
+    # profile/histogram
+    _cy = img.shape[0] // 2
+    _cx = img.shape[1] // 2
+    res['check_profile(hor)'] = time_stats(lambda: ImageFunc.check_profile(img, _cx, _cy, direction='hor'),
+                                           **_kwargs)
+    res['check_profile(ver)'] = time_stats(lambda: ImageFunc.check_profile(img, _cx, _cy, direction='ver'),
+                                           **_kwargs)
+    res['check_histgram(quarter)'] = time_stats(lambda: ImageFunc.check_histgram(img, _cx // 2, _cx + _cx // 2,
+                                                                                 _cy // 2, _cy + _cy // 2),
+                                                **_kwargs)
+    if img.dtype == np.uint8:
+        res['check_histgram(quarter, hsv)'] = time_stats(lambda: ImageFunc.check_histgram(img, _cx // 2, _cx + _cx // 2,
+                                                                                          _cy // 2, _cy + _cy // 2,
+                                                                                          hsv=True),
+                                                         **_kwargs)
+
+    # display window(auto) and conversion of the fit image
+    _window = DisplayWindow()
+    res['DisplayWindow.get_range'] = time_stats(lambda: _window.get_range(img_data.img_fit), **_kwargs)
+    _low, _high = _window.get_range(img_data.img_fit)
+    res['apply_window'] = time_stats(lambda: apply_window(img_data.img_fit, _low, _high), **_kwargs)
+
+    _img_fit = apply_window(img_data.img_fit, _low, _high)
+    res['img_cv2pil'] = time_stats(lambda: img_cv2pil(_img_fit), **_kwargs)
+    if tk_root is not None:
+        res['img_cv2tk'] = time_stats(lambda: img_cv2tk(_img_fit), **_kwargs)
+
+    return res
+
+
+def bench_tile_convert(img_h: int = 700, img_w: int = 1000, repeat: int = 50, max_sec: float = 2.0,
+                       tk_root=None) -> dict:
+    """
+    1タイルあたりの表示変換: img_cv2pil(BGR->RGB->PIL->RGB) vs タイルごとのバッファへの変換(to_pil_buffer)。
+    Tkがある場合はPhotoImageの新規作成 vs 既存のPhotoImageへの貼り付けも計測
+
+    :return: {カラー/グレー: 計測項目ごとの実行時間(time_statsの結果)}
+    """
+    _kwargs = {"repeat": repeat, "max_sec": max_sec}
+    _imgs = {"bgr": make_image(img_h, img_w, 8, 3),
+             "gray": make_image(img_h, img_w, 8, 1)}
+
+    res = {}
+    for _name, _img in _imgs.items():
+        _res = {}
+        _buf = [None]
+
+        def _to_pil():
+            _, _buf[0] = to_pil_buffer(_img, _buf[0])
+
+        _res['img_cv2pil'] = time_stats(lambda: img_cv2pil(_img), **_kwargs)
+        _res['to_pil_buffer'] = time_stats(_to_pil, **_kwargs)
+
+        if tk_root is not None:
+            _grid = TileGrid(tk_root, 1, 1, img_h, img_w)
+            _res['img_cv2tk(new photo)'] = time_stats(lambda: img_cv2tk(_img), **_kwargs)
+            _res['TileGrid.set_image_cv(paste)'] = time_stats(lambda: _grid.set_image_cv(0, '0', _img), **_kwargs)
+            _grid.destroy()
+
+        res[_name] = _res
+    return res
+
+
+def get_meta() -> dict:
+    """
+    計測環境(比較用)
+    """
+    _commit = None
+    try:
+        _commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        pass
+
+    res = {"commit": _commit,
+           "date": time.strftime('%Y-%m-%dT%H:%M:%S'),
+           "python": platform.python_version(),
+           "platform": platform.platform(),
+           "cpu_count": os.cpu_count(),
+           "opencv": cv2.__version__,
+           "numpy": np.__version__,
+           }
+    return res
+
+
+def run_suite(corpus_dir: str, sizes_mp=CORPUS_SIZES_MP, depths=CORPUS_DEPTHS,
+              channels=CORPUS_CHANNELS, formats=CORPUS_FORMATS,
+              repeat: int = 20, max_sec: float = 2.0, log: bool = True) -> dict:
+    """
+    コーパスの全画像を計測
+
+    :return: {"meta": 計測環境, "results": [{"case": 画像の条件, "timings": 計測結果}]}
+    """
+    _corpus = make_corpus(corpus_dir, sizes_mp, depths, channels, formats)
+    _tk_root = _get_tk_root()
+
+    res = {"meta": get_meta(), "results": []}
+    res["meta"]["tk"] = _tk_root is not None
+    res["tile_convert"] = bench_tile_convert(repeat=repeat, max_sec=max_sec, tk_root=_tk_root)
+    for _entry in _corpus:
+        if log:
+            print(f'{os.path.basename(_entry["path"])} ...', flush=True)
+        _timings = bench_image(_entry, repeat=repeat, max_sec=max_sec, tk_root=_tk_root)
+        _case = {_k: _v for _k, _v in _entry.items() if _k != 'path'}
+        _case["file"] = os.path.basename(_entry["path"])
+        res["results"].append({"case": _case, "timings": _timings})
+
+    if _tk_root is not None:
+        _tk_root.destroy()
+
+    return res
+
+
+def compare_results(old: dict, new: dict, threshold: float = 1.1, min_diff_msec: float = 0.5) -> list:
+    """
+    2つの計測結果(run_suiteの結果)の中央値を比較
+
+    :param threshold: 遅くなったと判定する比(new / old)
+    :param min_diff_msec: 遅くなったと判定する差[msec](計測誤差の除外)
+    :return: (画像, 計測項目, old[msec], new[msec], 比)のうち、threshold以上のもの
+    """
+    _old = {(_res["case"]["file"], _name): _t["median_msec"]
+            for _res in old["results"] for _name, _t in _res["timings"].items()}
+
+    res = []
+    for _res in new["results"]:
+        for _name, _t in _res["timings"].items():
+            _key = (_res["case"]["file"], _name)
+            if _key not in _old or _old[_key] <= 0:
+                continue
+            _ratio = _t["median_msec"] / _old[_key]
+            if _ratio >= threshold and _t["median_msec"] - _old[_key] >= min_diff_msec:
+                res.append((_key[0], _name, _old[_key], _t["median_msec"], _ratio))
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ビューアの主要な処理の計測(GUIなし、合成画像)')
+    parser.add_argument('--corpus', default=os.path.join('bench_corpus'), help='合成画像のホルダ')
+    parser.add_argument('--sizes', type=float, nargs='+', default=CORPUS_SIZES_MP, help='画素数[MP]')
+    parser.add_argument('--depths', type=int, nargs='+', default=CORPUS_DEPTHS, choices=[8, 16])
+    parser.add_argument('--channels', type=int, nargs='+', default=CORPUS_CHANNELS, choices=[1, 3])
+    parser.add_argument('--formats', nargs='+', default=CORPUS_FORMATS, choices=list(CORPUS_FORMATS))
+    parser.add_argument('--repeat', type=int, default=20, help='最大の繰り返し回数')
+    parser.add_argument('--max-sec', type=float, default=2.0, help='1項目あたりの計測時間の上限[sec]')
+    parser.add_argument('--out', default=None, help='結果の出力先(JSON)')
+    parser.add_argument('--compare', default=None, help='比較する過去の結果(JSON)')
+    parser.add_argument('--mouse', action='store_true', help='マウス情報のHSV変換のみ計測')
+    parser.add_argument('--convert', action='store_true', help='1タイルあたりの表示変換のみ計測')
+    args = parser.parse_args()
+
+    if args.mouse:
+        res = bench_mouse_info()
+        print(f'mouse-info(whole image hsv): {res["before_usec"]:.1f} usec/event')
+        print(f'mouse-info(pixel hsv):       {res["after_usec"]:.1f} usec/event')
+        return 0
+
+    if args.convert:
+        _tk_root = _get_tk_root()
+        res = bench_tile_convert(repeat=args.repeat, max_sec=args.max_sec, tk_root=_tk_root)
+        for _name, _timings in res.items():
+            print(_name)
+            for _func, _t in _timings.items():
+                print(f'  {_func}: {_t["median_msec"]:.2f} msec/tile')
+        if _tk_root is not None:
+            _tk_root.destroy()
+        return 0
+
+    _sizes = [int(_mp) if float(_mp).is_integer() else _mp for _mp in args.sizes]
+    res = run_suite(args.corpus, _sizes, args.depths, args.channels, args.formats,
+                    repeat=args.repeat, max_sec=args.max_sec)
+
+    for _res in res["results"]:
+        print(_res["case"]["file"])
+        for _name, _t in _res["timings"].items():
+            print(f'  {_name}: {_t["median_msec"]:.2f} msec')
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(res, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            _old = json.load(f)
+        _slower = compare_results(_old, res)
+        print(f'\nslower than {args.compare}: {len(_slower)}')
+        for _file, _name, _t_old, _t_new, _ratio in _slower:
+            print(f'  {_file} {_name}: {_t_old:.2f} -> {_t_new:.2f} msec (x{_ratio:.2f})')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+
+from dir_scanner import iter_img_paths
+from img_cache import imread
+from preprocess import PreprocParams, img_preproc
+
+BLOB_FIELDS = ('path', 'blob', 'area_px', 'area_um2', 'cx_um', 'cy_um', 'x_um', 'y_um', 'w_um', 'h_um')
+SUMMARY_FIELDS = ('path', 'blobs', 'total_area_px', 'total_area_um2', 'error')
+
+
+class BlobResult:
+    """
+    二値画像の連結成分(ブロブ)の解析結果。面積がmin_area未満のブロブは除外する
+    """
+
+    def __init__(self, labels, stats, centroids, min_area: int = 0):
+        """
+        :param labels: ラベル画像(0は背景)
+        :param stats: cv2.connectedComponentsWithStatsのstats
+        :param centroids: cv2.connectedComponentsWithStatsのcentroids
+        :param min_area: 最小面積[pix]
+        """
+        self.labels = labels
+        self.stats = stats
+        self.centroids = centroids
+        self.min_area = min_area
+
+        # labels of the blobs kept by the area filter
+        self.keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area) + 1
+
+    def __len__(self):
+        return len(self.keep)
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + self.stats.nbytes + self.centroids.nbytes
+
+    @property
+    def total_area(self) -> int:
+        return int(self.stats[self.keep, cv2.CC_STAT_AREA].sum())
+
+    def find(self, x, y) -> int:
+        """
+        画素(x, y)のブロブのラベル。背景/除外したブロブの場合は0
+        """
+        if not (0 <= y < self.labels.shape[0] and 0 <= x < self.labels.shape[1]):
+            return 0
+        _label = int(self.labels[int(y), int(x)])
+        if _label == 0 or self.stats[_label, cv2.CC_STAT_AREA] < self.min_area:
+            return 0
+        return _label
+
+    def get_blob(self, label: int, pix2um: float = 1.0) -> dict:
+        """
+        ブロブの面積、重心、外接矩形(pix2um単位)
+        """
+        _x, _y, _w, _h, _area = self.stats[label]
+        _cx, _cy = self.centroids[label]
+        res = {"blob": int(label),
+               "area_px": int(_area),
+               "area_um2": _area * pix2um ** 2,
+               "cx_um": _cx * pix2um,
+               "cy_um": _cy * pix2um,
+               "x_um": _x * pix2um,
+               "y_um": _y * pix2um,
+               "w_um": _w * pix2um,
+               "h_um": _h * pix2um,
+               }
+        return res
+
+    def get_blobs(self, pix2um: float = 1.0) -> list:
+        return [self.get_blob(_label, pix2um) for _label in self.keep]
+
+    def get_boxes(self):
+        """
+        外接矩形(x, y, w, h)の配列
+        """
+        return self.stats[self.keep, :4]
+
+
+def analyze_blobs(img_bin, min_area: int = 0, connectivity: int = 8) -> BlobResult:
+    """
+    二値画像(0以外を前景)の連結成分を解析
+
+    :param img_bin: 二値画像(単一チャンネル)
+    :param min_area: 最小面積[pix]
+    :param connectivity: 4 or 8
+    """
+    _img = np.asarray(img_bin)
+    if _img.ndim != 2:
+        raise ValueError('blob analysis needs a single-channel(thresholded) image')
+    if _img.dtype != np.uint8:
+        _img = (_img != 0).astype(np.uint8)
+
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(_img, connectivity=connectivity,
+                                                                   ltype=cv2.CV_32S)
+    return BlobResult(labels, stats, centroids, min_area=min_area)
+
+
+def format_blobs(result: BlobResult, pix2um: float = 1.0, label: int = 0) -> str:
+    """
+    ブロブの集計(個数、面積)と選択したブロブの表示用テキスト
+    """
+    _areas = result.stats[result.keep, cv2.CC_STAT_AREA] * pix2um ** 2
+    _lines = [f'blobs: {len(result)} (min area: {result.min_area} pix)']
+    if len(_areas) > 0:
+        _lines.append(f'total area: {_areas.sum():.6g} um2')
+        _lines.append(f'area mean: {_areas.mean():.6g}  max: {_areas.max():.6g} um2')
+
+    if label > 0:
+        _blob = result.get_blob(label, pix2um)
+        _lines += ['',
+                   f'[blob {_blob["blob"]}]',
+                   f'area: {_blob["area_px"]} pix ({_blob["area_um2"]:.6g} um2)',
+                   f'centroid: ({_blob["cx_um"]:.1f}, {_blob["cy_um"]:.1f})',
+                   f'box: ({_blob["x_um"]:.1f}, {_blob["y_um"]:.1f}) '
+                   f'{_blob["w_um"]:.1f} x {_blob["h_um"]:.1f}']
+
+    return '\n'.join(_lines)
+
+
+def blob_file(img_path: str, params: PreprocParams, min_area: int = 0, pix2um: float = 1.0,
+              flags: int = cv2.IMREAD_COLOR) -> dict:
+    """
+    1枚分の処理: 読込 -> 前処理(二値化) -> 連結成分の解析。ワーカープロセスで実行
+
+    :param flags: cv2.imreadのフラグ
+    :return: ブロブのリストとエラー
+    """
+    res = {"path": img_path, "error": None, "blobs": []}
+
+    try:
+        img = imread(img_path, flags)
+        if img is None:
+            raise ValueError('cannot read image')
+
+        img = img_preproc(img, params)
+        res["blobs"] = analyze_blobs(img, min_area=min_area).get_blobs(pix2um)
+
+    except Exception as err:
+        res["error"] = str(err)
+
+    return res
+
+
+def run_blob_batch(img_paths, csv_path: str, params: PreprocParams,
+                   min_area: int = 0, pix2um: float = 1.0, summary_path: str = None,
+                   workers: int = None, max_inflight: int = None,
+                   progress=None, is_cancelled=None, flags: int = cv2.IMREAD_COLOR) -> dict:
+    """
+    全画像の連結成分を並列に解析し、ブロブごとにCSVへ出力
+
+    :param img_paths: 画像パスのリスト(イテレータ可)
+    :param csv_path: ブロブごとのCSV
+    :param params: 前処理条件(単一チャンネル化、二値化)
+    :param min_area: 最小面積[pix]
+    :param pix2um: 1画素の長さ[um]
+    :param summary_path: 画像ごとの集計CSV。Noneの場合は出力しない
+    :param workers: プロセス数
+    :param max_inflight: 同時に投入する最大の処理数
+    :param progress: 処理した枚数ごとに呼ぶ関数(枚数, 失敗数)
+    :param is_cancelled: 処理中止を判定する関数
+    :param flags: cv2.imreadのフラグ(16bit/float: cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH)
+    :return: 処理結果のレポート
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_inflight is None:
+        max_inflight = workers * 4
+
+    _failures = []
+    _num = 0
+    _num_blobs = 0
+    _cancelled = False
+
+    _f_blob = open(csv_path, 'w', newline='')
+    _f_summary = open(summary_path, 'w', newline='') if summary_path is not None else None
+    try:
+        _writer = csv.DictWriter(_f_blob, fieldnames=BLOB_FIELDS)
+        _writer.writeheader()
+        _summary = None
+        if _f_summary is not None:
+            _summary = csv.DictWriter(_f_summary, fieldnames=SUMMARY_FIELDS)
+            _summary.writeheader()
+
+        def _collect(futures):
+            nonlocal _num, _num_blobs
+            for _future in futures:
+                _res = _future.result()
+                _num += 1
+                _num_blobs += len(_res["blobs"])
+                if _res["error"] is not None:
+                    _failures.append({"path": _res["path"], "error": _res["error"]})
+
+                for _blob in _res["blobs"]:
+                    _writer.writerow({"path": _res["path"], **_blob})
+                if _summary is not None:
+                    _summary.writerow({"path": _res["path"],
+                                       "blobs": len(_res["blobs"]),
+                                       "total_area_px": sum(_b["area_px"] for _b in _res["blobs"]),
+                                       "total_area_um2": sum(_b["area_um2"] for _b in _res["blobs"]),
+                                       "error": _res["error"] or ''})
+
+                if progress is not None:
+                    progress(_num, len(_failures))
+
+        _t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            _inflight = set()
+            for _img_path in img_paths:
+                if is_cancelled is not None and is_cancelled():
+                    _cancelled = True
+                    break
+
+                # bounded in-flight work
+                if len(_inflight) >= max_inflight:
+                    _done, _inflight = wait(_inflight, return_when=FIRST_COMPLETED)
+                    _collect(_done)
+
+                _inflight.add(executor.submit(blob_file, _img_path, params, min_area, pix2um, flags))
+
+            _collect(wait(_inflight).done)
+
+        _elapsed = time.perf_counter() - _t0
+
+    finally:
+        _f_blob.close()
+        if _f_summary is not None:
+            _f_summary.close()
+
+    res = {"csv": csv_path,
+           "summary": summary_path,
+           "images": _num,
+           "blobs": _num_blobs,
+           "failures": _failures,
+           "cancelled": _cancelled,
+           "elapsed_sec": _elapsed,
+           "images_per_sec": _num / _elapsed if _elapsed > 0 else 0.0,
+           }
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='二値化した画像の連結成分(面積、重心、外接矩形)をCSVに出力(GUIなし)')
+    parser.add_argument('dir', help='入力ホルダ')
+    parser.add_argument('csv', help='出力CSV(ブロブごと)')
+    parser.add_argument('--summary', default=None, help='画像ごとの集計CSV')
+    parser.add_argument('--key', default='*.*', help='ファイル名のパターン')
+    parser.add_argument('--color', default='gray',
+                        choices=['gray', 'blue', 'green', 'red', 'h', 's', 'v'])
+    parser.add_argument('--thres', type=int, nargs=2, metavar=('LOWER', 'UPPER'), required=True,
+                        help='二値化の閾値')
+    parser.add_argument('--min-area', type=int, default=0, help='最小面積[pix]')
+    parser.add_argument('--pix2um', type=float, default=1.0, help='1画素の長さ[um]')
+    parser.add_argument('--workers', type=int, default=None, help='プロセス数')
+    parser.add_argument('--high-depth', action='store_true', help='16bit/floatのまま読み込む')
+    args = parser.parse_args()
+
+    params = PreprocParams(color=args.color,
+                           thres_flg=True,
+                           thres={"mode": 'single',
+                                  "value_inverse": False,
+                                  "value_lower": args.thres[0],
+                                  "value_upper": args.thres[1],
+                                  })
+
+    res = run_blob_batch(iter_img_paths(args.dir, args.key), args.csv, params,
+                         min_area=args.min_area,
+                         pix2um=args.pix2um,
+                         summary_path=args.summary,
+                         workers=args.workers,
+                         flags=cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH if args.high_depth else cv2.IMREAD_COLOR)
+
+    print(f'images: {res["images"]}, blobs: {res["blobs"]}, failures: {len(res["failures"])}')
+    print(f'elapsed: {res["elapsed_sec"]:.2f} sec, {res["images_per_sec"]:.1f} images/s')
+    for _failure in res["failures"]:
+        print(f'  failed: {_failure["path"]}: {_failure["error"]}')
+
+    return 0 if len(res["failures"]) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
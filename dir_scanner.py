@@ -0,0 +1,123 @@
+import os
+import queue
+import fnmatch
+import threading
+
+# extensions readable by cv2.imread, and numpy arrays
+IMG_EXTS = ('.bmp', '.dib', '.jpg', '.jpeg', '.jpe', '.jp2', '.png', '.webp',
+            '.pbm', '.pgm', '.ppm', '.pxm', '.pnm', '.sr', '.ras',
+            '.tif', '.tiff', '.exr', '.hdr', '.pic', '.npy')
+
+
+def iter_img_paths(dir: str, img_key: str = '*.*', is_cancelled=None):
+    """
+    ホルダ以下の画像ファイルを探索(glob.glob(f'{dir}/**/{img_key}', recursive=True)相当)。
+    os.scandirで逐次探索し、画像の拡張子のみ返す
+
+    :param dir: 探索するホルダ
+    :param img_key: ファイル名のパターン
+    :param is_cancelled: 探索中止を判定する関数
+    :return: 画像パスのイテレータ
+    """
+    _match_path = '/' in img_key or os.sep in img_key
+    _show_hidden = img_key.startswith('.')
+
+    _dirs = [dir]
+    while len(_dirs) > 0:
+        if is_cancelled is not None and is_cancelled():
+            return
+
+        _dir = _dirs.pop()
+        try:
+            _entries = list(os.scandir(_dir))
+        except OSError:
+            continue
+
+        _sub_dirs = []
+        for _entry in _entries:
+            # like glob: skip hidden files/dirs
+            if _entry.name.startswith('.') and not _show_hidden:
+                continue
+
+            try:
+                if _entry.is_dir():
+                    _sub_dirs.append(_entry.path)
+                    continue
+            except OSError:
+                continue
+
+            if not _entry.name.lower().endswith(IMG_EXTS):
+                continue
+
+            if _match_path:
+                _rel_path = os.path.relpath(_entry.path, dir)
+                if not fnmatch.fnmatch(_rel_path, img_key) and not fnmatch.fnmatch(_rel_path, f'*/{img_key}'):
+                    continue
+            elif not fnmatch.fnmatch(_entry.name, img_key):
+                continue
+
+            yield _entry.path
+
+        # depth-first, in scandir order
+        _dirs.extend(reversed(_sub_dirs))
+
+
+class DirScanner:
+    """
+    画像ファイルの探索をバックグラウンドで行うクラス。
+    探索結果はbatch_sizeごとにキューへ格納し、Tkスレッドからpopで取り出す。
+    """
+
+    def __init__(self, dir: str, img_key: str = '*.*', batch_size: int = 200):
+        self.dir = dir
+        self.img_key = img_key
+        self.batch_size = batch_size
+
+        self.count = 0
+        self.is_done = False
+
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._scan, name='dir_scanner', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def pop(self) -> list:
+        """
+        探索済みの画像パスを取り出す
+        """
+        _paths = []
+        while True:
+            try:
+                _paths.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return _paths
+
+    def _scan(self):
+        _batch = []
+        try:
+            for _path in iter_img_paths(self.dir, self.img_key, self.is_cancelled):
+                _batch.append(_path)
+                self.count += 1
+
+                if len(_batch) >= self.batch_size:
+                    self._queue.put(_batch)
+                    _batch = []
+        except Exception as err:
+            print(err)
+
+        if len(_batch) > 0:
+            self._queue.put(_batch)
+        self.is_done = True
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,151 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+WINDOW_MODES = ('full', 'auto', 'manual')
+
+# float images are quantized to 16bit in [low, high] before the LUT
+_FLOAT_LEVELS = 65536
+
+
+@lru_cache(maxsize=32)
+def make_lut(low: float, high: float, gamma: float = 1.0, size: int = 65536) -> np.array:
+    """
+    画素値 -> 表示値(8bit)のLUT。[low, high]を0-255へ線形に割り当て、ガンマ補正(x^(1/gamma))する。
+    同じ条件のLUTは使い回す(書込不可)
+
+    :param low: 0とする画素値
+    :param high: 255とする画素値
+    :param gamma: ガンマ(1より大きいと明るくなる)
+    :param size: 要素数(8bit: 256, 16bit: 65536)
+    :return: uint8のLUT
+    """
+    _vals = np.arange(size, dtype=np.float64)
+    _x = np.clip((_vals - low) / max(high - low, 1e-12), 0.0, 1.0)
+    if gamma != 1.0:
+        _x = _x ** (1.0 / gamma)
+
+    lut = np.round(_x * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_window(img: np.array, low: float, high: float, gamma: float = 1.0) -> np.array:
+    """
+    表示用に8bitへ変換。8bitはcv2.LUT、16bitは65536要素のLUTをnp.takeで参照し、浮動小数点の演算は行わない。
+    その他(float, int32, ...)は[low, high]を16bitへ量子化してからLUTで変換する。
+    8bitで変換が不要(0-255, gamma=1)の場合は入力をそのまま返す
+
+    :param img: 画像(単一チャンネルまたはBGR)
+    :param low: 0とする画素値
+    :param high: 255とする画素値
+    :param gamma: ガンマ
+    :return: 8bit画像
+    """
+    if img is None:
+        return None
+
+    if img.dtype == np.uint8:
+        if low == 0 and high == 255 and gamma == 1.0:
+            return img
+        return cv2.LUT(img, make_lut(float(low), float(high), float(gamma), 256))
+
+    if img.dtype == np.uint16:
+        return np.take(make_lut(float(low), float(high), float(gamma), 65536), img)
+
+    _scale = (_FLOAT_LEVELS - 1) / max(high - low, 1e-12)
+    _img = (img.astype(np.float32, copy=False) - np.float32(low)) * np.float32(_scale)
+    np.clip(_img, 0, _FLOAT_LEVELS - 1, out=_img)
+    np.nan_to_num(_img, copy=False, nan=0.0)
+    return np.take(make_lut(0.0, float(_FLOAT_LEVELS - 1), float(gamma), _FLOAT_LEVELS),
+                   _img.astype(np.uint16))
+
+
+def _sample(img, max_samples: int):
+    """
+    画素を間引いて取得(範囲の算出用)
+    """
+    _img = np.asarray(img)
+    _num = _img.shape[0] * _img.shape[1]
+    _step = max(int(np.ceil(np.sqrt(_num / max_samples))), 1) if max_samples else 1
+    return _img[::_step, ::_step]
+
+
+def full_range(img) -> tuple:
+    """
+    型の範囲(整数)または有限値の最小/最大(浮動小数点)
+    """
+    if np.issubdtype(img.dtype, np.integer):
+        _info = np.iinfo(img.dtype)
+        return float(_info.min), float(_info.max)
+
+    _vals = np.asarray(img)
+    _vals = _vals[np.isfinite(_vals)]
+    if _vals.size == 0:
+        return 0.0, 1.0
+    return float(_vals.min()), float(_vals.max())
+
+
+def auto_range(img, percentiles=(0.5, 99.5), max_samples: int = 1 << 20) -> tuple:
+    """
+    画素値のパーセンタイルから表示範囲を算出(全チャンネル共通)。大きな画像は間引いて算出
+
+    :param img: 画像
+    :param percentiles: (下限, 上限)[%]
+    :param max_samples: 使用する最大の画素数
+    :return: (low, high)
+    """
+    _vals = _sample(img, max_samples).ravel()
+
+    if _vals.dtype in (np.uint8, np.uint16) and _vals.size > 0:
+        # integer: cumulative histogram instead of sorting
+        _cum = np.cumsum(np.bincount(_vals))
+        _low, _high = (float(np.searchsorted(_cum, _cum[-1] * _p / 100, side='left')) for _p in percentiles)
+    else:
+        _vals = _vals[np.isfinite(_vals)]
+        if _vals.size == 0:
+            return 0.0, 1.0
+        _low, _high = (float(_v) for _v in np.percentile(_vals, percentiles))
+
+    if _high <= _low:
+        _high = _low + 1
+    return _low, _high
+
+
+class DisplayWindow:
+    """
+    表示の階調変換(ウインドウ)の条件。画素値ではなく表示のみを変換する
+    full: 型の範囲(float: 最小/最大)、auto: パーセンタイル、manual: low/highを指定。
+    8bit画像はmanualの場合のみ範囲を変更する(ガンマは常に適用)
+    """
+
+    def __init__(self, mode: str = 'auto', low: float = 0.0, high: float = 65535.0, gamma: float = 1.0,
+                 percentiles=(0.5, 99.5)):
+        if mode not in WINDOW_MODES:
+            raise ValueError(f'illegal window mode: {mode}')
+
+        self.mode = mode
+        self.low = low
+        self.high = high
+        self.gamma = gamma
+        self.percentiles = tuple(percentiles)
+
+    def get_key(self):
+        return self.mode, self.low, self.high, self.percentiles
+
+    def get_range(self, img) -> tuple:
+        """
+        画像の表示範囲(low, high)
+        """
+        if self.mode == 'manual':
+            return self.low, self.high
+        if img is None or img.dtype == np.uint8:
+            return 0.0, 255.0
+        if self.mode == 'auto':
+            return auto_range(img, self.percentiles)
+        return full_range(img)
+
+
+if __name__ == '__main__':
+    pass
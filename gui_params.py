@@ -1,3 +1,5 @@
+import os
+
 import cv2
 import tkinter
 from tkinter import ttk
@@ -15,6 +17,12 @@ def draw_cross(img, x, y, line_thick=2, line_color=(255, 0, 0)):
     return img
 
 
+def draw_line(img, x0, x1, y0, y1, line_thick=2, line_color=(255, 0, 0)):
+    cv2.line(img, (x0, y0), (x1, y1), color=line_color, thickness=line_thick)
+
+    return img
+
+
 def draw_rectangle(img, x0, x1, y0, y1, line_thick=2, line_color=(255, 0, 0)):
     _img_h = img.shape[0]
     line_thick = int(line_thick *_img_h / 500)
@@ -35,6 +43,79 @@ class GuiParams:
 
         self.topmost = False
 
+        # decoded-image cache
+        self.cache_max_mb = 1024
+
+        # zoom: margin around the zoom area for the image process [pix]
+        self.zoom_margin = 0
+
+        # memoized preprocess stages
+        self.preproc_cache_mb = 512
+
+        # background prefetch
+        self.prefetch_pages = 2
+        self.prefetch_workers = 2
+
+        # parallel tile loading in a page
+        self.tile_workers = 4
+
+        # on-disk thumbnail cache
+        self.thumb_cache_flg = True
+        self.thumb_cache_path = os.path.join(os.path.expanduser('~'), '.cache', 'image_viewer', 'thumbs.sqlite')
+        self.thumb_cache_max_mb = 1024
+
+        # directory scan: number of paths per batch
+        self.scan_batch_size = 200
+
+        # large images(NPY/TIFF): read only the visible region
+        self.lazy_load_mb = 256
+        self.tile_cache_mb = 512
+
+        # wheel zoom/pan: pyramid tiles, max scale(display pix/image pix), wheel step
+        self.pyramid_cache_mb = 256
+        self.zoom_max_scale = 32.0
+        self.zoom_wheel_step = 1.25
+
+        # linked views: one zoom/pan for all images
+        self.linked_views = False
+
+        # profiles: band width(Hor/Ver), line width(Line) [pix], cumulative sums
+        self.profile_width = 20
+        self.profile_line_width = 1
+        self.profile_cache_mb = 512
+
+        # update profile/histogram windows while moving/dragging the mouse
+        self.live_graph = True
+
+        # rectangle histograms: block-histogram index(block size [pix], memory)
+        self.hist_index_flg = True
+        self.hist_index_block = 64
+        self.hist_index_mb = 256
+
+        # rectangle statistics: percentiles[%], foreground range(lower, upper) without threshold params
+        self.stats_percentiles = (1, 5, 25, 50, 75, 95, 99)
+        self.stats_thres = (128, 255)
+
+        # blobs: min area[pix], max size of the label image, boxes drawn per tile, export workers(None: all cpus)
+        self.blob_min_area = 0
+        self.blob_max_mb = 1024
+        self.blob_draw_max = 5000
+        self.blob_workers = None
+
+        # timing spans: record, readout in the side panel(update interval [msec])
+        self.perf_trace_flg = True
+        self.perf_overlay = False
+        self.perf_overlay_msec = 500
+
+        # high bit depth(16bit, float): loaded as is, displayed through a window
+        # (full/auto(percentiles[%])/manual(low, high)) and gamma
+        self.high_depth = True
+        self.display_window = 'auto'
+        self.display_percentiles = (0.5, 99.5)
+        self.display_low = 0
+        self.display_high = 4095
+        self.display_gamma = 1.0
+
         self.gui_type = None
         self.x0 = None
         self.y0 = None
@@ -81,6 +162,11 @@ class GuiParams:
                 img = draw_cross(img, self.x0, self.y0)
             return img
 
+        elif self.gui_type.lower() == 'line':
+            if self._set_pos0_flg and self._set_pos1_flg:
+                img = draw_line(img, self.x0, self.x1, self.y0, self.y1)
+            return img
+
         elif self.gui_type.lower() == 'rectangle':
             if self._set_pos0_flg and self._set_pos1_flg:
                 img = draw_rectangle(img, self.x0, self.x1, self.y0, self.y1)
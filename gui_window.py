@@ -1,16 +1,32 @@
 import cv2
+import numpy as np
 import tkinter
 from tkinter import ttk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
 
 
+def _to_number(text):
+    """
+    入力値を数値へ変換。整数の場合はint(float画像の閾値は小数も可)
+    """
+    _val = float(text)
+    return int(_val) if _val.is_integer() else _val
+
+
 class ParamsForSingleChannel:
-    def __init__(self):
+    def __init__(self, max_value=255):
+        """
+        :param max_value: 画素値の最大(8bit: 255, 16bit: 65535, float: 1.0)。初期値の算出に使用
+        """
         self.mode = 'single'
         self.val = Param()
-        self.val.set_params(lower=125,
-                            upper=255,
+
+        _lower = max_value * 125 / 255
+        if isinstance(max_value, int):
+            _lower = int(round(_lower))
+        self.val.set_params(lower=_lower,
+                            upper=max_value,
                             inverse=False)
 
     def get_result_dict(self):
@@ -119,11 +135,15 @@ class ParamWindow:
 
 
 class ParamWindowForSingleChannel(ParamWindow):
-    def __init__(self, parent):
+    def __init__(self, parent, max_value=255):
+        """
+        :param max_value: 画素値の最大。閾値は画像の値(16bit: 0-65535など)で指定する
+        """
         super().__init__(parent)
 
         ParamWindow.root.geometry('200x200')
-        self.param = ParamsForSingleChannel()
+        self.max_value = max_value
+        self.param = ParamsForSingleChannel(max_value)
         self.params_dict = self.param.get_result_dict()
 
         # parts
@@ -152,11 +172,11 @@ class ParamWindowForSingleChannel(ParamWindow):
             _lower = self.entry_lower.get()
 
             try:
-                _upper = int(_upper)
+                _upper = _to_number(_upper)
             except:
                 _upper = self.param.val.upper
             try:
-                _lower = int(_lower)
+                _lower = _to_number(_lower)
             except:
                 _lower = self.param.val.lower
 
@@ -177,7 +197,7 @@ class ParamWindowForSingleChannel(ParamWindow):
             self.params_dict = self.param.get_result_dict()
 
         # Label
-        label = tkinter.Label(self.frame, text='Value')
+        label = tkinter.Label(self.frame, text=f'Value (0-{self.max_value})')
         label.grid(row=0, column=0, sticky=tkinter.W)
 
         # CheckBOX
@@ -234,12 +254,16 @@ class GraphViewer:
     def __init__(self, parent, singleton=True):
         self.singleton = singleton
 
+        # window created by this instance(singleton: None when the shared window is reused)
+        self._root = None
+
         if singleton and not GraphViewer.is_exist:
             GraphViewer.root = tkinter.Toplevel(parent)
             GraphViewer.root.title('Viewer')
             GraphViewer.root.attributes('-topmost', True)
             GraphViewer.root.protocol('WM_DELETE_WINDOW', self.exit)
             GraphViewer.is_exist = True
+            self._root = GraphViewer.root
 
         elif singleton:
             children = GraphViewer.root.winfo_children()
@@ -264,17 +288,10 @@ class GraphViewer:
 
         self.frame.pack()
 
-    def __del__(self):
-        self.exit()
-
     def start(self):
+        # runs inside the main window's mainloop: no nested mainloop
         self.canvas.draw()
 
-        if self.singleton:
-            GraphViewer.root.mainloop()
-        else:
-            self.root.mainloop()
-
     def set_btn(self, command, btn_name='Button'):
         btn = tkinter.Button(self.frame,
                              text=btn_name,
@@ -283,21 +300,128 @@ class GraphViewer:
         btn.pack(fill=tkinter.BOTH, anchor=tkinter.W, pady=5)
 
     def exit(self):
+        """
+        このインスタンスが作成したウインドウのみ閉じる(後から作成された共有ウインドウは閉じない)
+        """
         try:
             if self.singleton:
-                GraphViewer.is_exist = False
-                GraphViewer.root.destroy()
+                if self._root is None:
+                    return
+                if GraphViewer.root is self._root:
+                    GraphViewer.is_exist = False
+                self._root.destroy()
             else:
                 self.root.destroy()
         except Exception:
             pass
 
 
-class ProfileViewer(GraphViewer):
+class LiveGraphViewer(GraphViewer):
+    """
+    データを更新して使い回すグラフの基底クラス。
+    軸とLine2Dを保持し、set_linesでデータのみ更新する。
+    軸の範囲が変わらない場合は、背景を再利用して線のみ描画する(blit)。
+    """
+
+    def __init__(self, parent, singleton=True):
+        super().__init__(parent, singleton)
+
+        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.lines = []
+        self._labels = None
+        self._x_range = None
+        self._background = None
+
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def is_alive(self) -> bool:
+        try:
+            return bool(self.frame.winfo_exists())
+        except tkinter.TclError:
+            return False
+
+    def set_lines(self, x, ys, labels=None, colors=None, linestyles=None):
+        """
+        グラフのデータを更新
+
+        :param x: x座標
+        :param ys: y座標のリスト(線ごと)
+        :param labels: 凡例。Noneの場合は凡例なし
+        :param colors: 線の色
+        :param linestyles: 線種
+        """
+        _labels = tuple(labels) if labels is not None else (None,) * len(ys)
+        _rebuild = len(ys) != len(self.lines) or _labels != self._labels
+
+        if _rebuild:
+            self.ax.clear()
+            self.lines = []
+            for _cnt, _y in enumerate(ys):
+                _kwargs = {"animated": True}
+                if colors is not None: _kwargs['color'] = colors[_cnt]
+                if linestyles is not None: _kwargs['ls'] = linestyles[_cnt]
+                if labels is not None: _kwargs['label'] = labels[_cnt]
+                _line, = self.ax.plot(x, _y, **_kwargs)
+                self.lines.append(_line)
+            if labels is not None:
+                self.ax.legend()
+            self._labels = _labels
+        else:
+            for _line, _y in zip(self.lines, ys):
+                _line.set_data(x, _y)
+
+        # full redraw only when the axes have to change
+        _x_range = (len(x), x[0], x[-1]) if len(x) > 0 else None
+        _y_min = min((np.nanmin(_y) for _y in ys if len(_y) > 0), default=0)
+        _y_max = max((np.nanmax(_y) for _y in ys if len(_y) > 0), default=0)
+        _ylim = self.ax.get_ylim()
+
+        if _rebuild or _x_range != self._x_range or _y_min < _ylim[0] or _y_max > _ylim[1]:
+            self._x_range = _x_range
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self.canvas.draw()
+        else:
+            self._blit()
+
+    def _on_draw(self, event):
+        # background without the lines, then the lines on top
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for _line in self.lines:
+            self.ax.draw_artist(_line)
+
+    def _blit(self):
+        if self._background is None:
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self._background)
+        for _line in self.lines:
+            self.ax.draw_artist(_line)
+        self.canvas.blit(self.ax.bbox)
+
+
+class ProfileViewer(LiveGraphViewer):
     """
     プロファイル表示クラス
-    メインウインドウとは別ウインドウとして開く
+    メインウインドウとは別ウインドウとして開く。showで開いている場合はデータのみ更新
     """
+    instance = None
+
+    @classmethod
+    def show(cls, parent, pos, profile):
+        """
+        プロファイルを表示。ウインドウが開いている場合は使い回す
+        """
+        if cls.instance is None or not cls.instance.is_alive():
+            cls.instance = cls(parent, pos, profile)
+        else:
+            cls.instance.update_profile(pos, profile)
+        return cls.instance
+
+    @classmethod
+    def is_open(cls) -> bool:
+        return cls.instance is not None and cls.instance.is_alive()
 
     def __init__(self,
                  parent,
@@ -306,43 +430,127 @@ class ProfileViewer(GraphViewer):
         super().__init__(parent)
         ProfileViewer.root.title('ProfileViewer')
 
-        self.ax = self.fig.add_subplot(1, 1, 1)
-        self.ax.plot(pos, profile)
+        self.update_profile(pos, profile)
+
+    def update_profile(self, pos, profile):
+        if pos is None or profile is None:
+            return
 
-        self.start()
+        profile = np.asarray(profile)
+        if profile.ndim == 1:
+            self.set_lines(pos, [profile])
+        elif profile.shape[1] == 3:
+            self.set_lines(pos, [profile[:, _ch] for _ch in range(3)], colors=('b', 'g', 'r'))
+        else:
+            self.set_lines(pos, [profile[:, _cnt] for _cnt in range(profile.shape[1])])
 
 
-class HistogramViewer(GraphViewer):
+class HistogramViewer(LiveGraphViewer):
     """
     ヒストグラム表示クラス
-    メインウインドウとは別ウインドウとして開く
+    メインウインドウとは別ウインドウとして開く。showで開いている場合はデータのみ更新
     """
+    instance = None
+
+    @classmethod
+    def show(cls, parent, hist_list, labels=('Blue', 'Green', 'Red'), x=None):
+        """
+        ヒストグラムを表示。ウインドウが開いている場合は使い回す
+
+        :param x: 各binの画素値。Noneの場合は0, 1, 2, ...
+        """
+        if cls.instance is None or not cls.instance.is_alive():
+            cls.instance = cls(parent, hist_list, labels=labels, x=x)
+        else:
+            cls.instance.update_hist(hist_list, labels=labels, x=x)
+        return cls.instance
 
     def __init__(self,
                  parent,
                  hist_list,
                  labels=('Blue', 'Green', 'Red'),
-                 singleton=False):
+                 singleton=False,
+                 x=None):
         super().__init__(parent, singleton)
         if singleton:
             HistogramViewer.root.title('HistogramViewer')
         else:
             self.root.title('HistogramViewer')
 
-        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.update_hist(hist_list, labels=labels, x=x)
+
+    def update_hist(self, hist_list, labels=('Blue', 'Green', 'Red'), x=None):
+        if hist_list is None or len(hist_list) == 0:
+            return
 
         colors = ('b', 'g', 'r')
         linestyles = ('-', ':', '-')
         if len(hist_list) == 1:
             labels = ('value',)
-        for _cnt, _hist in enumerate(hist_list):
-            _max = max(_hist)
-            _hist = _hist / _max
 
-            self.ax.plot(_hist, color=colors[_cnt], label=labels[_cnt], ls=linestyles[_cnt])
+        _hists = []
+        for _hist in hist_list:
+            _hist = np.ravel(_hist).astype(np.float64)
+            _max = _hist.max()
+            _hists.append(_hist / _max if _max > 0 else _hist)
+
+        if x is None or len(x) != len(_hists[0]):
+            x = np.arange(len(_hists[0]))
+
+        self.set_lines(x, _hists,
+                       labels=labels[:len(_hists)],
+                       colors=colors[:len(_hists)],
+                       linestyles=linestyles[:len(_hists)])
 
-        self.ax.legend()
-        self.start()
+
+class StatsViewer:
+    """
+    矩形の統計量を表示するクラス(テキスト)
+    メインウインドウとは別ウインドウとして開く。showで開いている場合はテキストのみ更新
+    """
+    instance = None
+
+    @classmethod
+    def show(cls, parent, text):
+        """
+        統計量を表示。ウインドウが開いている場合は使い回す
+        """
+        if cls.instance is None or not cls.instance.is_alive():
+            cls.instance = cls(parent)
+        cls.instance.msg.set(text)
+        return cls.instance
+
+    @classmethod
+    def is_open(cls) -> bool:
+        return cls.instance is not None and cls.instance.is_alive()
+
+    def __init__(self, parent):
+        self.root = tkinter.Toplevel(parent)
+        self.root.title('StatsViewer')
+        self.root.attributes('-topmost', True)
+        self.root.protocol('WM_DELETE_WINDOW', self.exit)
+
+        self.msg = tkinter.StringVar()
+        _label = tkinter.Label(self.root,
+                               textvariable=self.msg,
+                               justify=tkinter.LEFT,
+                               anchor=tkinter.NW,
+                               font=('Courier', 12),
+                               bg='#ffffff', fg='#000000',
+                               padx=10, pady=10)
+        _label.pack(fill=tkinter.BOTH, expand=True)
+
+    def is_alive(self) -> bool:
+        try:
+            return bool(self.root.winfo_exists())
+        except tkinter.TclError:
+            return False
+
+    def exit(self):
+        try:
+            self.root.destroy()
+        except Exception:
+            pass
 
 
 if __name__ == '__main__':
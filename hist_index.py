@@ -0,0 +1,156 @@
+import time
+
+import cv2
+import numpy as np
+
+HIST_BINS = 256
+
+
+def _convert(img, mode):
+    if mode == 'hsv' and img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    return img
+
+
+def calc_hist(img):
+    """
+    チャンネルごとのヒストグラム(8bit, 256bin)。索引の作成と矩形の統計量(region_stats)で使用
+    """
+    if img.ndim == 2:
+        img = img[:, :, np.newaxis]
+    res = np.zeros((img.shape[2], HIST_BINS), dtype=np.int64)
+    if img.shape[0] == 0 or img.shape[1] == 0:
+        return res
+
+    for _ch in range(img.shape[2]):
+        res[_ch] = cv2.calcHist([np.ascontiguousarray(img[:, :, _ch])], [0], None,
+                                [HIST_BINS], [0, HIST_BINS]).ravel()
+    return res
+
+
+class BlockHistIndex:
+    """
+    矩形ヒストグラム用の索引。画像をblock×blockのブロックに分割し、
+    ブロックごとのヒストグラムを2次元の累積和として保持する。
+    任意の矩形は、内側のブロックを累積和の差分(256bin)、端の余りを直接集計して厳密に算出するため、
+    計算量は矩形の面積ではなく周囲長に比例する。8bit画像のみ対応
+    """
+
+    def __init__(self, img, mode: str = 'bgr', block: int = 64):
+        """
+        :param img: 画像(numpy配列またはLazyImage)。8bitのみ
+        :param mode: bgr(画素値のまま), hsv(HSVへ変換)
+        :param block: ブロックサイズ[pix]
+        """
+        self.img = img
+        self.mode = mode
+        self.block = block
+
+        self.img_h = img.shape[0]
+        self.img_w = img.shape[1]
+        self.num_ch = img.shape[2] if len(img.shape) == 3 else 1
+        self.num_by = -(-self.img_h // block)
+        self.num_bx = -(-self.img_w // block)
+
+        self.cum = None
+        self.build_sec = 0.0
+
+    @staticmethod
+    def is_supported(img) -> bool:
+        return img is not None and img.dtype == np.uint8 and len(img.shape) in (2, 3)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        索引のサイズ(作成前は見積り)
+        """
+        if self.cum is not None:
+            return self.cum.nbytes
+        _dtype = np.int32 if self.img_h * self.img_w < 2 ** 31 else np.int64
+        return (self.num_by + 1) * (self.num_bx + 1) * self.num_ch * HIST_BINS * np.dtype(_dtype).itemsize
+
+    def build(self, is_cancelled=None) -> bool:
+        """
+        索引を作成。ブロック1行分ずつ読み込んで集計する
+
+        :param is_cancelled: 作成中止を判定する関数
+        :return: 作成したか
+        """
+        _t0 = time.perf_counter()
+
+        _block = self.block
+        _dtype = np.int32 if self.img_h * self.img_w < 2 ** 31 else np.int64
+        _hists = np.zeros((self.num_by, self.num_bx, self.num_ch, HIST_BINS), dtype=_dtype)
+
+        # block column of each pixel, shifted to its own 256 bins
+        _bx = (np.arange(self.img_w) // _block) * HIST_BINS
+        for _by in range(self.num_by):
+            if is_cancelled is not None and is_cancelled():
+                return False
+
+            _band = np.asarray(self.img[_by * _block:(_by + 1) * _block, :])
+            _band = _convert(_band, self.mode)
+            if _band.ndim == 2:
+                _band = _band[:, :, np.newaxis]
+
+            for _ch in range(self.num_ch):
+                _idx = _bx[np.newaxis, :] + _band[:, :, _ch]
+                _count = np.bincount(_idx.ravel(), minlength=self.num_bx * HIST_BINS)
+                _hists[_by, :, _ch] = _count.reshape(self.num_bx, HIST_BINS)
+
+        _cum = np.zeros((self.num_by + 1, self.num_bx + 1, self.num_ch, HIST_BINS), dtype=_dtype)
+        np.cumsum(_hists, axis=0, out=_cum[1:, 1:])
+        np.cumsum(_cum[1:, 1:], axis=1, out=_cum[1:, 1:])
+        self.cum = _cum
+
+        self.build_sec = time.perf_counter() - _t0
+        return True
+
+    def get_hist(self, x0, x1, y0, y1) -> list:
+        """
+        矩形のヒストグラム。ImageFunc.check_histgramと同じ形式
+
+        :return: チャンネルごとのヒストグラム((256, 1), float32)のリスト
+        """
+        _x0 = int(max(min(x0, x1), 0))
+        _x1 = int(min(max(x0, x1), self.img_w))
+        _y0 = int(max(min(y0, y1), 0))
+        _y1 = int(min(max(y0, y1), self.img_h))
+        _x1 = max(_x0, _x1)
+        _y1 = max(_y0, _y1)
+
+        # inner blocks
+        _block = self.block
+        _by0 = -(-_y0 // _block)
+        _by1 = _y1 // _block
+        _bx0 = -(-_x0 // _block)
+        _bx1 = _x1 // _block
+
+        if self.cum is None or _by0 >= _by1 or _bx0 >= _bx1:
+            _hist = self._read_hist(_y0, _y1, _x0, _x1)
+        else:
+            _cum = self.cum
+            _hist = (_cum[_by1, _bx1].astype(np.int64) - _cum[_by0, _bx1]
+                     - _cum[_by1, _bx0] + _cum[_by0, _bx0])
+
+            # exact fix-up of the edges outside the inner blocks
+            _iy0 = _by0 * _block
+            _iy1 = _by1 * _block
+            _ix0 = _bx0 * _block
+            _ix1 = _bx1 * _block
+            _hist += self._read_hist(_y0, _iy0, _x0, _x1)
+            _hist += self._read_hist(_iy1, _y1, _x0, _x1)
+            _hist += self._read_hist(_iy0, _iy1, _x0, _ix0)
+            _hist += self._read_hist(_iy0, _iy1, _ix1, _x1)
+
+        return [_hist[_ch].astype(np.float32).reshape(HIST_BINS, 1) for _ch in range(self.num_ch)]
+
+    def _read_hist(self, y0, y1, x0, x1):
+        if y1 <= y0 or x1 <= x0:
+            return np.zeros((self.num_ch, HIST_BINS), dtype=np.int64)
+        _img = _convert(np.asarray(self.img[y0:y1, x0:x1]), self.mode)
+        return calc_hist(_img)
+
+
+if __name__ == '__main__':
+    pass
@@ -7,11 +7,9 @@ from opencv_func import ImageFunc
 def img_proc(img_in: np.array):
     if img_in is None: return None
 
-    img = img_in.copy()
-    img_out = img_in.copy()
-
     try:
-        img = ImageFunc.convert_intensity(img, coeff=1.3)
+        # LUT: new output image, img_in(shared with the cache) is not modified
+        img = ImageFunc.convert_intensity(img_in, coeff=1.3)
 
     except Exception as err:
         print(err)
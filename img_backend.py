@@ -0,0 +1,368 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+
+from img_cache import ImageCache
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+LAZY_EXTS = ('.npy', '.tif', '.tiff')
+
+# resident tiles of all lazy images
+_tile_cache = ImageCache(max_bytes=512 * 1024 * 1024)
+
+# opened lazy images: path -> LazyImage
+_open_images: OrderedDict = OrderedDict()
+_open_images_max = 16
+_open_lock = threading.Lock()
+
+
+def set_tile_cache_bytes(max_bytes: int) -> None:
+    _tile_cache.set_max_bytes(max_bytes)
+
+
+def get_tile_cache_stats() -> dict:
+    return _tile_cache.get_stats()
+
+
+class LazyImage(ABC):
+    """
+    必要な範囲のみ読み込む画像の基底クラス。numpy配列と同様にスライスで使用する。
+    img[y0:y1, x0:x1]やimg[y, x]の範囲のみをread_regionで読み込み、numpy配列を返す。
+    カラー画像はOpenCVと同じBGR順で返す。
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @abstractmethod
+    def read_region(self, y0, y1, x0, x1) -> np.array:
+        """
+        範囲[y0:y1, x0:x1]を読み込む(範囲は画像内)
+        """
+
+    def band_height(self) -> int:
+        """
+        間引き読込時に一度に読み込む行数
+        """
+        return 256
+
+    def __array__(self, dtype=None, copy=None):
+        img = self.read_region(0, self.shape[0], 0, self.shape[1])
+        if dtype is not None:
+            img = img.astype(dtype)
+        return img
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 0 and key[0] is Ellipsis:
+            key = (slice(None), slice(None)) + key[1:]
+
+        _rows = key[0] if len(key) > 0 else slice(None)
+        _cols = key[1] if len(key) > 1 else slice(None)
+        _rest = key[2:]
+
+        _squeeze = []
+        _ranges = []
+        for _axis, _idx in enumerate((_rows, _cols)):
+            _size = self.shape[_axis]
+            if isinstance(_idx, (int, np.integer)):
+                _idx = int(_idx)
+                if _idx < 0:
+                    _idx += _size
+                if not 0 <= _idx < _size:
+                    raise IndexError('index out of range')
+                _ranges.append((_idx, _idx + 1, 1))
+                _squeeze.append(_axis)
+            elif isinstance(_idx, slice):
+                _start, _stop, _step = _idx.indices(_size)
+                if _step < 1:
+                    raise IndexError('negative step is not supported')
+                _ranges.append((_start, max(_start, _stop), _step))
+            else:
+                raise IndexError('only integers and slices are supported')
+
+        (y0, y1, ys), (x0, x1, xs) = _ranges
+        if ys == 1:
+            img = self.read_region(y0, y1, x0, x1)
+        else:
+            img = self._read_strided(y0, y1, ys, x0, x1)
+        if xs > 1:
+            img = img[:, ::xs]
+
+        if len(_squeeze) > 0:
+            img = img[tuple(0 if _axis in _squeeze else slice(None) for _axis in range(2))]
+        if len(_rest) > 0:
+            img = img[(Ellipsis,) + _rest]
+
+        return np.ascontiguousarray(img)
+
+    def read_reduced(self, min_h: int, min_w: int):
+        """
+        表示サイズ(min_h, min_w)以上となる最小の縮小画像(1/2, 1/4, ...)
+
+        :return: (縮小画像, (元画像の高さ, 元画像の幅))
+        """
+        _factor = ImageCache._get_factor(self.shape[:2], min_h, min_w, max_factor=2 ** 10)
+        return self[::_factor, ::_factor], self.shape[:2]
+
+    def _read_strided(self, y0, y1, ys, x0, x1):
+        # read band by band so that only one band is resident
+        _rows = np.arange(y0, y1, ys)
+        _bands = []
+        _band_h = max(self.band_height(), 1)
+        _cnt = 0
+        while _cnt < len(_rows):
+            _b0 = _rows[_cnt]
+            _b1 = min(_b0 + _band_h, y1)
+            _sel = _rows[(_rows >= _b0) & (_rows < _b1)]
+            _band = self.read_region(int(_b0), int(_b1), x0, x1)
+            _bands.append(_band[_sel - _b0])
+            _cnt += len(_sel)
+
+        if len(_bands) == 0:
+            return self.read_region(y0, y0, x0, x1)
+        return np.concatenate(_bands, axis=0)
+
+
+def _to_bgr(img, rgb):
+    if not rgb or img.ndim != 3:
+        return img
+    if img.shape[2] == 3:
+        return img[:, :, ::-1]
+    if img.shape[2] == 4:
+        return img[:, :, 2::-1]
+    return img
+
+
+class MemmapImage(LazyImage):
+    """
+    非圧縮画像(NPY, 非圧縮TIFF)をnp.memmapで参照する
+    """
+
+    def __init__(self, img_map: np.array, rgb: bool = False):
+        _shape = img_map.shape
+        if rgb and img_map.ndim == 3 and _shape[2] == 4:
+            _shape = _shape[:2] + (3,)
+        super().__init__(_shape, img_map.dtype)
+
+        self.img_map = img_map
+        self.rgb = rgb
+
+    def read_region(self, y0, y1, x0, x1) -> np.array:
+        return np.ascontiguousarray(_to_bgr(self.img_map[y0:y1, x0:x1], self.rgb))
+
+
+class TiffImage(LazyImage):
+    """
+    圧縮TIFF(タイル/ストリップ)を必要なタイルのみ読み込む。
+    読み込んだタイルは全画像共通のキャッシュ(容量上限あり)に保持する。
+    ピラミッド(縮小画像)を持つTIFFは、縮小表示で該当する解像度を使用する。
+    """
+
+    def __init__(self, img_path: str, tif, page, levels=None, level: int = 0):
+        _shape = page.shape
+        self.rgb = page.photometric == 2
+        if self.rgb and len(_shape) == 3 and _shape[2] == 4:
+            _shape = _shape[:2] + (3,)
+        super().__init__(_shape, page.dtype)
+
+        self.img_path = img_path
+        self.tif = tif
+        self.page = page
+        self.level = level
+        self.levels = levels if levels is not None else []
+
+        _chunks = page.chunks
+        self.chunk_h = _chunks[0]
+        self.chunk_w = _chunks[1] if page.is_tiled else page.shape[1]
+        self.chunk_nx = -(-page.shape[1] // self.chunk_w)
+
+        _stat = os.stat(img_path)
+        self._key = (os.path.abspath(img_path), _stat.st_mtime_ns, _stat.st_size, level)
+        self._lock = threading.Lock()
+
+    def band_height(self) -> int:
+        return self.chunk_h
+
+    def read_region(self, y0, y1, x0, x1) -> np.array:
+        _spp = self.page.shape[2] if len(self.page.shape) == 3 else None
+        _shape = (y1 - y0, x1 - x0) + ((_spp,) if _spp is not None else ())
+        img = np.empty(_shape, dtype=self.dtype)
+
+        for _iy in range(y0 // self.chunk_h, -(-y1 // self.chunk_h)):
+            for _ix in range(x0 // self.chunk_w, -(-x1 // self.chunk_w)):
+                _chunk = self._read_chunk(_iy, _ix)
+
+                _cy0 = _iy * self.chunk_h
+                _cx0 = _ix * self.chunk_w
+                _sy0 = max(y0, _cy0)
+                _sy1 = min(y1, _cy0 + self.chunk_h)
+                _sx0 = max(x0, _cx0)
+                _sx1 = min(x1, _cx0 + self.chunk_w)
+
+                img[_sy0 - y0:_sy1 - y0, _sx0 - x0:_sx1 - x0] = \
+                    _chunk[_sy0 - _cy0:_sy1 - _cy0, _sx0 - _cx0:_sx1 - _cx0]
+
+        return np.ascontiguousarray(_to_bgr(img, self.rgb))
+
+    def read_reduced(self, min_h: int, min_w: int):
+        # use the smallest pyramid level that still covers the tile
+        for _level in reversed(self.levels[1:]):
+            if min(min_h / _level.shape[0], min_w / _level.shape[1]) <= 1:
+                _img, _ = _level.read_reduced(min_h, min_w)
+                return _img, self.shape[:2]
+
+        return super().read_reduced(min_h, min_w)
+
+    def _read_chunk(self, iy, ix):
+        _index = iy * self.chunk_nx + ix
+        _key = self._key + (_index,)
+
+        _chunk = _tile_cache.get(_key)
+        if _chunk is not None:
+            return _chunk
+
+        _page = self.page
+        with self._lock:
+            _fh = self.tif.filehandle
+            _fh.seek(_page.dataoffsets[_index])
+            _data = _fh.read(_page.databytecounts[_index])
+
+        _segment, _, _ = _page.decode(_data, _index,
+                                      jpegtables=_page.jpegtables,
+                                      jpegheader=_page.jpegheader)
+        # the last strip has fewer rows than chunk_h(tiles are padded to the full size)
+        if len(self.page.shape) == 3:
+            _chunk = _segment.reshape(-1, self.chunk_w, self.page.shape[2])
+        else:
+            _chunk = _segment.reshape(-1, self.chunk_w)
+
+        _tile_cache.put(_key, _chunk)
+        return _chunk
+
+
+def _open_tiff(img_path):
+    if tifffile is None:
+        return None
+
+    tif = tifffile.TiffFile(img_path)
+    try:
+        _series = tif.series[0]
+        _page = _series.pages[0]
+        _ndim = len(_page.shape)
+
+        if _ndim not in (2, 3) or len(_series.shape) != _ndim:
+            raise ValueError('unsupported tiff layout')
+        if _page.photometric not in (1, 2) or (_ndim == 3 and _page.planarconfig != 1):
+            raise ValueError('unsupported tiff layout')
+
+        # uncompressed & contiguous: memory map
+        if _page.is_memmappable:
+            tif.close()
+            _img_map = tifffile.memmap(img_path, mode='r')
+            return MemmapImage(_img_map, rgb=_page.photometric == 2)
+
+        # compressed tiles/strips: read by chunk
+        _levels = []
+        for _cnt, _level in enumerate(_series.levels):
+            _level_page = _level.pages[0]
+            if len(_level_page.shape) != _ndim:
+                break
+            _levels.append(TiffImage(img_path, tif, _level_page, level=_cnt))
+        img = _levels[0]
+        img.levels = _levels
+        return img
+
+    except Exception:
+        tif.close()
+        return None
+
+
+def open_lazy_image(img_path: str):
+    """
+    必要な範囲のみ読み込む画像を開く。対応していない形式の場合はNone
+
+    :param img_path: 画像パス(NPY, TIFF)
+    :return: LazyImage
+    """
+    _ext = os.path.splitext(img_path)[1].lower()
+    if _ext not in LAZY_EXTS:
+        return None
+
+    try:
+        _stat = os.stat(img_path)
+    except OSError:
+        return None
+    _key = (os.path.abspath(img_path), _stat.st_mtime_ns, _stat.st_size)
+
+    with _open_lock:
+        if _key in _open_images:
+            _open_images.move_to_end(_key)
+            return _open_images[_key]
+
+    img = None
+    try:
+        if _ext == '.npy':
+            _img_map = np.load(img_path, mmap_mode='r')
+            if _img_map.ndim in (2, 3):
+                img = MemmapImage(_img_map)
+        else:
+            img = _open_tiff(img_path)
+    except Exception as err:
+        print(err)
+        img = None
+
+    if img is None:
+        return None
+
+    with _open_lock:
+        _open_images[_key] = img
+        # handles may still be in use by workers: closed by GC
+        while len(_open_images) > _open_images_max:
+            _open_images.popitem(last=False)
+
+    return img
+
+
+class RegionProcImage(LazyImage):
+    """
+    読み込んだ範囲にのみ処理(単一チャンネル化、二値化などの画素単位の処理)を行う
+    """
+
+    def __init__(self, src: LazyImage, func):
+        self.src = src
+        self.func = func
+
+        _img = func(src.read_region(0, 1, 0, 1))
+        super().__init__(src.shape[:2] + _img.shape[2:], _img.dtype)
+
+    def band_height(self) -> int:
+        return self.src.band_height()
+
+    def read_region(self, y0, y1, x0, x1) -> np.array:
+        return self.func(self.src.read_region(y0, y1, x0, x1))
+
+    def read_reduced(self, min_h: int, min_w: int):
+        _img, _org_shape = self.src.read_reduced(min_h, min_w)
+        return self.func(_img), _org_shape
+
+
+if __name__ == '__main__':
+    pass
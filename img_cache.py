@@ -0,0 +1,272 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# reduced decode(JPEG only): factor -> flags
+REDUCED_FLAGS = {
+    cv2.IMREAD_COLOR: {2: cv2.IMREAD_REDUCED_COLOR_2,
+                       4: cv2.IMREAD_REDUCED_COLOR_4,
+                       8: cv2.IMREAD_REDUCED_COLOR_8},
+    cv2.IMREAD_GRAYSCALE: {2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                           4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                           8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+JPEG_EXTS = ('.jpg', '.jpeg', '.jpe')
+PYRAMID_MAX_LEVEL = 5
+
+# original image sizes of reduced reads: max number of files
+SHAPES_MAX = 4096
+
+
+def imread(img_path: str, flags: int = cv2.IMREAD_COLOR) -> np.array:
+    """
+    cv2.imreadにNPY(numpy配列, BGR順)の読込を追加
+
+    :param img_path: 画像パス
+    :param flags: cv2.imreadのフラグ
+    :return: デコード済み画像。読み込めない場合はNone
+    """
+    if not img_path.lower().endswith('.npy'):
+        return cv2.imread(img_path, flags)
+
+    try:
+        img = np.load(img_path)
+    except Exception:
+        return None
+    if img.ndim not in (2, 3):
+        return None
+
+    if flags == cv2.IMREAD_COLOR and img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif flags == cv2.IMREAD_GRAYSCALE and img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+
+def read_img_size(img_path: str):
+    """
+    ヘッダのみ読み込んで画像サイズを取得
+
+    :return: (img_h, img_w)。取得できない場合はNone
+    """
+    try:
+        with Image.open(img_path) as img:
+            _w, _h = img.size
+        return _h, _w
+    except Exception:
+        return None
+
+
+class ImageCache:
+    """
+    デコード済み画像のLRUキャッシュ。容量はバイト数で管理する。
+    キーは(パス, 更新時刻, ファイルサイズ)とし、ファイルが更新された場合は再読込する。
+    キャッシュした画像は共有されるため、書き換えずにコピーして使用すること。
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.cur_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data: OrderedDict = OrderedDict()
+        self._shapes: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(img_path: str, *args):
+        try:
+            _stat = os.stat(img_path)
+        except OSError:
+            return None
+
+        return (os.path.abspath(img_path), _stat.st_mtime_ns, _stat.st_size) + args
+
+    def get(self, key):
+        if key is None:
+            return None
+
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, img: np.array) -> None:
+        if key is None or img is None:
+            return
+
+        _nbytes = img.nbytes
+        if _nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self.cur_bytes -= self._data.pop(key).nbytes
+
+            self._data[key] = img
+            self.cur_bytes += _nbytes
+            self._evict()
+
+    def read(self, img_path: str, flags: int = cv2.IMREAD_COLOR) -> np.array:
+        """
+        キャッシュから画像を取得。無い場合はファイルから読み込んでキャッシュに追加
+
+        :param img_path: 画像パス
+        :param flags: cv2.imreadのフラグ
+        :return: デコード済み画像
+        """
+        _key = self.make_key(img_path, flags)
+        if _key is None:
+            return None
+
+        img = self.get(_key)
+        if img is not None:
+            return img
+
+        img = imread(img_path, flags)
+        self.put(_key, img)
+
+        return img
+
+    def read_reduced(self, img_path: str, min_h: int, min_w: int,
+                     flags: int = cv2.IMREAD_COLOR):
+        """
+        表示サイズ(min_h, min_w)以上となる最小の縮小画像を取得。
+        JPEGは縮小デコード、その他は縮小画像(1/2, 1/4, ...)をキャッシュして使用する
+
+        :param img_path: 画像パス
+        :param min_h: 表示高さ
+        :param min_w: 表示幅
+        :param flags: cv2.imreadのフラグ
+        :return: (縮小画像, (元画像の高さ, 元画像の幅))
+        """
+        _org_shape = None
+        if img_path.lower().endswith(JPEG_EXTS) and flags in REDUCED_FLAGS:
+            _org_shape = read_img_size(img_path)
+
+        # JPEG: decode at reduced size directly
+        if _org_shape is not None:
+            _factor = self._get_factor(_org_shape, min_h, min_w, max_factor=8)
+            if _factor == 1:
+                return self.read(img_path, flags), _org_shape
+
+            _flags = REDUCED_FLAGS[flags][_factor]
+            img = self.read(img_path, _flags)
+            if img is None:
+                return None, None
+
+            # EXIF orientation is applied by imread
+            if abs(img.shape[0] * _factor - _org_shape[0]) > _factor:
+                _org_shape = (_org_shape[1], _org_shape[0])
+            return img, _org_shape
+
+        # others: cached pyramid
+        _shape_key = self.make_key(img_path, flags)
+        _org_shape = self._get_shape(_shape_key)
+        if _org_shape is not None:
+            _factor = self._get_factor(_org_shape, min_h, min_w, max_factor=2 ** PYRAMID_MAX_LEVEL)
+            if _factor > 1:
+                img = self.get(self.make_key(img_path, flags, 'pyramid', _factor))
+                if img is not None:
+                    return img, _org_shape
+
+        img = self.read(img_path, flags)
+        if img is None:
+            return None, None
+
+        _org_shape = img.shape[:2]
+        self._put_shape(_shape_key, _org_shape)
+        _factor = self._get_factor(_org_shape, min_h, min_w, max_factor=2 ** PYRAMID_MAX_LEVEL)
+
+        _level = 1
+        while _level < _factor:
+            _level *= 2
+            _key = self.make_key(img_path, flags, 'pyramid', _level)
+            _img = self.get(_key)
+            if _img is None:
+                _h = max(img.shape[0] // 2, 1)
+                _w = max(img.shape[1] // 2, 1)
+                _img = cv2.resize(img, (_w, _h), interpolation=cv2.INTER_AREA)
+                self.put(_key, _img)
+            img = _img
+
+        return img, _org_shape
+
+    def _get_shape(self, key):
+        """
+        縮小読込した画像の元のサイズ。無い場合はNone
+        """
+        with self._lock:
+            _shape = self._shapes.get(key)
+            if _shape is not None:
+                self._shapes.move_to_end(key)
+            return _shape
+
+    def _put_shape(self, key, shape) -> None:
+        # bounded: least recently used files are dropped
+        if key is None:
+            return
+        with self._lock:
+            self._shapes[key] = shape
+            self._shapes.move_to_end(key)
+            while len(self._shapes) > SHAPES_MAX:
+                self._shapes.popitem(last=False)
+
+    @staticmethod
+    def _get_factor(org_shape, min_h, min_w, max_factor=8):
+        """
+        元画像を表示サイズへフィットさせた際に、表示サイズ以上を保てる最大の縮小率(2のべき乗)
+        """
+        _ratio = min(min_h / org_shape[0], min_w / org_shape[1])
+        if _ratio <= 0:
+            return 1
+
+        _factor = 1
+        while _factor * 2 <= max_factor and _factor * 2 * _ratio <= 1:
+            _factor *= 2
+        return _factor
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._shapes.clear()
+            self.cur_bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            _total = self.hits + self.misses
+            res = {"items": len(self._data),
+                   "bytes": self.cur_bytes,
+                   "max_bytes": self.max_bytes,
+                   "hits": self.hits,
+                   "misses": self.misses,
+                   "evictions": self.evictions,
+                   "hit_rate": self.hits / _total if _total > 0 else 0.0,
+                   }
+        return res
+
+    def _evict(self) -> None:
+        while self.cur_bytes > self.max_bytes and len(self._data) > 0:
+            _, _img = self._data.popitem(last=False)
+            self.cur_bytes -= _img.nbytes
+            self.evictions += 1
+
+
+if __name__ == '__main__':
+    pass
@@ -1,20 +1,38 @@
 import os
 import sys
-import glob
+import copy
 import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
+import numpy as np
 import tkinter
 from tkinter import ttk, messagebox, simpledialog, filedialog
 from PIL import Image, ImageTk
 
-from gui_window import HistogramViewer, ProfileViewer, GraphViewer
+from gui_window import HistogramViewer, ProfileViewer, GraphViewer, StatsViewer
 from gui_window import ParamWindowForSingleChannel
 from opencv_func import ImageFunc
 from gui_params import GuiParams
 from image_proc import img_proc
-
-def img_cv2tk(img_cv):
+from img_cache import ImageCache, JPEG_EXTS
+from prefetch import PagePrefetcher
+from tile_grid import TileGrid, to_pil_buffer
+from thumb_cache import ThumbCache
+from dir_scanner import DirScanner
+from preprocess import PreprocParams, PreprocPipeline
+from viewport import Viewport, TilePyramid
+from profile_engine import ProfileIndex, line_profile
+from hist_index import BlockHistIndex
+from region_stats import region_stats, format_stats
+from blob_analysis import BlobResult, analyze_blobs, format_blobs, run_blob_batch
+from perf_trace import tracer, span, traced
+from display_lut import DisplayWindow, apply_window
+from img_backend import LAZY_EXTS, RegionProcImage, open_lazy_image, set_tile_cache_bytes, get_tile_cache_stats
+
+def img_cv2pil(img_cv):
     """
     OpenCV->PIL
     :param img_cv: OpenCV-image
@@ -28,13 +46,29 @@ def img_cv2tk(img_cv):
         img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
 
     img_pil = Image.fromarray(img_cv)
-    img = ImageTk.PhotoImage(img_pil.convert('RGB'))
+    if img_pil.mode == 'RGB':
+        return img_pil
+    return img_pil.convert('RGB')
+
+
+def img_cv2tk(img_cv):
+    """
+    OpenCV->PIL->Tk。カラーは1回の変換のみ、グレーは変換なし
+    :param img_cv: OpenCV-image
+    :return:
+    """
+
+    if img_cv is None:
+        return None
+
+    img_pil, _ = to_pil_buffer(img_cv)
+
+    img = ImageTk.PhotoImage(img_pil)
     return img
 
 
 class ImageViewer:
     """
-    TODO: 面積測定機能(モノクロ限定？)
     TODO: 二値化機能(BGR)
     TODO: 二値化条件の自動抽出??クラスタリング、ヒストグラム
     """
@@ -56,8 +90,12 @@ class ImageViewer:
         # parameters: images
         self.img_paths: list[str] = []
         self.imgs_cv: list[ImageCvData] = []
-        self.imgs_pil: list[ImageTk.PhotoImage] = []
+        self.tile_grid: TileGrid = None
         self.img_cnt = 0
+        self.page_generation = 0
+        self.page_t0 = None
+        self.page_pending = 0
+        self.dir_scanner: DirScanner = None
 
         # image preprocess
         self.preproc1_color = 'color'
@@ -82,10 +120,70 @@ class ImageViewer:
         if not self.topmost:
             self.root.attributes('-topmost', False)
 
+        # decoded-image cache
+        self.img_cache = ImageCache(max_bytes=self.param_gui.cache_max_mb * 1024 * 1024)
+
+        # large images: resident tiles
+        set_tile_cache_bytes(self.param_gui.tile_cache_mb * 1024 * 1024)
+
+        # wheel zoom/pan: tiles of the multi-resolution pyramids
+        self.pyramid_cache = ImageCache(max_bytes=self.param_gui.pyramid_cache_mb * 1024 * 1024)
+        self._pan_pos = None
+
+        # profiles: cumulative sums per image
+        self.profile_cache = ImageCache(max_bytes=self.param_gui.profile_cache_mb * 1024 * 1024)
+
+        # rectangle histograms: block-histogram indexes, built in the background
+        self.hist_index_cache = ImageCache(max_bytes=self.param_gui.hist_index_mb * 1024 * 1024)
+        self.hist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hist_index')
+
+        # linked views: one viewport state(center, scale) for all tiles
+        self.linked_views = tkinter.BooleanVar(value=self.param_gui.linked_views)
+        self.linked_state = None
+        self._linked_render_pending = False
+        # zoomed views being rendered on tile_executor: tile_cnt -> (ImageCvData, future)
+        self._view_renders = {}
+
+        # live graphs: latest pending update
+        self._graph_func = None
+
+        # blob export: (thread, state) of the running batch
+        self.blob_batch = None
+        # blobs of the shown images: analyzed in the background
+        self.blob_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='blob_analysis')
+
+        # timing spans: readout in frame1
+        tracer.enabled = self.param_gui.perf_trace_flg
+        self.perf_overlay = tkinter.BooleanVar(value=self.param_gui.perf_overlay)
+        self._perf_pending = False
+
+        # display window of high bit depth images
+        self.display_window = self.get_display_window()
+        self.display_mode = tkinter.StringVar(value=self.display_window.mode)
+
+        # preprocess stages: memoized per image
+        self.preproc_pipeline = PreprocPipeline(max_bytes=self.param_gui.preproc_cache_mb * 1024 * 1024)
+
+        # on-disk thumbnail cache
+        self.thumb_cache = None
+        if self.param_gui.thumb_cache_flg:
+            try:
+                self.thumb_cache = ThumbCache(self.param_gui.thumb_cache_path,
+                                              max_mb=self.param_gui.thumb_cache_max_mb)
+            except Exception as err:
+                print(err)
+
+        # worker pool: decode/preprocess/fit tiles of the current page
+        self.tile_executor = ThreadPoolExecutor(max_workers=self.param_gui.tile_workers,
+                                                thread_name_prefix='tile')
+
+        # background prefetch: next/previous pages
+        self.prefetcher = PagePrefetcher(self.root, self.load_page,
+                                         max_workers=self.param_gui.prefetch_workers,
+                                         num_next=self.param_gui.prefetch_pages)
+
         # parameters: etc
         self.cwd = os.getcwd()
-        self.gui_timer = time.time()
-        self.gui_response_sec = 0.1
 
         self.click_func = 'show_info'
 
@@ -103,9 +201,12 @@ class ImageViewer:
         self.msg_img = tkinter.StringVar()
         self.msg_hsv = tkinter.StringVar()
         self.msg_size = tkinter.StringVar()
+        self.msg_scan = tkinter.StringVar()
+        self.msg_batch = tkinter.StringVar()
+        self.msg_perf = tkinter.StringVar()
         self.msg_shortcut_func = tkinter.StringVar()
 
-        self.shortcut_func_list = ['None', 'Profile(Hor)', 'Profile(Ver)', 'Cross', 'Histogram', 'Histogram(HSV)']
+        self.shortcut_func_list = ['None', 'Profile(Hor)', 'Profile(Ver)', 'Profile(Line)', 'Cross', 'Histogram', 'Histogram(HSV)', 'Statistics', 'Blobs']
         self.shortcut_func = self.shortcut_func_list[0]
 
         # start
@@ -119,6 +220,7 @@ class ImageViewer:
         children = self.root.winfo_children()
         for child in children:
             child.destroy()
+        self.frame2 = None
 
         # Define Frames
         # frame1: user-interface
@@ -129,6 +231,21 @@ class ImageViewer:
                                     )
         self.frame1.pack(side='left', fill=tkinter.X)
 
+        # Set Frames
+        self.set_frame1()
+        self.tile_grid = None
+        self.set_layout()
+
+        # Set Menu
+        self.set_menu()
+
+    def set_layout(self):
+        """
+        画像表示領域(frame2)を生成。行数/列数が変わった場合のみ呼ぶ
+        """
+        if self.frame2 is not None:
+            self.frame2.destroy()
+
         # frame2: image-viewer
         self.frame2 = tkinter.Frame(self.root,
                                     width=1700,
@@ -139,18 +256,62 @@ class ImageViewer:
                                     )
         self.frame2.pack(side='right', fill=tkinter.X)
 
-        # Set Frames
-        self.set_frame1()
-
         self.root.update_idletasks()
         _frame2_h = self.frame2.winfo_height()
         _frame2_w = self.frame2.winfo_width()
         self.img_h = int(_frame2_h / self.img_num_row * 0.95)
         self.img_w = int(_frame2_w / self.img_num_col * 0.95)
+
+        self.tile_grid = TileGrid(self.frame2,
+                                  self.img_num_row, self.img_num_col,
+                                  self.img_h, self.img_w,
+                                  **self.style_color, **self.style_font)
+        self.bind_tile_events()
+
         self.set_frame2()
 
-        # Set Menu
-        self.set_menu()
+    def bind_tile_events(self):
+        """
+        ショートカットの種類に応じて、画像表示Labelにイベントを登録
+        """
+        _mode = self.shortcut_func.lower()
+
+        if _mode == 'profile(line)':
+            events = [("<ButtonPress-1>", self.line_profile_press),
+                      ("<Button1-Motion>", self.line_profile_drag),
+                      ("<ButtonRelease-1>", self.line_profile_release)]
+        elif 'profile' in _mode:
+            events = [("<Button>", self.show_profile)]
+        elif _mode == 'cross':
+            events = [("<Button>", self.set_cross)]
+        elif _mode == 'blobs':
+            events = [("<Button-1>", self.show_blob_click)]
+        elif 'histogram' in _mode or _mode == 'statistics':
+            events = [("<ButtonPress-1>", self.show_histogram_press),
+                      ("<Button1-Motion>", self.show_histogram_drag),
+                      ("<ButtonRelease-1>", self.show_histogram_release)]
+        else:
+            events = [("<ButtonPress-1>", self.set_zoom_press),
+                      ("<Button1-Motion>", self.set_zoom_drag),
+                      ("<ButtonRelease-1>", self.set_zoom_release)]
+
+        if _mode in ('profile(hor)', 'profile(ver)'):
+            _motion = self.show_profile_motion
+        elif _mode == 'blobs':
+            _motion = self.show_blob_mouse
+        else:
+            _motion = self.show_info_mouse
+
+        events += [("<Button-3>", self.click_function),
+                   ("<Motion>", _motion),
+                   ("<MouseWheel>", self.view_zoom_wheel),
+                   ("<Button-4>", self.view_zoom_wheel),
+                   ("<Button-5>", self.view_zoom_wheel),
+                   ("<ButtonPress-2>", self.view_pan_press),
+                   ("<Button2-Motion>", self.view_pan_drag),
+                   ("<Double-Button-2>", self.view_reset)]
+
+        self.tile_grid.bind_events(_mode, events)
 
     def set_frame1(self):
         _frame1_w = 20
@@ -203,6 +364,16 @@ class ImageViewer:
         self.msg_size.set('')
         _set_label(textvariable=self.msg_size, **self.style_color, **self.style_font)
 
+        # show scan_info
+        _set_label(textvariable=self.msg_scan, **self.style_color, **self.style_font)
+
+        # show batch_info
+        _set_label(textvariable=self.msg_batch, **self.style_color, **self.style_font)
+
+        # show perf_info
+        _set_label(textvariable=self.msg_perf, justify=tkinter.LEFT, font=("Courier", 9))
+        self.update_perf_overlay()
+
         # button: open_dir
         _set_button(text='Open Dir', command=self.load_img_list,
                     **self.style_color_blue, **self.style_font)
@@ -234,68 +405,261 @@ class ImageViewer:
             GraphViewer.delete()
             self.param_gui.reset()
             self.shortcut_func = self.msg_shortcut_func.get()
-            self.set_frames()
+            self.bind_tile_events()
+            self.set_frame2(update_cv=False)
 
         combobox.bind('<<ComboboxSelected>>', _combo)
 
+    @traced('set_frame2')
     def set_frame2(self, update_cv=True):
         # initialize
-        _cnt = 0
-        if update_cv:
-            self.imgs_cv = []
-        self.imgs_pil = []
+        _img_num = self.img_num_row * self.img_num_col
 
         # show info for gui
         self.show_img_path(self.img_cnt)
 
-        # main
-        for _row in range(self.img_num_row):
-            for _col in range(self.img_num_col):
-                # OpenCV->Image Process
-                if update_cv:
-                    _img_org = self.load_img_with_preprocess(self.img_cnt + _cnt)
-                    self.imgs_cv.append(ImageCvData(_img_org, self.img_h, self.img_w))
-
-                # Fit Window
-                img = self.imgs_cv[_cnt].img_fit
-
-                # Draw Shape->PIL
-                img = self.img_cv2viewer(img)
-                self.imgs_pil.append(img)
-
-                # Set frame->image
-                _frame = tkinter.Frame(self.frame2,
-                                       width=self.img_w, height=self.img_h)
-                _frame.grid(row=_row, column=_col, padx=4, pady=4)
-                _frame.grid_propagate(False)
-
-                _label = tkinter.Label(_frame,
-                                       text=str(self.img_cnt + _cnt),
-                                       image=self.imgs_pil[_cnt],
-                                       compound='none',
-                                       **self.style_color, **self.style_font
-                                       )
-                _label.grid()
-
-                # Set shortcut
-                if 'profile' in self.shortcut_func.lower():
-                    _label.bind("<Button>", self.show_profile)
-                elif self.shortcut_func.lower() == 'cross':
-                    _label.bind("<Button>", self.set_cross)
-                elif 'histogram' in self.shortcut_func.lower():
-                    _label.bind("<ButtonPress-1>", self.show_histogram_press)
-                    _label.bind("<Button1-Motion>", self.show_histogram_drag)
-                    _label.bind("<ButtonRelease-1>", self.show_histogram_release)
-                else:
-                    _label.bind("<ButtonPress-1>", self.set_zoom_press)
-                    _label.bind("<Button1-Motion>", self.set_zoom_drag)
-                    _label.bind("<ButtonRelease-1>", self.set_zoom_release)
+        # OpenCV->Image Process: use prefetched page if exists
+        if update_cv:
+            _page_key = self._get_page_key()
+            _page_paths = self.img_paths[self.img_cnt:self.img_cnt + _img_num]
 
-                _label.bind("<Button-3>", self.click_function)
-                _label.bind("<Motion>", self.show_info_mouse)
+            self.page_generation += 1
+            self.page_t0 = time.perf_counter()
+            self.imgs_cv = self.prefetcher.pop(self.img_cnt, _page_key, _page_paths)
+            if self.imgs_cv is None:
+                self.imgs_cv = self.load_page_progressive(self.img_cnt)
 
-                _cnt += 1
-        pass
+            # tiles shown as thumbnails: upgraded later
+            self.page_pending = sum(1 for _img in self.imgs_cv if _img is not None and _img.is_preview)
+
+        # main: Fit Window->Draw Shape->PIL->existing widgets
+        for _cnt in range(_img_num):
+            self.redraw_tile(_cnt)
+
+        # prefetch next/previous pages
+        if update_cv:
+            self.prefetcher.schedule(self.img_cnt, _img_num, self.img_paths, _page_key)
+            self.check_page_done()
+
+    def check_page_done(self):
+        """
+        ページの全画像の表示が完了した場合、Tkの描画(アイドル時)までをページの待ち時間として記録
+        """
+        if self.page_pending > 0 or self.page_t0 is None: return
+
+        _gen = self.page_generation
+        _t0 = self.page_t0
+        self.page_t0 = None
+
+        def _done():
+            if _gen == self.page_generation:
+                tracer.add('page.latency', time.perf_counter() - _t0, t0=_t0)
+
+        self.root.after_idle(_done)
+
+    def load_page(self, img_cnt, is_cancelled=None):
+        """
+        1ページ分の画像を読込。先読みの場合はワーカースレッドから呼ばれる
+
+        :param img_cnt: ページ先頭の画像番号
+        :param is_cancelled: 読込中止を判定する関数
+        :return: ImageCvDataのリスト。中止した場合はNone
+        """
+        _img_cnts = range(img_cnt, img_cnt + self.img_num_row * self.img_num_col)
+
+        _imgs = []
+        for _cnt in _img_cnts:
+            if is_cancelled is not None and is_cancelled():
+                return None
+            _imgs.append(self.load_tile(_cnt))
+
+        return _imgs
+
+    def load_page_progressive(self, img_cnt):
+        """
+        1ページ分の画像を並列に読込。
+        サムネイルがある画像はサムネイルを先に表示し、読込完了後にroot.afterで差し替える
+
+        :param img_cnt: ページ先頭の画像番号
+        :return: ImageCvDataのリスト
+        """
+        _gen = self.page_generation
+        _img_cnts = range(img_cnt, img_cnt + self.img_num_row * self.img_num_col)
+
+        # decode/preprocess/resize release the GIL: fan out over the pool
+        _futures = [self.tile_executor.submit(self.load_tile, _cnt) for _cnt in _img_cnts]
+
+        def _done(future, tile_cnt):
+            try:
+                self.root.after(0, self._upgrade_tile, _gen, tile_cnt, future)
+            except Exception:
+                pass
+
+        _imgs = []
+        for _tile_cnt, (_cnt, _future) in enumerate(zip(_img_cnts, _futures)):
+            _thumb = None
+            if not _future.done():
+                _thumb = self.load_tile_thumb(_cnt)
+
+            if _thumb is None:
+                _imgs.append(_future.result())
+            else:
+                _imgs.append(_thumb)
+                _future.add_done_callback(lambda f, t=_tile_cnt: _done(f, t))
+
+        return _imgs
+
+    def _upgrade_tile(self, gen, tile_cnt, future):
+        """
+        サムネイル表示中の画像を、読込完了した画像に差し替え
+        """
+        if gen != self.page_generation:
+            return
+
+        self.page_pending -= 1
+        try:
+            self.imgs_cv[tile_cnt] = future.result()
+        except Exception as err:
+            print(err)
+            self.check_page_done()
+            return
+
+        self.redraw_tile(tile_cnt)
+        self.check_page_done()
+
+    def load_tile_thumb(self, img_cnt):
+        """
+        サムネイルキャッシュから1枚分の画像を作成。無い場合はNone
+        """
+        if self.thumb_cache is None:
+            return None
+        if self.func_proc is not None or self.preproc3_zoom:
+            return None
+        if not 0 <= img_cnt < len(self.img_paths):
+            return None
+
+        _img, _org_shape = self.thumb_cache.get(self.img_paths[img_cnt], self.img_h, self.img_w)
+        if _img is None:
+            return None
+
+        _img = self.img_preproc(_img)
+        img = ImageCvData(_img, self.img_h, self.img_w,
+                          org_shape=_org_shape,
+                          img_loader=lambda: self.load_img_with_preprocess(img_cnt),
+                          img_key=self.get_img_data_key(img_cnt))
+        img.is_preview = True
+        return img
+
+    @traced('load_tile')
+    def load_tile(self, img_cnt):
+        """
+        1枚分の画像を読込: decode->img_preproc->func_proc->fit window
+        ズーム/画像処理なしの場合は縮小画像から表示し、元画像は必要になった時点で読み込む
+        """
+        if self.func_proc is None and not self.preproc3_zoom and 0 <= img_cnt < len(self.img_paths):
+            _src = self.open_lazy(self.img_paths[img_cnt])
+            if _src is not None:
+                # large image: subsampled read of the needed tiles only
+                _key = self.img_cache.make_key(self.img_paths[img_cnt], 'lazy', self.img_h, self.img_w)
+                _img = self.img_cache.get(_key)
+                _org_shape = _src.shape[:2]
+                if _img is None:
+                    with span('decode(reduced)'):
+                        _img, _org_shape = _src.read_reduced(self.img_h, self.img_w)
+                    self.img_cache.put(_key, _img)
+            else:
+                with span('decode(reduced)'):
+                    _img, _org_shape = self.img_cache.read_reduced(self.img_paths[img_cnt],
+                                                                   self.img_h, self.img_w,
+                                                                   self.get_imread_flags(self.img_paths[img_cnt]))
+            if _img is not None:
+                if self.thumb_cache is not None:
+                    self.thumb_cache.put(self.img_paths[img_cnt], _img, _org_shape)
+
+                _key = self.img_cache.make_key(self.img_paths[img_cnt], 'reduced', _img.shape)
+                _src_dtype = _img.dtype
+                _img = self.img_preproc(_img, _key)
+                return ImageCvData(_img, self.img_h, self.img_w,
+                                   org_shape=_org_shape,
+                                   img_loader=lambda: self.load_img_with_preprocess(img_cnt),
+                                   img_key=self.get_img_data_key(img_cnt),
+                                   src_dtype=_src_dtype)
+
+        _img_org = self.load_img_with_preprocess(img_cnt)
+        return ImageCvData(_img_org, self.img_h, self.img_w, img_key=self.get_img_data_key(img_cnt),
+                           src_dtype=self.get_src_dtype(img_cnt))
+
+    def get_src_dtype(self, img_cnt):
+        """
+        読込画像(前処理前)の型。大きな画像はヘッダ、その他は読込済みのフレーム(キャッシュ)から取得。無い場合はNone
+        """
+        if not 0 <= img_cnt < len(self.img_paths):
+            return None
+
+        _img_path = self.img_paths[img_cnt]
+        _src = self.open_lazy(_img_path)
+        if _src is not None:
+            return _src.dtype
+        _img = self.img_cache.read(_img_path, self.get_imread_flags(_img_path))
+        return None if _img is None else _img.dtype
+
+    def get_img_data_key(self, img_cnt):
+        """
+        前処理済みの元画像のキー: ファイル(パス, 更新時刻, サイズ), 読込フラグ, 前処理条件。
+        ページの再表示や先読みでImageCvDataを作り直しても、共有キャッシュ(ピラミッドなど)を再利用する。
+        ファイルが無い場合はNone
+        """
+        if not 0 <= img_cnt < len(self.img_paths):
+            return None
+
+        _img_path = self.img_paths[img_cnt]
+        _key = self.img_cache.make_key(_img_path, self.get_imread_flags(_img_path))
+        if _key is None:
+            return None
+        return _key + ('preproc', self.get_preproc_params().get_key(), self.func_proc)
+
+    def open_lazy(self, img_path):
+        """
+        大きな画像(NPY, lazy_load_mb以上のTIFF)を開く。表示範囲のみ読み込む。対象外の場合はNone
+        """
+        if not img_path.lower().endswith(LAZY_EXTS):
+            return None
+        if not img_path.lower().endswith('.npy'):
+            try:
+                if os.path.getsize(img_path) < self.param_gui.lazy_load_mb * 1024 * 1024:
+                    return None
+            except OSError:
+                return None
+
+        img = open_lazy_image(img_path)
+        if img is None:
+            return None
+
+        # same as get_imread_flags: BGR, 8bit unless high bit depth is enabled
+        if img.dtype != np.uint8 and not self.param_gui.high_depth:
+            return None
+        if img.ndim == 2:
+            return RegionProcImage(img, lambda region: cv2.cvtColor(region, cv2.COLOR_GRAY2BGR))
+        if img.shape[2] != 3:
+            return None
+        return img
+
+    def get_imread_flags(self, img_path):
+        """
+        読込のフラグ。高ビット深度が有効な場合は16bit/floatのまま読み込む(JPEGは8bitのみのため縮小デコードを使用)
+        """
+        if self.param_gui.high_depth and not img_path.lower().endswith(JPEG_EXTS):
+            return cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH
+        return cv2.IMREAD_COLOR
+
+    def _get_page_key(self):
+        """
+        ページ表示条件。先読み結果の有効判定に使用
+        連動表示の表示範囲は含めない(先読みしたページには表示時にredraw_tileで適用する)
+        """
+        return (self.img_num_row, self.img_num_col, self.img_h, self.img_w,
+                self.get_preproc_params().get_key(),
+                self.func_proc)
 
     def set_menu(self):
         menubar = tkinter.Menu(self.root)
@@ -307,7 +671,7 @@ class ImageViewer:
         def _set_images_num(col=None, row=None):
             if col is not None: self.img_num_col = col
             if row is not None: self.img_num_row = row
-            self.set_frames()
+            self.set_layout()
 
         col_menu = tkinter.Menu(menubar)
         col_menu.add_command(label='x1', command=lambda: _set_images_num(col=1))
@@ -345,6 +709,9 @@ class ImageViewer:
         zoom_menu = tkinter.Menu(menubar)
         zoom_menu.add_command(label='set zoom', command=self.set_zoom)
         zoom_menu.add_command(label='unset zoom', command=self.unset_zoom)
+        zoom_menu.add_command(label='reset view', command=self.reset_view)
+        zoom_menu.add_checkbutton(label='linked views', variable=self.linked_views,
+                                  command=self.toggle_linked_views)
         menubar.add_cascade(label='Zoom', menu=zoom_menu)
 
         def _set_click_function(mode='show_info'):
@@ -356,6 +723,32 @@ class ImageViewer:
         func_menu.add_command(label='save image', command=lambda: _set_click_function('save_image'))
         menubar.add_cascade(label='ClickFunc', menu=func_menu)
 
+        display_menu = tkinter.Menu(menubar)
+        for _mode in ('full', 'auto', 'manual'):
+            display_menu.add_radiobutton(label=_mode, value=_mode, variable=self.display_mode,
+                                         command=self.set_display_mode)
+        display_menu.add_command(label='set window(manual)', command=self.set_display_range)
+        display_menu.add_command(label='set gamma', command=self.set_display_gamma)
+        menubar.add_cascade(label='Display', menu=display_menu)
+
+        blob_menu = tkinter.Menu(menubar)
+        blob_menu.add_command(label='set min area', command=self.set_blob_min_area)
+        blob_menu.add_command(label='export csv(all images)', command=self.export_blobs_csv)
+        blob_menu.add_command(label='cancel export', command=self.cancel_blob_batch)
+        menubar.add_cascade(label='Blobs', menu=blob_menu)
+
+        perf_menu = tkinter.Menu(menubar)
+        perf_menu.add_checkbutton(label='show overlay', variable=self.perf_overlay,
+                                  command=self.update_perf_overlay)
+        perf_menu.add_command(label='show span stats', command=self.show_perf_stats)
+        perf_menu.add_command(label='export chrome trace', command=self.export_perf_trace)
+        perf_menu.add_command(label='reset', command=tracer.reset)
+        menubar.add_cascade(label='Perf', menu=perf_menu)
+
+        cache_menu = tkinter.Menu(menubar)
+        cache_menu.add_command(label='show cache info', command=self.show_cache_info)
+        menubar.add_cascade(label='Cache', menu=cache_menu)
+
         self.root.config(menu=menubar)
 
     def set_shortcut(self):
@@ -421,12 +814,14 @@ class ImageViewer:
         info.gui_x = int(event.x)
         info.gui_y = int(event.y)
 
+        _img_cv = self.imgs_cv[info.cnt - self.img_cnt]
         if use_org_img:
-            info.img = self.imgs_cv[info.cnt - self.img_cnt].img_org
+            info.img = _img_cv.img_org
         else:
-            info.img = self.imgs_cv[info.cnt - self.img_cnt].img_fit
+            info.img = _img_cv.img_view
 
-        info.fit_ratio = self.imgs_cv[info.cnt - self.img_cnt].fit_ratio
+        info.fit_ratio, info.origin_x, info.origin_y = _img_cv.get_transform()
+        info.org_shape = _img_cv.org_shape
 
         info.calc_params()
 
@@ -452,7 +847,7 @@ class ImageViewer:
         if img_path is None: return
         if len(img_path)<1: return
 
-        cv2.imwrite(img_path, info.img)
+        cv2.imwrite(img_path, np.asarray(info.img))
 
     def show_info(self, event):
         """
@@ -467,6 +862,133 @@ class ImageViewer:
                                     f'img_h: {info.img_h_org}\n'
                                     f'img_w: {info.img_w_org}\n')
 
+    def show_cache_info(self):
+        """
+        キャッシュの使用状況を表示
+        """
+        _stats = self.img_cache.get_stats()
+        _msg = (f'[image cache]\n'
+                f'items: {_stats["items"]}\n'
+                f'memory: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n'
+                f'hit rate: {_stats["hit_rate"] * 100:.1f} % '
+                f'(hit: {_stats["hits"]}, miss: {_stats["misses"]}, evict: {_stats["evictions"]})\n')
+
+        _stats = self.preproc_pipeline.memo.get_stats()
+        _msg += (f'\n[preprocess cache]\n'
+                 f'items: {_stats["items"]}\n'
+                 f'memory: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n'
+                 f'hit rate: {_stats["hit_rate"] * 100:.1f} %\n')
+
+        if self.thumb_cache is not None:
+            _stats = self.thumb_cache.get_stats()
+            _msg += (f'\n[thumbnail cache]\n'
+                     f'path: {_stats["path"]}\n'
+                     f'images: {_stats["images"]}\n'
+                     f'size: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n'
+                     f'hit rate: {_stats["hit_rate"] * 100:.1f} % '
+                     f'(hit: {_stats["hits"]}, miss: {_stats["misses"]})\n'
+                     f'build: {_stats["build_num"]} images, {_stats["build_sec"]:.2f} sec\n')
+
+        _stats = self.pyramid_cache.get_stats()
+        _msg += (f'\n[zoom pyramid tiles]\n'
+                 f'items: {_stats["items"]}\n'
+                 f'memory: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n'
+                 f'hit rate: {_stats["hit_rate"] * 100:.1f} %\n')
+
+        _stats = self.profile_cache.get_stats()
+        _msg += (f'\n[profile sums]\n'
+                 f'items: {_stats["items"]}\n'
+                 f'memory: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n')
+
+        _stats = self.hist_index_cache.get_stats()
+        _msg += (f'\n[histogram index]\n'
+                 f'items: {_stats["items"]}\n'
+                 f'memory: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n'
+                 f'evict: {_stats["evictions"]}\n')
+
+        _stats = get_tile_cache_stats()
+        _msg += (f'\n[large image tiles]\n'
+                 f'items: {_stats["items"]}\n'
+                 f'memory: {_stats["bytes"] / 1024 ** 2:.1f} / {_stats["max_bytes"] / 1024 ** 2:.0f} MB\n'
+                 f'hit rate: {_stats["hit_rate"] * 100:.1f} %\n')
+
+        tkinter.messagebox.showinfo('cache info', _msg)
+
+    @traced('perf.overlay')
+    def update_perf_overlay(self):
+        """
+        処理時間の表示(ページの待ち時間、スパンのp50/p95、キャッシュのヒット率、メモリ)。表示中は定期的に更新
+        """
+        if not self.perf_overlay.get():
+            self.msg_perf.set('')
+            return
+
+        _stats = tracer.get_stats()
+
+        def _span(label, name):
+            if name not in _stats: return f'{label}: -'
+            _s = _stats[name]
+            return f'{label}: {_s["p50_msec"]:.1f}/{_s["p95_msec"]:.1f}/{_s["max_msec"]:.0f}'
+
+        _last = tracer.last('page.latency')
+        _lines = [f'page(last): {_last * 1000:.0f} ms' if _last is not None else 'page(last): -',
+                  'p50/p95/max [ms]',
+                  _span('page', 'page.latency'),
+                  _span('tile', 'load_tile'),
+                  _span('decode', 'decode(reduced)'),
+                  _span('redraw', 'tile.render'),
+                  _span('tk', 'tile.tk_image'),
+                  _span('mouse', 'mouse.info')]
+
+        _caches = [('img', self.img_cache.get_stats()),
+                   ('pre', self.preproc_pipeline.memo.get_stats()),
+                   ('pyr', self.pyramid_cache.get_stats())]
+        _lines.append('hit: ' + ' '.join(f'{_name} {_s["hit_rate"] * 100:.0f}%' for _name, _s in _caches))
+
+        _bytes = sum(_s["bytes"] for _, _s in _caches)
+        _bytes += self.profile_cache.get_stats()["bytes"]
+        _bytes += self.hist_index_cache.get_stats()["bytes"]
+        _bytes += get_tile_cache_stats()["bytes"]
+        _lines.append(f'mem: {_bytes / 1024 ** 2:.0f} MB')
+
+        self.msg_perf.set('\n'.join(_lines))
+
+        if not self._perf_pending:
+            self._perf_pending = True
+            self.root.after(self.param_gui.perf_overlay_msec, self._next_perf_overlay)
+
+    def _next_perf_overlay(self):
+        self._perf_pending = False
+        self.update_perf_overlay()
+
+    def show_perf_stats(self):
+        """
+        スパンごとの処理時間(p50/p95/max)を表示
+        """
+        _stats = tracer.get_stats()
+        _msg = '\n'.join(f'{_name}: {_s["p50_msec"]:.2f} / {_s["p95_msec"]:.2f} / {_s["max_msec"]:.2f} ms '
+                         f'(n={_s["count"]})'
+                         for _name, _s in _stats.items())
+        tkinter.messagebox.showinfo('span stats(p50 / p95 / max)', _msg if len(_msg) > 0 else 'no spans')
+
+    def export_perf_trace(self):
+        """
+        スパンをChrome trace形式(JSON)で出力。chrome://tracingやPerfettoで表示する
+        """
+        if self.topmost:
+            self.root.attributes('-topmost', False)
+        _path = tkinter.filedialog.asksaveasfilename(initialdir=self.cwd,
+                                                     defaultextension='.json',
+                                                     filetypes=[('JSON', '*.json')])
+        if self.topmost:
+            self.root.attributes('-topmost', True)
+        if _path is None or len(_path) < 1:
+            return
+
+        _num = tracer.export_chrome_trace(_path)
+        tkinter.messagebox.showinfo('chrome trace', f'{_num} spans\n{_path}')
+
+    @traced('mouse.info')
     def show_info_mouse(self, event):
         """
         マウスポインタがある画像の情報をGUIに表示
@@ -488,6 +1010,183 @@ class ImageViewer:
         else:
             self.msg_size.set('')
 
+        return info
+
+    def get_blobs(self, tile_cnt):
+        """
+        二値化した画像の連結成分。二値化していない場合、解析中の場合はNone
+        """
+        if not self.preproc2_thres_flg: return None
+        if not 0 <= tile_cnt < len(self.imgs_cv): return None
+
+        return self.get_img_blobs(self.imgs_cv[tile_cnt])
+
+    def get_img_blobs(self, img_data):
+        """
+        1枚分の連結成分。解析中/未解析の場合はNone(未解析の場合は解析を開始し、完了後にroot.afterで再描画)
+        """
+        _gen = self.page_generation
+
+        def _done(future):
+            try:
+                self.root.after(0, self._show_blobs, _gen, img_data, future)
+            except Exception:
+                pass
+
+        return img_data.get_blobs(self.blob_executor,
+                                  min_area=self.param_gui.blob_min_area,
+                                  max_bytes=self.param_gui.blob_max_mb * 1024 * 1024,
+                                  is_cancelled=lambda: _gen != self.page_generation,
+                                  on_done=_done)
+
+    def _show_blobs(self, gen, img_data, future):
+        """
+        解析が完了した画像のブロブの枠を描画
+        """
+        if gen != self.page_generation or future.cancelled():
+            return
+
+        _err = future.exception()
+        if _err is not None:
+            print(_err)
+            return
+
+        if self.shortcut_func != 'Blobs':
+            return
+        for _tile_cnt in range(min(len(self.imgs_cv), len(self.tile_grid))):
+            if self.imgs_cv[_tile_cnt] is img_data:
+                self.redraw_tile(_tile_cnt)
+
+    @traced('mouse.blob')
+    def show_blob_mouse(self, event):
+        """
+        マウスポインタがあるブロブの面積、重心を表示
+        """
+        info: ImageInfo = self.show_info_mouse(event)
+        if info.x_org is None: return
+
+        if not self.preproc2_thres_flg:
+            self.msg_size.set('blobs: no threshold')
+            return
+
+        _result = self.get_blobs(info.cnt - self.img_cnt)
+        if _result is None:
+            # being analyzed(or too large)
+            self.msg_size.set('blobs: -')
+            return
+
+        _label = _result.find(info.x_org, info.y_org)
+        if _label > 0:
+            _blob = _result.get_blob(_label, pix2um=self.param_gui.pix2um)
+            self.msg_size.set(f'#{_label} A: {_blob["area_um2"]:.6g} '
+                              f'C: ({_blob["cx_um"]:.0f}, {_blob["cy_um"]:.0f})')
+        else:
+            self.msg_size.set(f'blobs: {len(_result)}')
+
+    def show_blob_click(self, event):
+        """
+        ブロブの集計とクリックしたブロブの情報を表示
+        """
+        info: ImageInfo = self._get_image_info(event)
+        if info.x_org is None: return
+
+        if not self.preproc2_thres_flg:
+            tkinter.messagebox.showinfo('blobs', 'Threshold > thres_1chで二値化してください')
+            return
+
+        _result = self.get_blobs(info.cnt - self.img_cnt)
+        if _result is None:
+            tkinter.messagebox.showinfo('blobs', '解析中です(または画像が大きすぎます)')
+            return
+
+        _label = _result.find(info.x_org, info.y_org)
+        StatsViewer.show(self.root, format_blobs(_result, pix2um=self.param_gui.pix2um, label=_label))
+
+    def set_blob_min_area(self):
+        ret = tkinter.simpledialog.askinteger('blobs', '最小面積[pix]',
+                                              initialvalue=self.param_gui.blob_min_area, minvalue=0)
+        if ret is None: return
+
+        self.param_gui.blob_min_area = ret
+        self.set_frame2(update_cv=False)
+
+    def export_blobs_csv(self):
+        """
+        全画像(self.img_paths)の連結成分をワーカープロセスで解析し、CSVに出力
+        """
+        if self.blob_batch is not None and self.blob_batch[0].is_alive():
+            tkinter.messagebox.showinfo('blobs', 'export is running')
+            return
+        if len(self.img_paths) == 0: return
+
+        _params = self.get_preproc_params()
+        if not _params.thres_flg:
+            tkinter.messagebox.showinfo('blobs', 'Threshold > thres_1chで二値化してください')
+            return
+
+        if self.topmost:
+            self.root.attributes('-topmost', False)
+        _csv_path = tkinter.filedialog.asksaveasfilename(initialdir=self.cwd,
+                                                         defaultextension='.csv',
+                                                         filetypes=[('CSV', '*.csv')])
+        if self.topmost:
+            self.root.attributes('-topmost', True)
+        if _csv_path is None or len(_csv_path) < 1:
+            return
+
+        _img_paths = list(self.img_paths)
+        _state = {"num": 0, "failures": 0, "cancel": False, "result": None, "error": None}
+
+        def _progress(num, failures):
+            _state["num"] = num
+            _state["failures"] = failures
+
+        def _run():
+            try:
+                _state["result"] = run_blob_batch(_img_paths, _csv_path, _params,
+                                                  min_area=self.param_gui.blob_min_area,
+                                                  pix2um=self.param_gui.pix2um,
+                                                  summary_path=os.path.splitext(_csv_path)[0] + '_summary.csv',
+                                                  workers=self.param_gui.blob_workers,
+                                                  progress=_progress,
+                                                  is_cancelled=lambda: _state["cancel"],
+                                                  flags=(cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH
+                                                         if self.param_gui.high_depth else cv2.IMREAD_COLOR))
+            except Exception as err:
+                _state["error"] = str(err)
+
+        _thread = threading.Thread(target=_run, name='blob_batch', daemon=True)
+        self.blob_batch = (_thread, _state)
+        _thread.start()
+        self.poll_blob_batch(_thread, _state, len(_img_paths))
+
+    def poll_blob_batch(self, thread, state, total, delay=200):
+        """
+        ブロブ出力の進捗を表示し、終了時に結果を表示
+        """
+        if thread.is_alive():
+            self.msg_batch.set(f'blobs: {state["num"]}/{total}')
+            self.root.after(delay, self.poll_blob_batch, thread, state, total, delay)
+            return
+
+        _res = state["result"]
+        if _res is None:
+            self.msg_batch.set('blobs: error')
+            tkinter.messagebox.showerror('blobs', f'export failed: {state["error"]}')
+            return
+
+        self.msg_batch.set(f'blobs: {_res["images"]}/{total}')
+        tkinter.messagebox.showinfo('blobs',
+                                    f'images: {_res["images"]}, blobs: {_res["blobs"]}, '
+                                    f'failures: {len(_res["failures"])}\n'
+                                    f'{"cancelled" if _res["cancelled"] else "done"}: '
+                                    f'{_res["elapsed_sec"]:.1f} sec\n{_res["csv"]}')
+
+    def cancel_blob_batch(self):
+        if self.blob_batch is not None:
+            self.blob_batch[1]["cancel"] = True
+
+    @traced('mouse.profile')
     def show_profile(self, event):
         info: ImageInfo = self._get_image_info(event, use_org_img=True)
 
@@ -496,50 +1195,217 @@ class ImageViewer:
         else:
             _direction = 'hor'
 
-        _pos, _profile = ImageFunc.check_profile(info.img, x=info.x, y=info.y, direction=_direction)
-        _viewer = ProfileViewer(self.root, _pos, _profile)
+        _index = self.imgs_cv[info.cnt - self.img_cnt].get_profile_index(self.profile_cache)
+        _pos, _profile = ImageFunc.check_profile(info.img, x=info.x, y=info.y, direction=_direction,
+                                                 width=self.param_gui.profile_width, index=_index)
+        ProfileViewer.show(self.root, _pos, _profile)
 
-    def show_histogram_press(self, event):
-        info: ImageInfo = self._get_image_info(event, use_org_img=True)
+    def show_profile_motion(self, event):
+        """
+        マウスの移動に合わせてプロファイルを更新(プロファイル表示中のみ)
+        """
+        self.show_info_mouse(event)
+
+        if self.param_gui.live_graph and ProfileViewer.is_open():
+            self.schedule_graph(lambda: self.show_profile(event))
+
+    def line_profile_press(self, event):
+        info: ImageInfo = self._get_image_info(event)
 
         self.param_gui.reset()
-        self.param_gui.set_type('Rectangle')
+        self.param_gui.set_type('Line')
         self.param_gui.set_pos0(info.x_fit, info.y_fit)
-        self.gui_timer = time.time()
 
-    def show_histogram_drag(self, event):
-        if time.time() - self.gui_timer < self.gui_response_sec:
-            return
-        else:
-            self.gui_timer = time.time()
+    def line_profile_drag(self, event):
+        info: ImageInfo = self._get_image_info(event)
+
+        self.param_gui.set_pos1(info.x_fit, info.y_fit)
+        self.redraw_tile(info.cnt - self.img_cnt)
 
+        if self.param_gui.live_graph and ProfileViewer.is_open():
+            _tile_cnt = info.cnt - self.img_cnt
+            self.schedule_graph(lambda: self.show_line_profile(_tile_cnt))
+
+    def line_profile_release(self, event):
+        """
+        ドラッグした線分のプロファイルを表示
+        """
         info: ImageInfo = self._get_image_info(event, use_org_img=True)
+        if info.img is None: return
 
         self.param_gui.set_pos1(info.x_fit, info.y_fit)
+
+        self._graph_func = None
+        self.show_line_profile(info.cnt - self.img_cnt)
+
         self.set_frame2(update_cv=False)
 
+    @traced('mouse.line_profile')
+    def show_line_profile(self, tile_cnt):
+        if not 0 <= tile_cnt < len(self.imgs_cv): return
+        if self.param_gui.x0 is None or self.param_gui.x1 is None: return
+
+        _img_cv = self.imgs_cv[tile_cnt]
+        if _img_cv.img_org is None: return
+
+        x0, y0 = _img_cv.gui2org(self.param_gui.x0, self.param_gui.y0)
+        x1, y1 = _img_cv.gui2org(self.param_gui.x1, self.param_gui.y1)
+        _dist, _profile = line_profile(_img_cv.img_org, x0, y0, x1, y1, width=self.param_gui.profile_line_width)
+        ProfileViewer.show(self.root, _dist, _profile)
+
+    def show_histogram_press(self, event):
+        info: ImageInfo = self._get_image_info(event)
+
+        self.param_gui.reset()
+        self.param_gui.set_type('Rectangle')
+        self.param_gui.set_pos0(info.x_fit, info.y_fit)
+
+        # start building the index: used once it is ready
+        self.get_hist_index(info.cnt - self.img_cnt)
+
+    def show_histogram_drag(self, event):
+        info: ImageInfo = self._get_image_info(event)
+
+        self.param_gui.set_pos1(info.x_fit, info.y_fit)
+        self.redraw_tile(info.cnt - self.img_cnt)
+
+        # stream the histogram/statistics of the rectangle while dragging
+        if self.param_gui.live_graph:
+            _tile_cnt = info.cnt - self.img_cnt
+            self.schedule_graph(lambda: self.show_rect_result(_tile_cnt))
+
     def show_histogram_release(self, event):
         info: ImageInfo = self._get_image_info(event, use_org_img=True)
 
         self.param_gui.set_pos1(info.x_fit, info.y_fit)
 
+        self._graph_func = None
+        self.show_rect_result(info.cnt - self.img_cnt)
+
+        self.set_frame2(update_cv=False)
+
+    def show_rect_result(self, tile_cnt):
+        if self.shortcut_func == 'Statistics':
+            self.show_rect_stats(tile_cnt)
+        else:
+            self.show_rect_histogram(tile_cnt)
+
+    @traced('mouse.stats')
+    def show_rect_stats(self, tile_cnt):
+        """
+        矩形(self.param_gui)内の統計量(面積、平均、標準偏差、最小/最大、パーセンタイル、前景の面積)を表示
+        """
+        if not 0 <= tile_cnt < len(self.imgs_cv): return
+        if self.param_gui.x0 is None or self.param_gui.x1 is None: return
+
+        _img_cv = self.imgs_cv[tile_cnt]
+        _img = _img_cv.img_org
+        if _img is None: return
+
+        x0, y0 = map(int, _img_cv.gui2org(self.param_gui.x0, self.param_gui.y0))
+        x1, y1 = map(int, _img_cv.gui2org(self.param_gui.x1, self.param_gui.y1))
+
+        _stats_list = region_stats(_img, x0, x1, y0, y1,
+                                   index=self.get_hist_index(tile_cnt),
+                                   percentiles=self.param_gui.stats_percentiles,
+                                   thres=self.get_stats_thres(_img))
+
+        if len(_stats_list) == 1:
+            labels = ('value',)
+        else:
+            labels = ('Blue', 'Green', 'Red', 'Alpha')[:len(_stats_list)]
+
+        _area = _stats_list[0]["count"] if len(_stats_list) > 0 else 0
+        _pix2um = self.param_gui.pix2um
+        self.msg_size.set(f'Area: {_area * _pix2um ** 2:.6g}')
+        StatsViewer.show(self.root, format_stats(_stats_list, labels, _area, pix2um=_pix2um))
+
+    def get_stats_thres(self, img):
+        """
+        前景とする画素値の範囲: 二値化済みの画像は二値化後の前景、二値化条件がある場合はその範囲
+        """
+        if self.preproc2_thres_flg and img.ndim == 2:
+            return 255, 255
+        if len(self.preproc2_thres) > 0:
+            return self.preproc2_thres['value_lower'], self.preproc2_thres['value_upper']
+        return self.param_gui.stats_thres
+
+    @traced('mouse.histogram')
+    def show_rect_histogram(self, tile_cnt):
+        """
+        矩形(self.param_gui)内のヒストグラムを表示。ウインドウが開いている場合は更新のみ
+        """
+        if not 0 <= tile_cnt < len(self.imgs_cv): return
+        if self.param_gui.x0 is None or self.param_gui.x1 is None: return
+
+        _img_cv = self.imgs_cv[tile_cnt]
+        x0, y0 = map(int, _img_cv.gui2org(self.param_gui.x0, self.param_gui.y0))
+        x1, y1 = map(int, _img_cv.gui2org(self.param_gui.x1, self.param_gui.y1))
+
         if self.shortcut_func == 'Histogram(HSV)':
-            _img = cv2.cvtColor(info.img, cv2.COLOR_BGR2HSV)
             labels = ('Hue', 'Saturation', 'Bright')
         else:
-            _img = info.img
             labels = ('Blue', 'Green', 'Red')
 
-        x0 = int(self.param_gui.x0 / info.fit_ratio)
-        x1 = int(self.param_gui.x1 / info.fit_ratio)
-        y0 = int(self.param_gui.y0 / info.fit_ratio)
-        y1 = int(self.param_gui.y1 / info.fit_ratio)
-        _hist_list = ImageFunc.check_histgram(_img,
-                                              x0=x0, x1=x1,
-                                              y0=y0, y1=y1)
-        _viewer = HistogramViewer(self.root, _hist_list, labels=labels)
+        # index: independent of the rectangle area
+        _index = self.get_hist_index(tile_cnt)
+        if _index is not None:
+            HistogramViewer.show(self.root, _index.get_hist(x0, x1, y0, y1), labels=labels)
+            return
 
-        self.set_frame2(update_cv=False)
+        _hsv = False
+        _img = _img_cv.img_org
+        if _img is None: return
+        if self.shortcut_func == 'Histogram(HSV)':
+            if _img.dtype != np.uint8:
+                # high bit depth: HSV of the displayed(windowed 8bit) colors in the selected region
+                _x0, _x1 = sorted((max(x0, 0), max(x1, 0)))
+                _y0, _y1 = sorted((max(y0, 0), max(y1, 0)))
+                _img = self.apply_display_window(np.asarray(_img[_y0:_y1, _x0:_x1]), _img_cv)
+                x0, x1, y0, y1 = 0, _img.shape[1], 0, _img.shape[0]
+                _hsv = True
+            else:
+                _view = _img_cv.get_view('hsv', use_org_img=True)
+                if _view is not None:
+                    _img = _view
+                else:
+                    # large image: convert the selected region only
+                    _hsv = True
+
+        # bins in the original values(8bit: 0-255, others: min-max of the region)
+        _x, _hist_list = ImageFunc.check_histgram_bins(_img,
+                                                       x0=x0, x1=x1,
+                                                       y0=y0, y1=y1,
+                                                       hsv=_hsv)
+        HistogramViewer.show(self.root, _hist_list, labels=labels, x=_x)
+
+    def get_hist_index(self, tile_cnt):
+        """
+        表示中の画像の矩形ヒストグラム索引。作成中/未作成の場合はNone(未作成の場合は作成を開始)
+        """
+        if not self.param_gui.hist_index_flg: return None
+        if not 0 <= tile_cnt < len(self.imgs_cv): return None
+
+        _mode = 'hsv' if self.shortcut_func == 'Histogram(HSV)' else 'bgr'
+        _gen = self.page_generation
+        return self.imgs_cv[tile_cnt].get_hist_index(_mode, self.hist_index_cache, self.hist_executor,
+                                                     block=self.param_gui.hist_index_block,
+                                                     is_cancelled=lambda: _gen != self.page_generation)
+
+    def schedule_graph(self, func):
+        """
+        グラフの更新を予約。連続したイベントは、アイドル時に最後の1回のみ実行する
+        """
+        _pending = self._graph_func is not None
+        self._graph_func = func
+        if not _pending:
+            self.root.after_idle(self._run_graph)
+
+    def _run_graph(self):
+        _func = self._graph_func
+        self._graph_func = None
+        if _func is not None:
+            _func()
 
     def set_cross(self, event):
         info: ImageInfo = self._get_image_info(event)
@@ -555,29 +1421,23 @@ class ImageViewer:
         info: ImageInfo = self._get_image_info(event)
 
         self.preproc3_pos0 = (info.x_org, info.y_org)
-        self.gui_timer = time.time()
 
+    @traced('mouse.zoom_drag')
     def set_zoom_drag(self, event):
         if self.preproc3_zoom: return
 
-        if time.time() - self.gui_timer < self.gui_response_sec:
-            return
-        else:
-            self.gui_timer = time.time()
-
         info: ImageInfo = self._get_image_info(event)
         self.preproc3_pos1 = (info.x_org, info.y_org)
 
         self.preproc3_zoom_draw = True
-        self.set_frame2()
+        self.redraw_tile(info.cnt - self.img_cnt)
 
     def set_zoom_release(self, event):
         if self.preproc3_zoom: return
 
         info: ImageInfo = self._get_image_info(event)
 
-        _x0 = self.preproc3_pos0[0] * info.fit_ratio
-        _y0 = self.preproc3_pos0[1] * info.fit_ratio
+        _x0, _y0 = self.imgs_cv[info.cnt - self.img_cnt].org2gui(*self.preproc3_pos0)
         if abs(info.x - _x0) < 5 or abs(info.y - _y0) < 5:
             self.preproc3_pos0 = None
             self.preproc3_pos1 = None
@@ -587,10 +1447,198 @@ class ImageViewer:
             return
 
         self.preproc3_pos1 = (info.x_org, info.y_org)
+
+        # linked views: shared ROI instead of cropping every image
+        if self.linked_views.get():
+            _viewport = self.imgs_cv[info.cnt - self.img_cnt].get_viewport(self.param_gui.zoom_max_scale)
+            self.preproc3_zoom_draw = False
+            if _viewport is not None:
+                _viewport.fit_rect(*self.preproc3_pos0, *self.preproc3_pos1)
+                self.set_linked_state(_viewport.get_state())
+            return
+
         self.preproc3_zoom = True
         self.preproc3_zoom_draw = False
         self.set_frame2()
 
+    @traced('mouse.wheel')
+    def view_zoom_wheel(self, event):
+        """
+        マウスホイールで拡大/縮小。ポインタ位置の画素を固定する
+        """
+        _tile_cnt = int(event.widget['text']) - self.img_cnt
+        if not 0 <= _tile_cnt < len(self.imgs_cv): return
+
+        _viewport = self.imgs_cv[_tile_cnt].get_viewport(self.param_gui.zoom_max_scale)
+        if _viewport is None: return
+
+        # X11: Button-4/5, others: delta
+        if event.num == 4 or event.delta > 0:
+            _factor = self.param_gui.zoom_wheel_step
+        else:
+            _factor = 1 / self.param_gui.zoom_wheel_step
+
+        _viewport.zoom_at(event.x, event.y, _factor)
+        if self.linked_views.get():
+            self.set_linked_state(_viewport.get_state())
+        else:
+            self.redraw_tile(_tile_cnt)
+
+    def view_pan_press(self, event):
+        self._pan_pos = (event.x, event.y)
+
+    @traced('mouse.pan')
+    def view_pan_drag(self, event):
+        """
+        中ボタンのドラッグで表示範囲を移動
+        """
+        if self._pan_pos is None: return
+
+        _tile_cnt = int(event.widget['text']) - self.img_cnt
+        if not 0 <= _tile_cnt < len(self.imgs_cv): return
+
+        _viewport = self.imgs_cv[_tile_cnt].viewport
+        _dx = event.x - self._pan_pos[0]
+        _dy = event.y - self._pan_pos[1]
+        self._pan_pos = (event.x, event.y)
+        if _viewport is None or _viewport.is_fit(): return
+
+        _viewport.pan(_dx, _dy)
+        if self.linked_views.get():
+            self.set_linked_state(_viewport.get_state())
+        else:
+            self.redraw_tile(_tile_cnt)
+
+    def view_reset(self, event):
+        if self.linked_views.get():
+            self.set_linked_state(None)
+            return
+
+        _tile_cnt = int(event.widget['text']) - self.img_cnt
+        if not 0 <= _tile_cnt < len(self.imgs_cv): return
+
+        if self.imgs_cv[_tile_cnt].viewport is not None:
+            self.imgs_cv[_tile_cnt].viewport.fit()
+        self.redraw_tile(_tile_cnt)
+
+    def reset_view(self):
+        """
+        全画像の表示範囲をフィットに戻す
+        """
+        self.linked_state = None
+        for _tile_cnt, _img_cv in enumerate(self.imgs_cv):
+            if _img_cv is not None and _img_cv.viewport is not None:
+                _img_cv.viewport.fit()
+                self.redraw_tile(_tile_cnt)
+
+    def toggle_linked_views(self):
+        """
+        連動表示の切替。有効にした場合は拡大表示中の画像の表示範囲に揃える
+        """
+        self.linked_state = None
+        if not self.linked_views.get():
+            return
+
+        for _img_cv in self.imgs_cv:
+            if _img_cv is not None and _img_cv.viewport is not None and not _img_cv.viewport.is_fit():
+                self.linked_state = _img_cv.viewport.get_state()
+                break
+        self.set_linked_state(self.linked_state)
+
+    def set_linked_state(self, state):
+        """
+        連動表示の表示範囲を設定し、全画像の再描画を予約。
+        ドラッグ中の連続したイベントは、アイドル時の1回の再描画に纏める
+
+        :param state: (中心x, 中心y, 倍率)。Noneの場合はフィット
+        """
+        self.linked_state = state
+        if self._linked_render_pending:
+            return
+        self._linked_render_pending = True
+        self.root.after_idle(self.redraw_linked_views)
+
+    def redraw_linked_views(self):
+        """
+        全画像に共通の表示範囲を適用して再描画。各画像の表示範囲のみ並列に描画する
+        """
+        self._linked_render_pending = False
+
+        for _tile_cnt in range(min(len(self.imgs_cv), len(self.tile_grid))):
+            _img_cv = self.imgs_cv[_tile_cnt]
+            self.apply_linked_state(_img_cv)
+            if _img_cv is None or _img_cv.is_view_ready():
+                self.redraw_tile(_tile_cnt)
+            else:
+                self.render_tile_async(_tile_cnt)
+
+    def render_tile_async(self, tile_cnt):
+        """
+        1枚分の表示範囲をtile_executorで描画し、完了後にroot.afterで再描画する。
+        描画中の場合は、完了時に表示範囲を再確認する
+        """
+        _img_cv = self.imgs_cv[tile_cnt]
+        _running = self._view_renders.get(tile_cnt)
+        if _running is not None and _running[0] is _img_cv and not _running[1].done():
+            return
+
+        _gen = self.page_generation
+
+        def _done(future):
+            try:
+                self.root.after(0, self._show_rendered, _gen, tile_cnt, _img_cv, future)
+            except Exception:
+                pass
+
+        # resampling releases the GIL: render the visible region on the pool
+        _future = self.tile_executor.submit(_img_cv.render_view, self.pyramid_cache)
+        self._view_renders[tile_cnt] = (_img_cv, _future)
+        _future.add_done_callback(_done)
+
+    def _show_rendered(self, gen, tile_cnt, img_cv, future):
+        """
+        描画が完了した表示範囲を表示。表示範囲が変わっていた場合は再度描画する
+        """
+        if gen != self.page_generation:
+            return
+        if tile_cnt >= min(len(self.imgs_cv), len(self.tile_grid)) or self.imgs_cv[tile_cnt] is not img_cv:
+            return
+
+        _err = future.exception()
+        if _err is not None:
+            print(_err)
+            return
+
+        if img_cv.is_view_ready():
+            self.redraw_tile(tile_cnt)
+        else:
+            self.render_tile_async(tile_cnt)
+
+    def apply_linked_state(self, img_cv) -> bool:
+        """
+        連動表示の表示範囲を1枚分に適用。サムネイル表示中の画像は読込完了後に適用する
+
+        :return: 適用したか
+        """
+        if not self.linked_views.get():
+            return False
+        if img_cv is None or img_cv.is_preview:
+            return False
+
+        _viewport = img_cv.viewport
+        if _viewport is None:
+            if self.linked_state is None:
+                return False
+            _viewport = img_cv.get_viewport(self.param_gui.zoom_max_scale)
+            if _viewport is None:
+                return False
+
+        if self.linked_state is None:
+            _viewport.fit()
+        else:
+            _viewport.set_state(*self.linked_state)
+        return True
+
     def set_zoom(self):
         if self.preproc3_pos0 is None: return
         if self.preproc3_pos1 is None: return
@@ -601,6 +1649,7 @@ class ImageViewer:
         self.preproc3_zoom = False
         self.set_frame2()
 
+    @traced('load_img_with_preprocess')
     def load_img_with_preprocess(self, img_cnt):
         if 0 <= img_cnt < len(self.img_paths):
             _img_path = self.img_paths[img_cnt]
@@ -608,72 +1657,168 @@ class ImageViewer:
             if not os.path.isfile(_img_path):
                 return None
 
-            _img = cv2.imread(_img_path, cv2.IMREAD_COLOR)
+            _params = self.get_preproc_params()
 
-            # image process---------------
-            _img = self.img_preproc(_img)
+            # large image: read only the region in use
+            _src = self.open_lazy(_img_path)
+            if _src is not None:
+                if _params.zoom and _params.pos0 is not None and _params.pos1 is not None:
+                    # crop stage slices the zoom area from the file
+                    _key = self.img_cache.make_key(_img_path, 'lazy')
+                    return self.preproc_pipeline.run(_key, _src, _params, func_proc=self.func_proc)
+                if self.func_proc is None:
+                    return RegionProcImage(_src, lambda region: self.preproc_pipeline.run(None, region, _params))
 
-            if self.func_proc is not None:
-                _img = self.func_proc(_img)
+            # cached frame is shared: stages copy only where they write
+            _flags = self.get_imread_flags(_img_path)
+            with span('decode'):
+                _img = self.img_cache.read(_img_path, _flags)
+            _key = self.img_cache.make_key(_img_path, _flags)
+
+            # image process---------------
+            _img = self.run_preproc(_key, _img, _params, func_proc=self.func_proc)
 
             return _img
         else:
             return None
 
-    def img_preproc(self, img_cv):
-        if img_cv is None: return None
+    def img_preproc(self, img_cv, img_key=None):
+        """
+        前処理(画像処理を除く)。img_keyを指定した場合は各段の結果をメモ化
+        """
+        return self.run_preproc(img_key, img_cv, self.get_preproc_params())
 
-        img = img_cv.copy()
+    def run_preproc(self, img_key, img_cv, params, func_proc=None):
+        """
+        前処理を実行し、各段の時間をスパン(preproc.段の名前)として記録
+        """
+        _timings = {}
+        img = self.preproc_pipeline.run(img_key, img_cv, params, func_proc=func_proc, timings=_timings)
+        for _name, _sec in _timings.items():
+            tracer.add(f'preproc.{_name}', _sec)
+        return img
+
+    def get_preproc_params(self):
+        """
+        GUIで設定した前処理条件
+        """
+        return PreprocParams(color=self.preproc1_color,
+                             thres_flg=self.preproc2_thres_flg,
+                             thres=self.preproc2_thres,
+                             zoom=self.preproc3_zoom,
+                             pos0=self.preproc3_pos0,
+                             pos1=self.preproc3_pos1,
+                             margin=self.param_gui.zoom_margin)
+
+    def img_overlay(self, img_cv, img_data=None):
+        """
+        表示画像に図形(十字線、矩形、ズーム範囲)を描画
 
-        if img.ndim == 3:
-            if self.preproc1_color == 'gray':
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            elif self.preproc1_color == 'blue':
-                img = img[:, :, 0]
-            elif self.preproc1_color == 'green':
-                img = img[:, :, 1]
-            elif self.preproc1_color == 'red':
-                img = img[:, :, 2]
-            elif self.preproc1_color == 'h':
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-                img = img[:, :, 0]
-            elif self.preproc1_color == 's':
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-                img = img[:, :, 1]
-            elif self.preproc1_color == 'v':
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-                img = img[:, :, 2]
-        
-        img = img.copy()
-        if self.preproc2_thres_flg and img.ndim!=3:
-            if len(self.preproc2_thres)>0:
-                _low = self.preproc2_thres['value_lower']
-                _high = self.preproc2_thres['value_upper']
-                img = ImageFunc.threshold_gray2(img, thres_min=_low, thres_max=_high)
-
-        img_out = img.copy()
-        if self.preproc3_pos1 is not None:
-            x0 = self.preproc3_pos0[0]
-            y0 = self.preproc3_pos0[1]
-            x1 = self.preproc3_pos1[0]
-            y1 = self.preproc3_pos1[1]
-
-            if self.preproc3_zoom_draw:
-                img_out = draw_rectangle(img_out, x0, x1, y0, y1)
-            if self.preproc3_zoom:
-                img_out = img_out[min(y0, y1):max(y0, y1), min(x0, x1):max(x0, x1)]
-
-        return img_out
-
-    def img_cv2viewer(self, img_cv):
+        :param img_cv: 表示画像
+        :param img_data: ImageCvData。ズーム範囲の座標変換に使用
+        """
         if img_cv is None: return None
 
         img = img_cv.copy()
         img = self.param_gui.draw_img(img)
-        img = img_cv2tk(img)
+
+        # zoom area while dragging: original-pixel -> fit-pixel
+        if self.preproc3_zoom_draw and not self.preproc3_zoom and img_data is not None:
+            if self.preproc3_pos0 is not None and self.preproc3_pos1 is not None:
+                x0, y0 = map(int, img_data.org2gui(*self.preproc3_pos0))
+                x1, y1 = map(int, img_data.org2gui(*self.preproc3_pos1))
+                img = draw_rectangle(img, x0, x1, y0, y1)
+
+        # bounding boxes of the blobs
+        if self.shortcut_func == 'Blobs' and self.preproc2_thres_flg and img_data is not None:
+            # drawn once the background analysis is done
+            _result = self.get_img_blobs(img_data)
+            if _result is not None:
+                img = draw_boxes(img, _result.get_boxes(), *img_data.get_transform(),
+                                 max_num=self.param_gui.blob_draw_max)
 
         return img
 
+    def apply_display_window(self, img_cv, img_data):
+        """
+        表示画像を表示用の8bitへ変換(ウインドウ、ガンマ)。変換不要の8bit画像はそのまま返す
+
+        :param img_cv: 表示画像(元画像と同じビット深度)
+        :param img_data: ImageCvData。表示範囲の算出に使用
+        """
+        if img_cv is None: return None
+
+        _low, _high = img_data.get_display_range(self.display_window)
+        return apply_window(img_cv, _low, _high, self.display_window.gamma)
+
+    def get_display_window(self):
+        """
+        GUIで設定した表示の階調変換の条件
+        """
+        return DisplayWindow(mode=self.param_gui.display_window,
+                             low=self.param_gui.display_low,
+                             high=self.param_gui.display_high,
+                             gamma=self.param_gui.display_gamma,
+                             percentiles=self.param_gui.display_percentiles)
+
+    def set_display_mode(self):
+        self.param_gui.display_window = self.display_mode.get()
+        self.redraw_display_window()
+
+    def set_display_range(self):
+        ret = tkinter.simpledialog.askstring('display', '表示範囲(low high)',
+                                             initialvalue=f'{self.param_gui.display_low} {self.param_gui.display_high}')
+        if ret is None: return
+
+        try:
+            _low, _high = map(float, ret.split())
+        except ValueError:
+            tkinter.messagebox.showinfo('display', 'low highを数値で入力してください')
+            return
+        if _high <= _low:
+            tkinter.messagebox.showinfo('display', 'low < highとしてください')
+            return
+
+        self.param_gui.display_low = _low
+        self.param_gui.display_high = _high
+        self.param_gui.display_window = 'manual'
+        self.display_mode.set('manual')
+        self.redraw_display_window()
+
+    def set_display_gamma(self):
+        ret = tkinter.simpledialog.askfloat('display', 'ガンマ',
+                                            initialvalue=self.param_gui.display_gamma, minvalue=0.01)
+        if ret is None: return
+
+        self.param_gui.display_gamma = ret
+        self.redraw_display_window()
+
+    def redraw_display_window(self):
+        """
+        表示の階調変換の変更を全画像に適用。画像の再読込は行わない
+        """
+        self.display_window = self.get_display_window()
+        for _tile_cnt in range(min(len(self.imgs_cv), len(self.tile_grid))):
+            self.redraw_tile(_tile_cnt)
+
+    def redraw_tile(self, tile_cnt):
+        """
+        1枚分の表示のみ更新。読込済みの表示画像(フィット画像または拡大表示)に図形を描画し、既存のPhotoImageへ貼り付け
+        """
+        if not 0 <= tile_cnt < len(self.tile_grid):
+            return
+
+        _img_cv = self.imgs_cv[tile_cnt]
+        self.apply_linked_state(_img_cv)
+        with span('tile.render'):
+            img = _img_cv.render_view(self.pyramid_cache)
+        with span('tile.window'):
+            img = self.apply_display_window(img, _img_cv)
+        with span('tile.overlay'):
+            img = self.img_overlay(img, _img_cv)
+        with span('tile.tk_image'):
+            self.tile_grid.set_image_cv(tile_cnt, str(self.img_cnt + tile_cnt), img)
+
     def show_img_path(self, img_cnt):
         if 0 <= img_cnt < len(self.img_paths):
             _img_path = self.img_paths[img_cnt]
@@ -704,12 +1849,46 @@ class ImageViewer:
         if self.topmost:
             self.root.attributes('-topmost', True)
 
+        if dir is None or len(dir) < 1:
+            return
+
         # self.img_path_list = glob.glob(os.path.join(_dir, '*.png'))
 
         dir = os.path.relpath(dir)
-        self.img_paths = glob.glob(f'{dir}/**/{_img_key}', recursive=True)
+        self.prefetcher.cancel()
+        if self.dir_scanner is not None:
+            self.dir_scanner.cancel()
 
-        self.start()
+        self.img_paths = []
+        self.img_cnt = 0
+        self.msg_scan.set('scan: 0')
+
+        self.dir_scanner = DirScanner(dir, _img_key, batch_size=self.param_gui.scan_batch_size)
+        self.dir_scanner.start()
+        self.poll_dir_scanner(self.dir_scanner)
+
+    def poll_dir_scanner(self, scanner, shown=False, delay=100):
+        """
+        探索済みの画像パスを取り込み、1ページ分揃った時点で表示を開始
+        """
+        if scanner is not self.dir_scanner:
+            return
+
+        _is_done = scanner.is_done
+        self.img_paths.extend(scanner.pop())
+
+        if _is_done:
+            self.msg_scan.set(f'found: {len(self.img_paths)}')
+        else:
+            self.msg_scan.set(f'scan: {len(self.img_paths)}')
+
+        if not shown:
+            if _is_done or len(self.img_paths) >= self.img_num_row * self.img_num_col:
+                self.start()
+                shown = True
+
+        if not _is_done:
+            self.root.after(delay, self.poll_dir_scanner, scanner, shown, delay)
 
     def set_img_process(self):
         try:
@@ -740,6 +1919,14 @@ class ImageViewer:
         self.img_num_col = self.param_gui.img_num_col
         self.img_num_row = self.param_gui.img_num_row
         self.topmost = self.param_gui.topmost
+        self.img_cache.set_max_bytes(self.param_gui.cache_max_mb * 1024 * 1024)
+        self.preproc_pipeline.memo.set_max_bytes(self.param_gui.preproc_cache_mb * 1024 * 1024)
+        self.pyramid_cache.set_max_bytes(self.param_gui.pyramid_cache_mb * 1024 * 1024)
+        self.profile_cache.set_max_bytes(self.param_gui.profile_cache_mb * 1024 * 1024)
+        self.hist_index_cache.set_max_bytes(self.param_gui.hist_index_mb * 1024 * 1024)
+        set_tile_cache_bytes(self.param_gui.tile_cache_mb * 1024 * 1024)
+        self.display_window = self.get_display_window()
+        self.display_mode.set(self.display_window.mode)
         if self.topmost:
             self.root.attributes('-topmost', True)
         else:
@@ -771,7 +1958,15 @@ class ImageViewer:
             if event.widget == event.widget.winfo_toplevel():
                 self.root.after(delay, _func2)
 
-        app = ParamWindowForSingleChannel(self.root)
+        # thresholds in the values of the shown images(16bit: 0-65535, float: 0-1)
+        _dtype = next((_img.src_dtype for _img in self.imgs_cv
+                       if _img is not None and not _img.is_preview and _img.src_dtype is not None),
+                      np.dtype(np.uint8))
+        if np.issubdtype(_dtype, np.integer):
+            _max_value = int(np.iinfo(_dtype).max)
+        else:
+            _max_value = 1.0
+        app = ParamWindowForSingleChannel(self.root, max_value=_max_value)
         app.entry_lower.bind('<Return>', _call_entry, add='+')
         app.entry_upper.bind('<Return>', _call_entry, add='+')
         app.check_inv.bind('<Button-1>', _call_entry, add='+')
@@ -780,6 +1975,15 @@ class ImageViewer:
         app.root.bind('<Destroy>', _call_destroy)
 
     def exit(self):
+        if self.dir_scanner is not None:
+            self.dir_scanner.cancel()
+        self.cancel_blob_batch()
+        self.prefetcher.shutdown()
+        self.tile_executor.shutdown(wait=False, cancel_futures=True)
+        self.hist_executor.shutdown(wait=False, cancel_futures=True)
+        self.blob_executor.shutdown(wait=False, cancel_futures=True)
+        if self.thumb_cache is not None:
+            self.thumb_cache.close()
         self.root.destroy()
 
     def close_window(self):
@@ -787,35 +1991,312 @@ class ImageViewer:
         if _ret: self.exit()
 
 
+# ids of ImageCvData: prefix of the keys in the shared caches
+_img_data_ids = itertools.count()
+
+# rectangle histograms being built, by index key: shared by the rebuilt ImageCvData of a page(Tk thread only)
+_hist_futures = {}
+
+
 class ImageCvData:
-    def __init__(self, img_cv, img_win_h, img_win_w):
-        self.img_org = img_cv
+    def __init__(self, img_cv, img_win_h, img_win_w, org_shape=None, img_loader=None, img_key=None,
+                 src_dtype=None):
+        """
+        :param img_cv: 前処理済みの画像。org_shapeを指定した場合は縮小画像
+        :param img_win_h: 表示高さ
+        :param img_win_w: 表示幅
+        :param org_shape: 元画像のサイズ(img_h, img_w)。img_cvが縮小画像の場合に指定
+        :param img_loader: 元画像を読み込む関数。元画像が必要になった時点で呼ぶ
+        :param img_key: 元画像のキー(ImageViewer.get_img_data_key)。共有キャッシュのキーに使用。
+                        Noneの場合はこのインスタンスのみのキー
+        :param src_dtype: 読込画像(前処理前)の型。Noneの場合はimg_cvの型
+        """
+        self._img_org = None
+        self._img_src = img_cv
+        self._img_loader = img_loader
+        self._loader_lock = threading.Lock()
+        if org_shape is None:
+            self._img_org = img_cv
+            if img_cv is not None:
+                org_shape = img_cv.shape[:2]
+        self.org_shape = org_shape
+
         self.img_fit = None
         self.fit_ratio = None
 
         self._img_win_h = img_win_h
         self._img_win_w = img_win_w
 
+        # derived views(hsv, ...), computed lazily once per tile
+        self._views = {}
+
+        # thumbnail shown until the tile is loaded
+        self.is_preview = False
+
+        # bit depth of the decoded image: range of the thresholds
+        self.src_dtype = src_dtype if src_dtype is not None or img_cv is None else img_cv.dtype
+
+        # preprocessed original image in the shared caches
+        self.img_key = img_key if img_key is not None else ('img_data', next(_img_data_ids))
+
+        # profiles: created on the first profile
+        self._profile_index: ProfileIndex = None
+
+        # blobs: analyzed in the background on the first use
+        self._blobs: BlobResult = None
+        self._blob_future = None
+
+        # display window: range computed once per window setting
+        self._display_range = None
+
+        # wheel zoom/pan: created on the first zoom
+        self.viewport: Viewport = None
+        self._pyramid: TilePyramid = None
+        self._view = None
+        self._view_state = None
+        self._render_lock = threading.Lock()
+
         self._fit_window()
 
+    @property
+    def img_org(self):
+        """
+        元画像。縮小画像から表示した場合は、初回アクセス時に読み込む
+        """
+        if self._img_org is None and self._img_loader is not None:
+            # worker(render) and Tk thread: decode only once
+            with self._loader_lock:
+                if self._img_org is None and self._img_loader is not None:
+                    self._img_org = self._img_loader()
+                    self._img_loader = None
+        return self._img_org
+
+    def get_hist_index(self, mode, cache, executor, block=64, is_cancelled=None):
+        """
+        矩形ヒストグラムの索引。無い場合はexecutorで作成を開始し、作成完了まではNone
+
+        :param mode: bgr, hsv
+        :param cache: 索引のキャッシュ(容量上限あり)
+        :param executor: 作成用のスレッドプール
+        :param block: ブロックサイズ[pix]
+        :param is_cancelled: 作成中止を判定する関数
+        """
+        _key = self.img_key + ('hist', mode, block)
+        _index = cache.get(_key)
+        if _index is not None:
+            return _index
+
+        _future = _hist_futures.get(_key)
+        if _future is not None and not _future.done():
+            return None
+
+        _img = self.img_org
+        if not BlockHistIndex.is_supported(_img):
+            return None
+        _index = BlockHistIndex(_img, mode=mode, block=block)
+        if _index.nbytes > cache.max_bytes:
+            return None
+
+        def _build():
+            if _index.build(is_cancelled):
+                cache.put(_key, _index)
+
+        for _done in [_k for _k, _f in _hist_futures.items() if _f.done()]:
+            del _hist_futures[_done]
+        _hist_futures[_key] = executor.submit(_build)
+        return None
+
+    def get_blobs(self, executor, min_area=0, max_bytes=None, is_cancelled=None, on_done=None):
+        """
+        二値画像(単一チャンネル)の連結成分。無い場合はexecutorで解析を開始し、解析完了まではNone。
+        解析は初回のみ行い、最小面積の変更はフィルタのみ更新
+
+        :param executor: 解析用のスレッドプール
+        :param min_area: 最小面積[pix]
+        :param max_bytes: ラベル画像のサイズの上限
+        :param is_cancelled: 解析中止を判定する関数
+        :param on_done: 解析完了時に呼ぶ関数(引数: future)。ワーカースレッドから呼ばれる
+        """
+        if self._blobs is None:
+            # thumbnail: analyzed after the tile is loaded
+            if self.is_preview or self.img_fit is None or len(self.img_fit.shape) != 2:
+                return None
+            if max_bytes is not None and self.org_shape[0] * self.org_shape[1] * 4 > max_bytes:
+                return None
+
+            if self._blob_future is None:
+                def _analyze():
+                    if is_cancelled is not None and is_cancelled():
+                        return None
+                    return analyze_blobs(self.img_org, min_area=min_area)
+
+                self._blob_future = executor.submit(_analyze)
+                if on_done is not None:
+                    self._blob_future.add_done_callback(on_done)
+                return None
+
+            if not self._blob_future.done() or self._blob_future.exception() is not None:
+                return None
+            self._blobs = self._blob_future.result()
+            if self._blobs is None:
+                # cancelled: analyzed again on the next use
+                self._blob_future = None
+                return None
+
+        if self._blobs.min_area != min_area:
+            self._blobs = BlobResult(self._blobs.labels, self._blobs.stats, self._blobs.centroids,
+                                     min_area=min_area)
+        return self._blobs
+
+    def get_display_range(self, window: DisplayWindow):
+        """
+        表示範囲(low, high)。フィット画像から算出し、拡大/移動しても変えない
+        """
+        _key = window.get_key()
+        if self._display_range is None or self._display_range[0] != _key:
+            self._display_range = (_key, window.get_range(self.img_fit))
+        return self._display_range[1]
+
+    def get_profile_index(self, profile_cache):
+        """
+        プロファイル算出用の累積和。初回のみ作成する
+        """
+        if self._profile_index is None:
+            if self.img_org is None:
+                return None
+            self._profile_index = ProfileIndex(self.img_org, profile_cache, key=self.img_key)
+        return self._profile_index
+
+    @property
+    def img_view(self):
+        """
+        表示中の画像。拡大表示していない場合はフィット画像
+        """
+        if self.viewport is None or self.viewport.is_fit() or self._view is None:
+            return self.img_fit
+        return self._view
+
+    def get_viewport(self, max_scale=32.0):
+        if self.viewport is None and self.img_fit is not None:
+            self.viewport = Viewport(self.org_shape[0], self.org_shape[1],
+                                     self.img_fit.shape[0], self.img_fit.shape[1],
+                                     max_scale=max_scale)
+        return self.viewport
+
+    def render_view(self, pyramid_cache):
+        """
+        表示範囲を描画。表示範囲が変わった場合のみ、ピラミッドの該当タイルから作成する
+
+        :param pyramid_cache: ピラミッドのタイルのキャッシュ
+        :return: 表示画像
+        """
+        if self.viewport is None or self.viewport.is_fit():
+            return self.img_fit
+
+        # snapshot: the Tk thread may zoom/pan while rendering on the pool
+        _viewport = copy.copy(self.viewport)
+        _state = _viewport.get_state()
+        if self._view is not None and self._view_state == _state:
+            return self._view
+
+        # being rendered on the pool: show the previous view until it is done
+        if not self._render_lock.acquire(blocking=False):
+            return self._view if self._view is not None else self.img_fit
+        try:
+            if self._pyramid is None:
+                _img = self.img_org
+                if _img is None:
+                    return self.img_fit
+                self._pyramid = TilePyramid(_img, pyramid_cache, key=self.img_key)
+
+            self._view = self._pyramid.render(_viewport)
+            self._view_state = _state
+            return self._view
+        finally:
+            self._render_lock.release()
+
+    def is_view_ready(self) -> bool:
+        """
+        表示範囲の描画が済んでいるか(render_viewが描画せずに返すか)
+        """
+        if self.viewport is None or self.viewport.is_fit():
+            return True
+        return self._view is not None and self._view_state == self.viewport.get_state()
+
+    def get_transform(self):
+        """
+        表示座標 -> 元画像の座標: (倍率, 左上のx, 左上のy)
+        """
+        if self.viewport is None or self.viewport.is_fit():
+            return self.fit_ratio, 0.0, 0.0
+        _ox, _oy = self.viewport.get_origin()
+        return self.viewport.scale, _ox, _oy
+
+    def gui2org(self, gui_x, gui_y):
+        _scale, _ox, _oy = self.get_transform()
+        return _ox + gui_x / _scale, _oy + gui_y / _scale
+
+    def org2gui(self, x, y):
+        _scale, _ox, _oy = self.get_transform()
+        return (x - _ox) * _scale, (y - _oy) * _scale
+
+    def get_view(self, view_type='hsv', use_org_img=False):
+        """
+        派生画像を取得。初回のみ変換し、以降はキャッシュを返す
+
+        :param view_type: 変換タイプ: hsv, gray
+        :param use_org_img: 元画像を使用するか、GUIにフィットした画像を使用するか
+        :return:
+        """
+        _key = (view_type, use_org_img)
+        if _key in self._views:
+            return self._views[_key]
+
+        img = self.img_org if use_org_img else self.img_fit
+        if img is None or img.ndim != 3:
+            return None
+        # large image(LazyImage): not converted as a whole
+        if not isinstance(img, np.ndarray):
+            return None
+
+        if view_type == 'hsv':
+            _view = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        elif view_type == 'gray':
+            _view = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            raise ValueError('illegal type')
+
+        self._views[_key] = _view
+        return _view
+
+    @traced('fit_window')
     def _fit_window(self):
-        if self.img_org is None: return
+        if self._img_src is None: return
 
         try:
-            img_h = self.img_org.shape[0]
-            img_w = self.img_org.shape[1]
+            img_h = self.org_shape[0]
+            img_w = self.org_shape[1]
 
             _h_ratio = self._img_win_h / img_h
             _w_ratio = self._img_win_w / img_w
             _ratio = min(_h_ratio, _w_ratio)
 
-            self.img_fit = cv2.resize(self.img_org,
-                                  (int(img_w * _ratio), int(img_h * _ratio)))
+            if _ratio < 1:
+                _interpolation = cv2.INTER_AREA
+            else:
+                _interpolation = cv2.INTER_LINEAR
+
+            self.img_fit = cv2.resize(self._img_src,
+                                      (int(img_w * _ratio), int(img_h * _ratio)),
+                                      interpolation=_interpolation)
             self.fit_ratio = _ratio
         except:
             self.img_fit = None
             self.fit_ratio = None
 
+        # reduced image is no longer needed
+        self._img_src = None
+
 
 class ImageInfo:
     def __init__(self, use_org_img=False):
@@ -829,6 +2310,9 @@ class ImageInfo:
 
         self.img = None
         self.fit_ratio = None
+        self.origin_x = 0.0
+        self.origin_y = 0.0
+        self.org_shape = None
         self.gui_x = None
         self.gui_y = None
 
@@ -853,31 +2337,40 @@ class ImageInfo:
         # img shape
         self.img_h = self.img.shape[0]
         self.img_w = self.img.shape[1]
-        if not self.use_org_img:
+        if self.org_shape is not None:
+            self.img_h_org = self.org_shape[0]
+            self.img_w_org = self.org_shape[1]
+        elif not self.use_org_img:
             self.img_h_org = int(self.img_h / self.fit_ratio)
             self.img_w_org = int(self.img_w / self.fit_ratio)
 
-        # x/y position
+        # x/y position: origin is the top-left of the view(wheel zoom)
         if self.use_org_img:
-            _x = int(self.gui_x / self.fit_ratio)
-            _y = int(self.gui_y / self.fit_ratio)
-            self.x_fit = int(_x * self.fit_ratio)
-            self.y_fit = int(_y * self.fit_ratio)
+            _x = int(self.gui_x / self.fit_ratio + self.origin_x)
+            _y = int(self.gui_y / self.fit_ratio + self.origin_y)
+            self.x_fit = int((_x - self.origin_x) * self.fit_ratio)
+            self.y_fit = int((_y - self.origin_y) * self.fit_ratio)
         else:
             _x = self.gui_x
             _y = self.gui_y
-            self.x_org = int(_x / self.fit_ratio)
-            self.y_org = int(_y / self.fit_ratio)
+            self.x_org = int(_x / self.fit_ratio + self.origin_x)
+            self.y_org = int(_y / self.fit_ratio + self.origin_y)
+            self.x_fit = _x
+            self.y_fit = _y
 
-        self.x = min(_x, self.img_w - 5)
-        self.y = min(_y, self.img_h - 5)
+        self.x = min(max(_x, 0), self.img_w - 1)
+        self.y = min(max(_y, 0), self.img_h - 1)
 
         # image value
         self.val = self.img[self.y, self.x]
 
+        # convert only the sampled pixel, not the whole image
         try:
-            _img_hsv = cv2.cvtColor(self.img, cv2.COLOR_BGR2HSV)
-            self.hsv = _img_hsv[self.y, self.x]
+            _pix = self.img[self.y:self.y + 1, self.x:self.x + 1]
+            # HSV of 16bit images: float(h: 0-360, s: 0-1, v: original values), as preproc_color
+            if _pix.dtype not in (np.uint8, np.float32):
+                _pix = _pix.astype(np.float32)
+            self.hsv = cv2.cvtColor(_pix, cv2.COLOR_BGR2HSV)[0, 0]
         except:
             self.hsv = ''
 
@@ -891,6 +2384,25 @@ def draw_rectangle(img, x0, x1, y0, y1, line_thick=2, line_color=(255, 0, 0)):
     return img
 
 
+def draw_boxes(img, boxes, scale, ox, oy, max_num=5000, line_color=(0, 255, 255)):
+    """
+    外接矩形(元画像の座標: x, y, w, h)を表示画像に描画。表示範囲内のみ、最大max_num個
+    """
+    if len(boxes) == 0: return img
+
+    _boxes = np.asarray(boxes, dtype=np.float64)
+    x0 = np.floor((_boxes[:, 0] - ox) * scale).astype(np.int64)
+    y0 = np.floor((_boxes[:, 1] - oy) * scale).astype(np.int64)
+    x1 = np.ceil((_boxes[:, 0] + _boxes[:, 2] - ox) * scale).astype(np.int64)
+    y1 = np.ceil((_boxes[:, 1] + _boxes[:, 3] - oy) * scale).astype(np.int64)
+
+    _visible = np.flatnonzero((x1 >= 0) & (y1 >= 0) & (x0 < img.shape[1]) & (y0 < img.shape[0]))
+    for _idx in _visible[:max_num]:
+        cv2.rectangle(img, (int(x0[_idx]), int(y0[_idx])), (int(x1[_idx]), int(y1[_idx])),
+                      color=line_color, thickness=1)
+    return img
+
+
 def main():
     app = ImageViewer()
 
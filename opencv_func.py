@@ -1,10 +1,58 @@
 import os
+from functools import lru_cache
 from logging import getLogger, Logger
 
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
+from profile_engine import get_band
+
+POINT_OPS = ('intensity', 'gamma', 'inverse', 'threshold')
+
+
+def _point_op_lut(op: tuple, dtype=np.uint8) -> np.array:
+    """
+    点演算1つ分のLUT(8bit: 256要素, 16bit: 65536要素)。
+    画像に直接適用した場合と同じ値(切り捨て、型の範囲でクリップ)とする
+    """
+    _name = op[0]
+    _max = np.iinfo(dtype).max
+    _vals = np.arange(_max + 1, dtype=np.float64)
+
+    if _name == 'intensity':
+        _coeff, _offset = op[1:]
+        return np.clip(_coeff * _vals + _offset, 0, _max).astype(dtype)
+    elif _name == 'gamma':
+        _gamma, = op[1:]
+        return np.round(_max * (_vals / _max) ** (1.0 / _gamma)).astype(dtype)
+    elif _name == 'inverse':
+        return (_max - _vals).astype(dtype)
+    elif _name == 'threshold':
+        _low, _high, _inverse = op[1:]
+        _fg = (_vals >= _low) & (_vals <= _high)
+        return np.where(_fg != _inverse, _max, 0).astype(dtype)
+    else:
+        raise ValueError(f'illegal point operation: {_name}')
+
+
+@lru_cache(maxsize=64)
+def make_point_lut(ops: tuple, dtype=np.uint8) -> np.array:
+    """
+    点演算の列を1つに合成したLUT。同じ条件のLUTは使い回す(書込不可)
+
+    :param ops: 点演算のタプル: ('intensity', coeff, offset), ('gamma', gamma), ('inverse',),
+                ('threshold', lower, upper, inverse)。値は画像の型の範囲(8bit: 0-255, 16bit: 0-65535)
+    :param dtype: np.uint8(256要素), np.uint16(65536要素)
+    :return: LUT(dtypeと同じ型)
+    """
+    lut = np.arange(np.iinfo(dtype).max + 1, dtype=dtype)
+    for _op in ops:
+        lut = _point_op_lut(_op, dtype)[lut]
+
+    lut.flags.writeable = False
+    return lut
+
 
 class ImageFunc:
     """
@@ -176,18 +224,107 @@ class ImageFunc:
         return img
 
     @classmethod
-    def convert_intensity(cls, img:np.array, coeff:float=1.0, offset:float=0.0):
+    def convert_intensity(cls, img:np.array, coeff:float=1.0, offset:float=0.0, inplace:bool=False):
+        """
+        輝度変換: coeff * img + offset。画像の型を保ち、整数は型の範囲(8bit: 0-255, 16bit: 0-65535)でクリップ。
+        8bit/16bit画像はLUTで変換、floatはクリップなし
+
+        :param img: 入力画像
+        :param coeff: 係数
+        :param offset: オフセット
+        :param inplace: 入力画像を書き換えるか(8bit/16bitのみ)
+        :return:
+        """
         # check image
         if img is None:
             if cls.debug:
                 cls.logger.warning(f'No Image')
             return None
 
+        if img.dtype in (np.uint8, np.uint16):
+            return cls.point_ops(img, [('intensity', coeff, offset)], inplace=inplace)
+
+        _dtype = img.dtype
         img = coeff * img + offset
-        img = np.clip(img, 0, 255).astype(np.uint8)
+        if np.issubdtype(_dtype, np.integer):
+            _info = np.iinfo(_dtype)
+            img = np.clip(img, _info.min, _info.max)
+        img = img.astype(_dtype, copy=False)
 
         return img
 
+    @classmethod
+    def convert_gamma(cls, img:np.array, gamma:float=1.0, inplace:bool=False):
+        """
+        ガンマ補正: max * (img / max) ^ (1 / gamma)。maxは型の最大値(8bit: 255, 16bit: 65535)。8bit/16bitのみ
+
+        :param img: 入力画像
+        :param gamma: ガンマ(1より大きいと明るくなる)
+        :param inplace: 入力画像を書き換えるか
+        :return:
+        """
+        return cls.point_ops(img, [('gamma', gamma)], inplace=inplace)
+
+    @classmethod
+    def invert(cls, img:np.array, inplace:bool=False):
+        """
+        階調反転: max - img。8bit/16bitのみ
+
+        :param img: 入力画像
+        :param inplace: 入力画像を書き換えるか
+        :return:
+        """
+        return cls.point_ops(img, [('inverse',)], inplace=inplace)
+
+    @classmethod
+    def threshold_lut(cls, img:np.array, thres_min=0, thres_max=255, inverse=False, inplace:bool=False):
+        """
+        二値化(チャンネルごと, ２つの閾値): thres_min <= img <= thres_maxを型の最大値、その他を0。8bit/16bitのみ
+
+        :param img: 入力画像
+        :param thres_min: 画像の値の範囲で指定
+        :param thres_max: 画像の値の範囲で指定
+        :param inverse: 範囲外を最大値とするか
+        :param inplace: 入力画像を書き換えるか
+        :return:
+        """
+        return cls.point_ops(img, [('threshold', thres_min, thres_max, bool(inverse))], inplace=inplace)
+
+    @classmethod
+    def point_ops(cls, img:np.array, ops, inplace:bool=False):
+        """
+        点演算の列を1つのLUTに合成し、1回だけ変換(8bit: cv2.LUT, 16bit: 65536要素のLUTをnp.takeで参照)
+        例: ImageFunc.point_ops(img, [('intensity', 1.3, 0.0), ('gamma', 2.2), ('threshold', 128, 255, False)])
+
+        :param img: 入力画像(8bit/16bit)。値は画像の型の範囲のまま変換する
+        :param ops: 点演算のリスト(make_point_lutを参照)
+        :param inplace: 入力画像を書き換えるか
+        :return:
+        """
+        # check image
+        if img is None:
+            if cls.debug:
+                cls.logger.warning(f'No Image')
+            return None
+        if img.dtype not in (np.uint8, np.uint16):
+            raise ValueError('point operations need an 8bit or 16bit image')
+
+        _lut = make_point_lut(tuple(tuple(_op) for _op in ops), img.dtype.type)
+
+        if img.dtype == np.uint16:
+            if inplace and img.flags.writeable:
+                return np.take(_lut, img, out=img)
+            return np.take(_lut, img)
+
+        if inplace and img.flags.writeable:
+            if img.flags.c_contiguous:
+                cv2.LUT(img, _lut, dst=img)
+            else:
+                img[...] = cv2.LUT(img, _lut)
+            return img
+
+        return cv2.LUT(img, _lut)
+
     @classmethod
     def threshold_gray(cls, img_bgr, thres=0, type='gray', inverse=False):
         """
@@ -366,17 +503,18 @@ class ImageFunc:
 
     @classmethod
     def check_profile(cls, img, x, y, direction='hor',
-                      width=20, average=True, ch_type='all'):
+                      width=20, average=True, ch_type='all', index=None):
         """
-        プロファイル算出
+        プロファイル算出。平均プロファイルは累積和(ProfileIndex)の差分から算出
 
         :param img:
         :param x:
         :param y:
         :param direction:
-        :param width:
+        :param width: 平均する幅[pix]。位置x(y)を中心とし、画像端では範囲内にずらす
         :param average:
         :param ch_type:
+        :param index: ProfileIndex。指定した場合は累積和から算出
         :return:
         """
         _pos = None
@@ -399,42 +537,26 @@ class ImageFunc:
                 ch = 0
 
             if direction == 'hor':
-                y0 = max(y - (width - 1) / 2, 0)
-                y1 = min(y + (width - 1) / 2, img_h - 5)
-
                 _pos = np.arange(0, img_w)
-
-                if average:
-                    if ch_type == 'all' or img.ndim < 3:
-                        _profile = np.mean(img[int(y0):int(y1), :], axis=0)
-                    else:
-                        _profile = np.mean(img[int(y0):int(y1), :, ch], axis=0)
-                else:
-                    if img.ndim != 3:
-                        _profile = img[int(y0):int(y1), :]
-                    else:
-                        _profile = img[int(y0):int(y1), :, ch]
-                    _profile = _profile.T
-
+                _start, _stop = get_band(y, width, img_h)
             else:
-                x0 = max(x - (width - 1) / 2, 0)
-                x1 = min(x + (width - 1) / 2, img_w - 5)
-
                 _pos = np.arange(0, img_h)
+                _start, _stop = get_band(x, width, img_w)
 
-                if average:
-                    if ch_type == 'all' or img.ndim < 3:
-                        _profile = np.mean(img[:, int(x0):int(x1)], axis=1)
-                    else:
-                        _profile = np.mean(img[:, int(x0):int(x1), ch], axis=1)
-                else:
-                    if img.ndim != 3:
-                        _profile = img[:, int(x0):int(x1), :]
-                    else:
-                        _profile = img[:, int(x0):int(x1), ch]
-                    _profile = _profile.T
+            # band: (length, width[, channel])
+            if average and index is not None:
+                _profile = index.band_mean(direction, _start, _stop)
+            elif direction == 'hor':
+                _profile = np.asarray(img[_start:_stop, :]).swapaxes(0, 1)
+            else:
+                _profile = np.asarray(img[:, _start:_stop])
+
+            if average and index is None:
+                _profile = np.mean(_profile, axis=1)
 
-            # viewer = ProfileViewer(_pos, _profile)
+            # color: selected channel(without averaging: always one channel)
+            if img.ndim == 3 and (ch_type != 'all' or not average):
+                _profile = _profile[..., ch]
 
         except Exception as err:
             print(err)
@@ -442,13 +564,42 @@ class ImageFunc:
         return _pos, _profile
 
     @classmethod
-    def check_histgram(cls, img, x0, x1, y0, y1):
+    def check_histgram(cls, img, x0, x1, y0, y1, hsv=False):
+        """
+        ヒストグラム算出
+
+        :param img:
+        :param x0:
+        :param x1:
+        :param y0:
+        :param y1:
+        :param hsv: 切り出した範囲のみHSVへ変換して算出
+        :return:
+        """
+        _, _hist_list = cls.check_histgram_bins(img, x0, x1, y0, y1, hsv=hsv)
+        return _hist_list
+
+    @classmethod
+    def check_histgram_bins(cls, img, x0, x1, y0, y1, hsv=False, bins=256):
+        """
+        ヒストグラム算出(binの画素値付き)
+        8bit画像は画素値ごと(0-255)、その他は切り出した範囲の最小-最大をbins分割(整数は整数幅)して算出
+
+        :param img:
+        :param x0:
+        :param x1:
+        :param y0:
+        :param y1:
+        :param hsv: 切り出した範囲のみHSVへ変換して算出
+        :param bins: 8bit以外の画像のbin数
+        :return: (各binの下限の画素値, チャンネルごとのヒストグラム)
+        """
 
         _hist_list = []
 
         try:
             if img is None:
-                return
+                return None, []
 
             img_h = img.shape[0]
             img_w = img.shape[1]
@@ -463,20 +614,44 @@ class ImageFunc:
             _y1 = int(min(_y1, img_h))
 
             img = img[_y0:_y1, _x0:_x1]
+            if hsv and img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+            if img.dtype == np.uint8:
+                _ranges = [0, 256]
+                _bins = 256
+                _x = np.arange(256)
+            else:
+                img = np.asarray(img)
+                if img.dtype not in (np.uint16, np.float32):
+                    img = img.astype(np.float32)
+
+                _min = float(np.nanmin(img))
+                _max = float(np.nanmax(img))
+                if img.dtype == np.uint16:
+                    # integer width: no empty bins between the values
+                    _width = max(int(np.ceil((_max + 1 - _min) / bins)), 1)
+                    _bins = int(np.ceil((_max + 1 - _min) / _width))
+                    _ranges = [_min, _min + _width * _bins]
+                else:
+                    _width = (_max - _min) / bins if _max > _min else 1.0
+                    _bins = bins
+                    _ranges = [_min, _min + _width * bins * (1 + 1e-6)]
+                _x = _min + _width * np.arange(_bins)
 
             if img.ndim==3:
                 for ch_cnt in range(3):
-                    _hist = cv2.calcHist([img], [ch_cnt], None, [256], [0, 256])
+                    _hist = cv2.calcHist([img], [ch_cnt], None, [_bins], _ranges)
                     _hist_list.append(_hist)
             else:
-                _hist = cv2.calcHist([img], [0], None, [256], [0, 256])
+                _hist = cv2.calcHist([img], [0], None, [_bins], _ranges)
                 _hist_list.append(_hist)
 
         except Exception as err:
             print(err)
-            return []
+            return None, []
 
-        return _hist_list
+        return _x, _hist_list
 
 
 def main():
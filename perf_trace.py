@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+
+import numpy as np
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 't0')
+
+    def __init__(self, tracer, name, cat):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.t0 = None
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.tracer.add(self.name, time.perf_counter() - self.t0, t0=self.t0, cat=self.cat)
+        return False
+
+
+class Tracer:
+    """
+    処理時間の計測(スパン)。スパン名ごとに直近size件の時間をリングバッファに保持し、p50/p95/maxを算出する。
+    全スパンの直近max_events件はChrome trace形式(chrome://tracing, Perfetto)で出力できる。
+    ワーカースレッドからも使用可能
+    """
+
+    def __init__(self, size: int = 512, max_events: int = 20000, enabled: bool = True):
+        """
+        :param size: スパン名ごとに保持する件数
+        :param max_events: Chrome trace用に保持するイベント数
+        :param enabled: 計測するか
+        """
+        self.size = size
+        self.enabled = enabled
+
+        self._spans = {}
+        self._counts = {}
+        self._events = deque(maxlen=max_events)
+        self._t_origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def span(self, name: str, cat: str = 'viewer'):
+        """
+        withで囲んだ範囲の時間を計測
+
+        :param name: スパン名
+        :param cat: 分類(Chrome traceのcategory)
+        """
+        return _Span(self, name, cat)
+
+    def add(self, name: str, sec: float, t0: float = None, cat: str = 'viewer') -> None:
+        """
+        計測済みの時間を追加
+
+        :param name: スパン名
+        :param sec: 時間[sec]
+        :param t0: 開始時刻(time.perf_counter)。Noneの場合は現在時刻-sec
+        :param cat: 分類
+        """
+        if not self.enabled:
+            return
+        if t0 is None:
+            t0 = time.perf_counter() - sec
+
+        with self._lock:
+            _buf = self._spans.get(name)
+            if _buf is None:
+                _buf = deque(maxlen=self.size)
+                self._spans[name] = _buf
+            _buf.append(sec)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._events.append((name, cat, t0, sec, threading.get_ident()))
+
+    def last(self, name: str):
+        """
+        直近の時間[sec]。無い場合はNone
+        """
+        with self._lock:
+            _buf = self._spans.get(name)
+            return _buf[-1] if _buf else None
+
+    def get_stats(self) -> dict:
+        """
+        スパン名ごとの統計量[msec](リングバッファ内)と累計の件数
+        """
+        with self._lock:
+            _spans = {_name: np.array(_buf) for _name, _buf in self._spans.items()}
+            _counts = dict(self._counts)
+
+        res = {}
+        for _name, _times in sorted(_spans.items()):
+            if len(_times) == 0:
+                continue
+            _times = _times * 1000
+            res[_name] = {"count": _counts[_name],
+                          "last_msec": float(_times[-1]),
+                          "p50_msec": float(np.percentile(_times, 50)),
+                          "p95_msec": float(np.percentile(_times, 95)),
+                          "max_msec": float(_times.max()),
+                          }
+        return res
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._counts.clear()
+            self._events.clear()
+
+    def export_chrome_trace(self, path: str) -> int:
+        """
+        Chrome trace形式(JSON)で出力
+
+        :param path: 出力先
+        :return: イベント数
+        """
+        with self._lock:
+            _events = list(self._events)
+
+        _pid = os.getpid()
+        _tids = {}
+        _trace = []
+        for _name, _cat, _t0, _sec, _ident in _events:
+            _tid = _tids.setdefault(_ident, len(_tids))
+            _trace.append({"name": _name, "cat": _cat, "ph": 'X',
+                           "ts": (_t0 - self._t_origin) * 1e6,
+                           "dur": _sec * 1e6,
+                           "pid": _pid, "tid": _tid})
+
+        # thread names of the recorded threads
+        _names = {_t.ident: _t.name for _t in threading.enumerate()}
+        for _ident, _tid in _tids.items():
+            _trace.append({"name": 'thread_name', "ph": 'M', "pid": _pid, "tid": _tid,
+                           "args": {"name": _names.get(_ident, str(_ident))}})
+
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": _trace, "displayTimeUnit": 'ms'}, f)
+        return len(_events)
+
+
+# shared tracer of the viewer
+tracer = Tracer()
+
+
+def span(name: str, cat: str = 'viewer'):
+    return tracer.span(name, cat)
+
+
+def traced(name: str, cat: str = 'viewer'):
+    """
+    関数全体の時間を計測するデコレータ
+    """
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            with tracer.span(name, cat):
+                return func(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+
+if __name__ == '__main__':
+    pass
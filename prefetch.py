@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PagePrefetcher:
+    """
+    表示中ページの前後ページをバックグラウンドで読み込むクラス。
+    読込処理(load_page)はワーカースレッドで実行し、結果はroot.afterでTkスレッドへ返す。
+    表示位置や表示条件(page_key)が変わった場合は、古い読込を破棄する。
+    """
+
+    def __init__(self, root, load_page, max_workers: int = 2, num_next: int = 2, num_prev: int = 1):
+        """
+        :param root: Tkのルートウインドウ
+        :param load_page: load_page(img_cnt, is_cancelled) -> ページ内画像のリスト
+        :param max_workers: ワーカー数
+        :param num_next: 先読みする次ページ数
+        :param num_prev: 先読みする前ページ数
+        """
+        self.root = root
+        self.load_page = load_page
+        self.num_next = num_next
+        self.num_prev = num_prev
+
+        self.generation = 0
+        self.page_key = None
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='prefetch')
+        self._pages: OrderedDict = OrderedDict()
+        self._futures: dict = {}
+
+    def pop(self, img_cnt: int, page_key, img_paths: list):
+        """
+        先読み済みのページを取得。無い場合はNone
+
+        :param img_cnt: ページ先頭の画像番号
+        :param page_key: 表示条件
+        :param img_paths: ページ内の画像パス(読込時と一致するか確認)
+        :return: ページ内画像のリスト
+        """
+        if page_key != self.page_key:
+            return None
+
+        _page = self._pages.pop(img_cnt, None)
+        if _page is None:
+            return None
+
+        _paths, _imgs = _page
+        if _paths != list(img_paths):
+            return None
+
+        return _imgs
+
+    def schedule(self, img_cnt: int, page_size: int, img_paths: list, page_key) -> None:
+        """
+        現在のページ位置から前後ページの先読みを登録
+
+        :param img_cnt: 表示中ページ先頭の画像番号
+        :param page_size: 1ページの画像数
+        :param img_paths: 全画像パス
+        :param page_key: 表示条件
+        """
+        if page_key != self.page_key:
+            self.cancel()
+            self.page_key = page_key
+
+        _targets = []
+        for _cnt in range(1, self.num_next + 1):
+            _targets.append(img_cnt + _cnt * page_size)
+        for _cnt in range(1, self.num_prev + 1):
+            _targets.append(img_cnt - _cnt * page_size)
+        _targets = [_t for _t in _targets if 0 <= _t < len(img_paths)]
+
+        # drop pages/works out of range
+        for _t in list(self._pages.keys()):
+            if _t not in _targets:
+                del self._pages[_t]
+        for _t in list(self._futures.keys()):
+            if _t not in _targets:
+                self._futures.pop(_t).cancel()
+
+        for _t in _targets:
+            if _t in self._pages or _t in self._futures:
+                continue
+            _paths = list(img_paths[_t:_t + page_size])
+            self._submit(_t, _paths)
+
+    def cancel(self) -> None:
+        """
+        全ての先読みを破棄
+        """
+        self.generation += 1
+        for _future in self._futures.values():
+            _future.cancel()
+        self._futures.clear()
+        self._pages.clear()
+
+    def shutdown(self) -> None:
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, img_cnt, img_paths):
+        _gen = self.generation
+
+        def _is_cancelled():
+            return _gen != self.generation
+
+        def _work():
+            if _is_cancelled():
+                return None
+            return self.load_page(img_cnt, _is_cancelled)
+
+        def _done(future):
+            # called in worker thread: hand over to Tk thread
+            try:
+                self.root.after(0, self._on_done, _gen, img_cnt, img_paths, future)
+            except Exception:
+                pass
+
+        _future = self._executor.submit(_work)
+        self._futures[img_cnt] = _future
+        _future.add_done_callback(_done)
+
+    def _on_done(self, gen, img_cnt, img_paths, future):
+        if gen != self.generation:
+            return
+        if self._futures.get(img_cnt) is future:
+            del self._futures[img_cnt]
+        if future.cancelled():
+            return
+
+        try:
+            _imgs = future.result()
+        except Exception as err:
+            print(err)
+            return
+
+        if _imgs is not None:
+            self._pages[img_cnt] = (img_paths, _imgs)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,263 @@
+import time
+
+import cv2
+import numpy as np
+
+from opencv_func import ImageFunc
+from img_cache import ImageCache
+
+
+class PreprocParams:
+    """
+    画像の前処理条件: 単一チャンネル化 -> 二値化 -> ズーム
+    ズームの場合は先に切り出してから処理する。marginは近傍処理(画像処理)用の余白[pix]
+    """
+
+    def __init__(self, color='color',
+                 thres_flg=False, thres=None,
+                 zoom=False, pos0=None, pos1=None, margin=0):
+        self.color = color
+        self.thres_flg = thres_flg
+        self.thres = thres if thres is not None else {}
+        self.zoom = zoom
+        self.pos0 = pos0
+        self.pos1 = pos1
+        self.margin = margin
+
+    def get_key(self):
+        # the zoom area only matters while zooming(linked views keep it without cropping)
+        if self.zoom:
+            _zoom = (self.pos0, self.pos1, self.margin)
+        else:
+            _zoom = None
+        return (self.color,
+                self.thres_flg, tuple(sorted(self.thres.items())),
+                self.zoom, _zoom)
+
+
+def get_zoom_rect(img_shape, pos0, pos1, margin=0):
+    """
+    余白付きの切り出し範囲と、処理後に取り除く余白
+
+    :param img_shape: 元画像のサイズ
+    :param pos0: 始点(x, y)
+    :param pos1: 終点(x, y)
+    :param margin: 余白[pix]。画像外は含めない
+    :return: (y0, y1, x0, x1), (top, bottom, left, right)
+    """
+    img_h = img_shape[0]
+    img_w = img_shape[1]
+
+    # same clipping as numpy slicing of the zoom rectangle
+    _y0, _y1, _ = slice(min(pos0[1], pos1[1]), max(pos0[1], pos1[1])).indices(img_h)
+    _x0, _x1, _ = slice(min(pos0[0], pos1[0]), max(pos0[0], pos1[0])).indices(img_w)
+    _y1 = max(_y0, _y1)
+    _x1 = max(_x0, _x1)
+
+    y0 = max(_y0 - margin, 0)
+    y1 = min(_y1 + margin, img_h)
+    x0 = max(_x0 - margin, 0)
+    x1 = min(_x1 + margin, img_w)
+
+    return (y0, y1, x0, x1), (_y0 - y0, y1 - _y1, _x0 - x0, x1 - _x1)
+
+
+def preproc_color(img: np.array, color: str = 'color') -> np.array:
+    """
+    単一チャンネル化
+
+    :param img: 入力画像
+    :param color: color, gray, blue, green, red, h, s, v
+    :return:
+    """
+    # HSV of 16bit images: float(h: 0-360, s: 0-1, v: original values)
+    if img.ndim == 3 and color in ('h', 's', 'v') and img.dtype not in (np.uint8, np.float32):
+        img = img.astype(np.float32)
+
+    if img.ndim == 3:
+        if color == 'gray':
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        elif color == 'blue':
+            img = img[:, :, 0]
+        elif color == 'green':
+            img = img[:, :, 1]
+        elif color == 'red':
+            img = img[:, :, 2]
+        elif color == 'h':
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            img = img[:, :, 0]
+        elif color == 's':
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            img = img[:, :, 1]
+        elif color == 'v':
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            img = img[:, :, 2]
+
+    return img
+
+
+def preproc_threshold(img: np.array, thres_flg: bool = False, thres: dict = None) -> np.array:
+    """
+    二値化(単一チャンネルのみ)
+
+    :param img: 入力画像
+    :param thres_flg: 二値化するか
+    :param thres: ParamsForSingleChannel.get_result_dict()の結果
+    :return:
+    """
+    if thres_flg and img.ndim != 3:
+        if thres is not None and len(thres) > 0:
+            _low = thres['value_lower']
+            _high = thres['value_upper']
+            img = ImageFunc.threshold_gray2(img, thres_min=_low, thres_max=_high)
+
+    return img
+
+
+def _stage_crop(img, param):
+    if param is None:
+        return img
+    _y0, _y1, _x0, _x1 = param
+    return img[_y0:_y1, _x0:_x1]
+
+
+def _stage_color(img, param):
+    return preproc_color(img, param)
+
+
+def _stage_threshold(img, param):
+    _thres_flg, _thres = param
+    return preproc_threshold(img, _thres_flg, dict(_thres))
+
+
+def _stage_proc(img, param):
+    if param is None:
+        return img
+    return param(img)
+
+
+def _stage_trim(img, param):
+    if param is None or param == (0, 0, 0, 0):
+        return img
+    _top, _bottom, _left, _right = param
+    return img[_top:img.shape[0] - _bottom, _left:img.shape[1] - _right]
+
+
+class PreprocPipeline:
+    """
+    前処理を名前付きの段に分けて実行するクラス: crop -> color -> threshold -> proc -> trim
+    ズームの場合は先に(余白付きで)切り出し、単一チャンネル化以降は切り出した範囲のみ処理する。
+    各段の出力を(画像キー, その段までの条件)ごとにメモ化し、条件が変わった段以降のみ再実行する。
+    メモ化した画像は共有されるため、書き換える段(inplace)の入力のみコピーする。
+    切り出しなどのビューはメモ化する際にコピーし、キャッシュの容量に元画像全体が残らないようにする。
+    """
+
+    # (name, func, inplace)
+    STAGES = (('crop', _stage_crop, False),
+              ('color', _stage_color, False),
+              ('threshold', _stage_threshold, False),
+              ('proc', _stage_proc, True),
+              ('trim', _stage_trim, False),
+              )
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        self.memo = ImageCache(max_bytes=max_bytes)
+
+    @staticmethod
+    def get_stage_params(params: PreprocParams, img_shape, func_proc=None) -> dict:
+        """
+        各段の条件(ハッシュ可能な値)
+        """
+        _rect = None
+        _trim = None
+        if params.zoom and params.pos0 is not None and params.pos1 is not None:
+            # the margin only matters for the user process
+            _margin = params.margin if func_proc is not None else 0
+            _rect, _trim = get_zoom_rect(img_shape, params.pos0, params.pos1, _margin)
+
+        res = {"crop": _rect,
+               "color": params.color,
+               "threshold": (params.thres_flg, tuple(sorted(params.thres.items()))),
+               "proc": func_proc,
+               "trim": _trim,
+               }
+        return res
+
+    def run(self, img_key, img_cv: np.array, params: PreprocParams,
+            func_proc=None, timings: dict = None) -> np.array:
+        """
+        前処理を実行
+
+        :param img_key: 画像のキー(ImageCache.make_keyなど)。Noneの場合はメモ化しない
+        :param img_cv: 入力画像。書き換えない
+        :param params: 前処理条件
+        :param func_proc: 任意の画像処理(image_proc.img_procなど)
+        :param timings: 指定した場合は各段の時間[sec]を加算
+        :return: 前処理後の画像。メモ化した画像と共有するため書き換えないこと
+        """
+        if img_cv is None: return None
+
+        _stage_params = self.get_stage_params(params, img_cv.shape, func_proc)
+
+        _keys = []
+        _key = (img_key,)
+        for _name, _, _ in self.STAGES:
+            _key = _key + ((_name, _stage_params[_name]),)
+            _keys.append(_key)
+
+        # resume from the deepest memoized stage
+        img = img_cv
+        _start = 0
+        if img_key is not None:
+            for _cnt in reversed(range(len(self.STAGES))):
+                _img = self.memo.get(_keys[_cnt])
+                if _img is not None:
+                    img = _img
+                    _start = _cnt + 1
+                    break
+
+        for _cnt in range(_start, len(self.STAGES)):
+            _name, _func, _inplace = self.STAGES[_cnt]
+
+            _param = _stage_params[_name]
+            if _inplace and _param is not None:
+                _img_in = img.copy()
+            else:
+                _img_in = img
+
+            _t0 = time.perf_counter()
+            _img = _func(_img_in, _param)
+            if timings is not None:
+                timings[_name] = timings.get(_name, 0.0) + time.perf_counter() - _t0
+
+            if _img is None:
+                return None
+
+            # no-op stages return their input: nothing to memoize
+            if img_key is not None and _img is not img:
+                # views(crop, trim, channel) keep the whole parent alive: memoize a compact copy
+                if isinstance(_img, np.ndarray) and _img.base is not None:
+                    _img = _img.copy()
+                self.memo.put(_keys[_cnt], _img)
+            img = _img
+
+        return img
+
+
+def img_preproc(img_cv: np.array, params: PreprocParams, timings: dict = None) -> np.array:
+    """
+    前処理(メモ化なし): ズーム -> 単一チャンネル化 -> 二値化
+
+    :param img_cv: 入力画像。書き換えない
+    :param params: 前処理条件
+    :param timings: 指定した場合は各処理の時間[sec]を加算
+    :return: 前処理後の画像。入力画像と共有する場合があるため書き換えないこと
+    """
+    return _pipeline.run(None, img_cv, params, timings=timings)
+
+
+_pipeline = PreprocPipeline(max_bytes=0)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,171 @@
+import math
+import itertools
+
+import cv2
+import numpy as np
+
+# ids of indexes: prefix of the keys in the shared cache
+_index_ids = itertools.count()
+
+
+def get_band(pos: int, width: int, size: int):
+    """
+    位置posを中心とする幅widthの範囲。画像端では範囲内にずらす
+
+    :return: (start, stop)
+    """
+    width = min(max(int(width), 1), size)
+    start = min(max(int(pos) - width // 2, 0), size - width)
+    return start, start + width
+
+
+def _get_sum_dtype(img, length: int):
+    if np.issubdtype(img.dtype, np.floating):
+        return np.float64
+    if img.dtype == np.uint8 and length * 255 < 2 ** 31:
+        return np.int32
+    return np.int64
+
+
+class ProfileIndex:
+    """
+    プロファイル算出用の累積和(行方向, 列方向)。画像ごとに一度だけ作成する。
+    水平/垂直方向の任意の幅の平均プロファイルを、累積和の差分により長さに比例する時間で算出する。
+    累積和はキャッシュ(容量上限あり)に保持し、上限を超える場合や部分読込の画像は範囲を直接平均する。
+    """
+
+    def __init__(self, img, cache=None, key=None):
+        """
+        :param img: 画像(numpy配列またはLazyImage)
+        :param cache: 累積和のキャッシュ(ImageCache)。Noneの場合はこのインスタンスで保持
+        :param key: キャッシュのキー(画像の内容から作成)。Noneの場合はインスタンスごとに割り当て
+        """
+        self.img = img
+        self.cache = cache
+        if key is None:
+            key = next(_index_ids)
+        self.key = ('profile', key)
+
+        self._sums = {}
+
+    def get_cumsum(self, axis: int):
+        """
+        axis方向の累積和(先頭に0を追加)。作成できない場合はNone
+        """
+        if not isinstance(self.img, np.ndarray):
+            return None
+
+        _key = self.key + (axis,)
+        if self.cache is not None:
+            _sum = self.cache.get(_key)
+        else:
+            _sum = self._sums.get(_key)
+        if _sum is not None:
+            return _sum
+
+        _shape = list(self.img.shape)
+        _dtype = _get_sum_dtype(self.img, _shape[axis])
+        _shape[axis] += 1
+        _nbytes = int(np.prod(_shape)) * np.dtype(_dtype).itemsize
+        if self.cache is not None and _nbytes > self.cache.max_bytes:
+            return None
+
+        _sum = np.zeros(_shape, dtype=_dtype)
+        if axis == 0:
+            np.cumsum(self.img, axis=0, dtype=_dtype, out=_sum[1:])
+        else:
+            np.cumsum(self.img, axis=1, dtype=_dtype, out=_sum[:, 1:])
+
+        if self.cache is not None:
+            self.cache.put(_key, _sum)
+        else:
+            self._sums[_key] = _sum
+        return _sum
+
+    def band_mean(self, direction: str, start: int, stop: int) -> np.array:
+        """
+        帯状の範囲の平均プロファイル
+
+        :param direction: hor: 行[start, stop)の平均(長さ=画像幅), ver: 列[start, stop)の平均(長さ=画像高さ)
+        :return: 平均プロファイル。カラー画像は(長さ, チャンネル数)
+        """
+        _axis = 0 if direction == 'hor' else 1
+        _num = max(stop - start, 1)
+
+        _sum = self.get_cumsum(_axis)
+        if _sum is None:
+            if _axis == 0:
+                _band = np.asarray(self.img[start:stop, :])
+            else:
+                _band = np.asarray(self.img[:, start:stop])
+            return np.mean(_band, axis=_axis)
+
+        if _axis == 0:
+            _diff = _sum[stop] - _sum[start]
+        else:
+            _diff = _sum[:, stop] - _sum[:, start]
+        return _diff / _num
+
+    def profile(self, direction: str, pos: int, width: int = 20) -> np.array:
+        """
+        位置posを中心とする幅widthの平均プロファイル
+        """
+        _size = self.img.shape[0] if direction == 'hor' else self.img.shape[1]
+        _start, _stop = get_band(pos, width, _size)
+        return self.band_mean(direction, _start, _stop)
+
+
+def line_profile(img, x0, y0, x1, y1, width: int = 1):
+    """
+    任意の線分(x0, y0)-(x1, y1)のプロファイル。線分上を1画素間隔で双線形補間し、
+    widthが2以上の場合は線分に垂直な方向にwidth本平均する
+
+    :param img: 画像(numpy配列またはLazyImage)
+    :param width: 平均する幅[pix]
+    :return: (始点からの距離, プロファイル)。カラー画像は(長さ, チャンネル数)
+    """
+    img_h = img.shape[0]
+    img_w = img.shape[1]
+
+    _dx = x1 - x0
+    _dy = y1 - y0
+    _length = math.hypot(_dx, _dy)
+    _num = max(int(math.ceil(_length)) + 1, 2)
+    width = max(int(width), 1)
+
+    _t = np.linspace(0.0, 1.0, _num)
+    _xs = x0 + _t * _dx
+    _ys = y0 + _t * _dy
+
+    # normal of the line
+    if _length > 0:
+        _nx = -_dy / _length
+        _ny = _dx / _length
+    else:
+        _nx, _ny = 0.0, 0.0
+    _offsets = np.arange(width) - (width - 1) / 2
+
+    _map_x = _xs[np.newaxis, :] + _offsets[:, np.newaxis] * _nx
+    _map_y = _ys[np.newaxis, :] + _offsets[:, np.newaxis] * _ny
+
+    # read only the bounding box of the samples
+    _bx0 = min(max(int(math.floor(_map_x.min())), 0), img_w - 1)
+    _by0 = min(max(int(math.floor(_map_y.min())), 0), img_h - 1)
+    _bx1 = min(max(int(math.ceil(_map_x.max())) + 1, _bx0 + 1), img_w)
+    _by1 = min(max(int(math.ceil(_map_y.max())) + 1, _by0 + 1), img_h)
+    _img = np.asarray(img[_by0:_by1, _bx0:_bx1])
+    if _img.dtype == np.float64:
+        _img = _img.astype(np.float32)
+
+    _samples = cv2.remap(_img,
+                         (_map_x - _bx0).astype(np.float32),
+                         (_map_y - _by0).astype(np.float32),
+                         interpolation=cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_REPLICATE)
+
+    _profile = np.mean(_samples, axis=0, dtype=np.float64)
+    return _t * _length, _profile
+
+
+if __name__ == '__main__':
+    pass
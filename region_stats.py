@@ -0,0 +1,132 @@
+import numpy as np
+
+from hist_index import calc_hist
+
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+
+def hist_stats(hist, percentiles=PERCENTILES, thres=None) -> dict:
+    """
+    ヒストグラム(8bit, 256bin)から統計量を算出。計算量は画素数によらない
+
+    :param hist: 画素値ごとの画素数
+    :param percentiles: パーセンタイル[%]
+    :param thres: 前景とする画素値の範囲(lower, upper)。Noneの場合は前景を算出しない
+    :return: 画素数、平均、標準偏差、最小、最大、パーセンタイル、前景の画素数
+    """
+    _hist = np.ravel(hist).astype(np.float64)
+    _num = _hist.sum()
+    res = {"count": int(_num), "mean": None, "std": None, "min": None, "max": None,
+           "percentiles": {}, "fg_count": None}
+    if _num <= 0:
+        return res
+
+    _vals = np.arange(len(_hist), dtype=np.float64)
+    _mean = float((_hist * _vals).sum() / _num)
+    _var = float((_hist * (_vals - _mean) ** 2).sum() / _num)
+    _nonzero = np.flatnonzero(_hist)
+
+    res["mean"] = _mean
+    res["std"] = _var ** 0.5
+    res["min"] = int(_nonzero[0])
+    res["max"] = int(_nonzero[-1])
+
+    # lowest value whose cumulative count reaches p% (same as np.percentile(method='inverted_cdf'))
+    _cum = np.cumsum(_hist)
+    for _p in percentiles:
+        _idx = np.searchsorted(_cum, _num * _p / 100, side='left')
+        res["percentiles"][_p] = int(min(max(_idx, _nonzero[0]), _nonzero[-1]))
+
+    if thres is not None:
+        _low = min(max(int(thres[0]), 0), len(_hist) - 1)
+        _high = min(max(int(thres[1]), 0), len(_hist) - 1)
+        res["fg_count"] = int(_hist[_low:_high + 1].sum())
+
+    return res
+
+
+def array_stats(values, percentiles=PERCENTILES, thres=None) -> dict:
+    """
+    画素値の配列から統計量を算出(8bit以外の画像用)。hist_statsと同じ形式
+    """
+    _vals = np.ravel(values)
+    res = {"count": int(_vals.size), "mean": None, "std": None, "min": None, "max": None,
+           "percentiles": {}, "fg_count": None}
+    if _vals.size == 0:
+        return res
+
+    res["mean"] = float(np.mean(_vals, dtype=np.float64))
+    res["std"] = float(np.std(_vals, dtype=np.float64))
+    res["min"] = _vals.min().item()
+    res["max"] = _vals.max().item()
+    _ps = np.percentile(_vals, percentiles, method='inverted_cdf')
+    res["percentiles"] = {_p: _v.item() for _p, _v in zip(percentiles, _ps)}
+
+    if thres is not None:
+        res["fg_count"] = int(np.count_nonzero((_vals >= thres[0]) & (_vals <= thres[1])))
+
+    return res
+
+
+def region_stats(img, x0, x1, y0, y1, index=None, percentiles=PERCENTILES, thres=None) -> list:
+    """
+    矩形のチャンネルごとの統計量。
+    8bit画像はヒストグラム(索引がある場合は索引、無い場合は矩形のcalcHist)から算出する
+
+    :param img: 画像(numpy配列またはLazyImage)
+    :param index: hist_index.BlockHistIndex(mode='bgr')。Noneの場合は矩形を直接集計
+    :param percentiles: パーセンタイル[%]
+    :param thres: 前景とする画素値の範囲(lower, upper)
+    :return: チャンネルごとの統計量(hist_statsの結果)のリスト
+    """
+    if index is not None:
+        _hists = index.get_hist(x0, x1, y0, y1)
+        return [hist_stats(_hist, percentiles, thres) for _hist in _hists]
+
+    _x0, _x1 = sorted((int(x0), int(x1)))
+    _y0, _y1 = sorted((int(y0), int(y1)))
+    _x0 = max(_x0, 0)
+    _y0 = max(_y0, 0)
+    _img = np.asarray(img[_y0:max(_y1, _y0), _x0:max(_x1, _x0)])
+    if _img.ndim == 2:
+        _img = _img[:, :, np.newaxis]
+
+    if _img.dtype == np.uint8:
+        _hists = calc_hist(_img)
+        return [hist_stats(_hists[_ch], percentiles, thres) for _ch in range(_img.shape[2])]
+
+    return [array_stats(_img[:, :, _ch], percentiles, thres) for _ch in range(_img.shape[2])]
+
+
+def format_stats(stats_list, labels, area_px: int, pix2um: float = 1.0) -> str:
+    """
+    統計量の表示用テキスト
+
+    :param stats_list: region_statsの結果
+    :param labels: チャンネル名
+    :param area_px: 矩形の画素数
+    :param pix2um: 1画素の長さ[um]
+    """
+    _area = area_px * pix2um ** 2
+    _lines = [f'area: {area_px} pix ({_area:.6g} um2)']
+
+    for _label, _stats in zip(labels, stats_list):
+        _lines.append('')
+        _lines.append(f'[{_label}]')
+        if _stats["count"] == 0:
+            _lines.append('no pixels')
+            continue
+
+        _lines.append(f'mean: {_stats["mean"]:.2f}  std: {_stats["std"]:.2f}')
+        _lines.append(f'min: {_stats["min"]}  max: {_stats["max"]}')
+        _lines.append('  '.join(f'p{_p}: {_v}' for _p, _v in _stats["percentiles"].items()))
+        if _stats["fg_count"] is not None:
+            _ratio = _stats["fg_count"] / _stats["count"] * 100
+            _lines.append(f'foreground: {_stats["fg_count"]} pix '
+                          f'({_stats["fg_count"] * pix2um ** 2:.6g} um2, {_ratio:.1f} %)')
+
+    return '\n'.join(_lines)
+
+
+if __name__ == '__main__':
+    pass
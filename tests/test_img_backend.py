@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+tifffile = pytest.importorskip('tifffile')
+
+from img_backend import TiffImage, open_lazy_image
+
+
+@pytest.mark.parametrize('shape', [(1000, 700, 3), (1000, 700)])
+def test_stripped_tiff_short_last_strip(tmp_path, shape):
+    # height is not a multiple of the strip height: the last strip is shorter
+    img = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    img_path = str(tmp_path / 'strips.tif')
+    tifffile.imwrite(img_path, img, compression='zlib', rowsperstrip=64)
+
+    lazy = open_lazy_image(img_path)
+    assert isinstance(lazy, TiffImage)
+
+    # color: returned in BGR order
+    expected = img[:, :, ::-1] if img.ndim == 3 else img
+    np.testing.assert_array_equal(np.asarray(lazy), expected)
+    np.testing.assert_array_equal(lazy[950:1000, 600:700], expected[950:1000, 600:700])
+
+
+def test_tiled_tiff_edge_region(tmp_path):
+    img = np.random.default_rng(1).integers(0, 256, (300, 200, 3), dtype=np.uint8)
+    img_path = str(tmp_path / 'tiles.tif')
+    tifffile.imwrite(img_path, img, compression='zlib', tile=(64, 64))
+
+    lazy = open_lazy_image(img_path)
+    assert isinstance(lazy, TiffImage)
+    np.testing.assert_array_equal(lazy[250:300, 150:200], img[250:300, 150:200, ::-1])
@@ -0,0 +1,190 @@
+import os
+import time
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+# long-edge sizes of stored previews
+THUMB_SIZES = (128, 256, 512)
+
+
+class ThumbCache:
+    """
+    サムネイルをSQLiteファイルに保存するキャッシュ。セッションをまたいで使用する。
+    キーは(パス, 更新時刻, ファイルサイズ)とし、長辺THUMB_SIZESの縮小画像をJPEGで保持する。
+    """
+
+    def __init__(self, db_path: str, max_mb: int = 1024, quality: int = 90):
+        self.db_path = db_path
+        self.max_bytes = max_mb * 1024 * 1024
+        self.quality = quality
+
+        self.hits = 0
+        self.misses = 0
+        self.build_sec = 0.0
+        self.build_num = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS thumbs ('
+                           'path TEXT, size INTEGER, '
+                           'mtime INTEGER, fsize INTEGER, '
+                           'org_h INTEGER, org_w INTEGER, '
+                           'created REAL, data BLOB, '
+                           'PRIMARY KEY (path, size))')
+        self._conn.commit()
+
+        self.cur_bytes = int(self._conn.execute('SELECT TOTAL(LENGTH(data)) FROM thumbs').fetchone()[0])
+
+    @staticmethod
+    def _stat(img_path):
+        try:
+            _stat = os.stat(img_path)
+        except OSError:
+            return None
+        return os.path.abspath(img_path), _stat.st_mtime_ns, _stat.st_size
+
+    def get(self, img_path: str, tile_h: int, tile_w: int):
+        """
+        表示サイズを満たす最小のサムネイルを取得。無い場合は最大のサムネイル
+
+        :param img_path: 画像パス
+        :param tile_h: 表示高さ
+        :param tile_w: 表示幅
+        :return: (サムネイル, (元画像の高さ, 元画像の幅))。無い場合は(None, None)
+        """
+        _stat = self._stat(img_path)
+        if _stat is None:
+            return None, None
+        _path, _mtime, _fsize = _stat
+
+        with self._lock:
+            rows = self._conn.execute('SELECT size, org_h, org_w, data FROM thumbs '
+                                      'WHERE path=? AND mtime=? AND fsize=? ORDER BY size',
+                                      (_path, _mtime, _fsize)).fetchall()
+
+        if len(rows) == 0:
+            self.misses += 1
+            return None, None
+
+        _row = rows[-1]
+        for _size, _org_h, _org_w, _data in rows:
+            _ratio = _size / max(_org_h, _org_w)
+            if min(tile_h / (_org_h * _ratio), tile_w / (_org_w * _ratio)) <= 1:
+                _row = (_size, _org_h, _org_w, _data)
+                break
+
+        _size, _org_h, _org_w, _data = _row
+        img = cv2.imdecode(np.frombuffer(_data, np.uint8), cv2.IMREAD_UNCHANGED)
+        if img is None:
+            self.misses += 1
+            return None, None
+
+        self.hits += 1
+        return img, (_org_h, _org_w)
+
+    def put(self, img_path: str, img: np.array, org_shape) -> None:
+        """
+        サムネイルを作成して保存。登録済みの場合は何もしない
+
+        :param img_path: 画像パス
+        :param img: デコード済み画像(縮小画像でも可)
+        :param org_shape: 元画像のサイズ(img_h, img_w)
+        """
+        if img is None or org_shape is None:
+            return
+        if img.dtype != np.uint8:
+            return
+
+        _stat = self._stat(img_path)
+        if _stat is None:
+            return
+        _path, _mtime, _fsize = _stat
+
+        with self._lock:
+            _row = self._conn.execute('SELECT 1 FROM thumbs WHERE path=? AND mtime=? AND fsize=? LIMIT 1',
+                                      (_path, _mtime, _fsize)).fetchone()
+        if _row is not None:
+            return
+
+        _t0 = time.perf_counter()
+
+        _org_h, _org_w = org_shape
+        _rows = []
+        for _size in THUMB_SIZES:
+            _ratio = _size / max(_org_h, _org_w)
+            _h = int(_org_h * _ratio)
+            _w = int(_org_w * _ratio)
+            if _h < 1 or _w < 1:
+                continue
+            if _h > img.shape[0] or _w > img.shape[1]:
+                break
+
+            _img = cv2.resize(img, (_w, _h), interpolation=cv2.INTER_AREA)
+            _ret, _buf = cv2.imencode('.jpg', _img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not _ret:
+                continue
+            _rows.append((_path, _size, _mtime, _fsize, _org_h, _org_w, time.time(), _buf.tobytes()))
+
+        with self._lock:
+            # replace stale thumbnails of the same path
+            _old = self._conn.execute('SELECT TOTAL(LENGTH(data)) FROM thumbs WHERE path=?',
+                                      (_path,)).fetchone()[0]
+            self._conn.execute('DELETE FROM thumbs WHERE path=?', (_path,))
+            self._conn.executemany('INSERT INTO thumbs VALUES (?, ?, ?, ?, ?, ?, ?, ?)', _rows)
+            self._conn.commit()
+            self.cur_bytes += sum(len(_row[-1]) for _row in _rows) - int(_old)
+
+        self.build_sec += time.perf_counter() - _t0
+        self.build_num += 1
+
+        self._prune()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            _num = self._conn.execute('SELECT COUNT(DISTINCT path) FROM thumbs').fetchone()[0]
+
+        _total = self.hits + self.misses
+        res = {"path": self.db_path,
+               "images": _num,
+               "bytes": self.cur_bytes,
+               "max_bytes": self.max_bytes,
+               "hits": self.hits,
+               "misses": self.misses,
+               "hit_rate": self.hits / _total if _total > 0 else 0.0,
+               "build_num": self.build_num,
+               "build_sec": self.build_sec,
+               }
+        return res
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _prune(self) -> None:
+        """
+        容量を超えた場合は古いサムネイルから削除
+        """
+        if self.cur_bytes <= self.max_bytes:
+            return
+
+        with self._lock:
+            rows = self._conn.execute('SELECT path, TOTAL(LENGTH(data)) FROM thumbs '
+                                      'GROUP BY path ORDER BY MIN(created)').fetchall()
+            _paths = []
+            for _path, _nbytes in rows:
+                if self.cur_bytes <= self.max_bytes * 0.9:
+                    break
+                _paths.append((_path,))
+                self.cur_bytes -= int(_nbytes)
+
+            self._conn.executemany('DELETE FROM thumbs WHERE path=?', _paths)
+            self._conn.commit()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,160 @@
+import cv2
+import numpy as np
+import tkinter
+from PIL import Image, ImageTk
+
+
+def to_pil_buffer(img_cv, buf=None):
+    """
+    OpenCV画像(8bit: BGR, BGRA, グレー)をPhotoImageへ貼り付けるPIL画像に変換。
+    カラーはbuf(RGBX)への1回の変換のみ、グレーは変換なしで、PIL画像はその配列を参照する(コピーなし)。
+    bufは次の変換で上書きされるため、PIL画像は貼り付けた後は使用しないこと
+
+    :param img_cv: OpenCV画像
+    :param buf: 変換先(高さ, 幅, 4)。Noneまたはサイズが異なる場合は確保
+    :return: (PIL画像, buf)
+    """
+    img_h, img_w = img_cv.shape[:2]
+    if img_cv.ndim == 3 and img_cv.shape[2] == 1:
+        img_cv = img_cv[:, :, 0]
+
+    if img_cv.ndim == 2:
+        _img = np.ascontiguousarray(img_cv)
+        return Image.frombuffer('L', (img_w, img_h), _img, 'raw', 'L', 0, 1), buf
+
+    if buf is None or buf.shape != (img_h, img_w, 4):
+        buf = np.empty((img_h, img_w, 4), dtype=np.uint8)
+    if img_cv.shape[2] == 4:
+        cv2.cvtColor(img_cv, cv2.COLOR_BGRA2RGBA, dst=buf)
+    else:
+        cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGBA, dst=buf)
+    return Image.frombuffer('RGBX', (img_w, img_h), buf, 'raw', 'RGBX', 0, 1), buf
+
+
+class TileGrid:
+    """
+    画像表示用のFrame/Labelを纏めたクラス。
+    レイアウト(行数, 列数, 画像サイズ)ごとに一度だけ生成し、ページ送りや図形描画では使い回す。
+    イベントはショートカットの種類が変わった場合のみ再登録する。
+    """
+
+    def __init__(self, parent, num_row, num_col, tile_h, tile_w, **label_style):
+        self.num_row = num_row
+        self.num_col = num_col
+        self.tile_h = tile_h
+        self.tile_w = tile_w
+
+        self.frames: list[tkinter.Frame] = []
+        self.labels: list[tkinter.Label] = []
+        self.photos: list[ImageTk.PhotoImage] = []
+
+        # per tile: mode of the PhotoImage, RGBX buffer of the conversion
+        self.modes = []
+        self.buffers = []
+
+        self.bind_mode = None
+        self._bind_sequences = []
+
+        for _row in range(num_row):
+            for _col in range(num_col):
+                _frame = tkinter.Frame(parent, width=tile_w, height=tile_h)
+                _frame.grid(row=_row, column=_col, padx=4, pady=4)
+                _frame.grid_propagate(False)
+
+                _label = tkinter.Label(_frame,
+                                       text='',
+                                       compound='none',
+                                       **label_style
+                                       )
+                _label.grid()
+
+                self.frames.append(_frame)
+                self.labels.append(_label)
+                self.photos.append(None)
+                self.modes.append(None)
+                self.buffers.append(None)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def is_layout(self, num_row, num_col, tile_h, tile_w) -> bool:
+        return (self.num_row, self.num_col, self.tile_h, self.tile_w) == (num_row, num_col, tile_h, tile_w)
+
+    def set_image_cv(self, tile_cnt, text, img_cv) -> None:
+        """
+        OpenCV画像を表示。タイルごとの変換用バッファを使い回す
+
+        :param tile_cnt: 表示位置
+        :param text: Labelのテキスト(画像番号)
+        :param img_cv: OpenCV画像(8bit)。Noneの場合はテキストのみ
+        """
+        if img_cv is None:
+            self.set_image(tile_cnt, text, None)
+            return
+
+        img_pil, self.buffers[tile_cnt] = to_pil_buffer(img_cv, self.buffers[tile_cnt])
+        self.set_image(tile_cnt, text, img_pil)
+
+    def set_image(self, tile_cnt, text, img_pil) -> None:
+        """
+        画像を表示。同じサイズ/モードのPhotoImageがあれば貼り付けのみ行う
+
+        :param tile_cnt: 表示位置
+        :param text: Labelのテキスト(画像番号)
+        :param img_pil: PIL画像。Noneの場合はテキストのみ
+        """
+        _label = self.labels[tile_cnt]
+        _photo = self.photos[tile_cnt]
+
+        if img_pil is None:
+            self.photos[tile_cnt] = None
+            self.modes[tile_cnt] = None
+            _label.configure(text=text, image='')
+            return
+
+        # pasting into a photo of another mode would convert again
+        _mode = Image.getmodebase(img_pil.mode)
+        if _photo is not None and (_photo.width(), _photo.height()) == img_pil.size \
+                and self.modes[tile_cnt] == _mode:
+            _photo.paste(img_pil)
+            if _label['text'] != text:
+                _label.configure(text=text)
+            return
+
+        _photo = ImageTk.PhotoImage(img_pil)
+        self.photos[tile_cnt] = _photo
+        self.modes[tile_cnt] = _mode
+        _label.configure(text=text, image=_photo)
+
+    def bind_events(self, mode, events) -> None:
+        """
+        全Labelにイベントを登録
+
+        :param mode: ショートカットの種類。前回と同じ場合は何もしない
+        :param events: (sequence, func)のリスト
+        """
+        if mode == self.bind_mode:
+            return
+
+        for _label in self.labels:
+            for _seq in self._bind_sequences:
+                _label.unbind(_seq)
+            for _seq, _func in events:
+                _label.bind(_seq, _func)
+
+        self.bind_mode = mode
+        self._bind_sequences = [_seq for _seq, _ in events]
+
+    def destroy(self) -> None:
+        for _frame in self.frames:
+            _frame.destroy()
+
+        self.frames = []
+        self.labels = []
+        self.photos = []
+        self.modes = []
+        self.buffers = []
+
+
+if __name__ == '__main__':
+    pass
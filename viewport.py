@@ -0,0 +1,234 @@
+import math
+import itertools
+
+import cv2
+import numpy as np
+
+from img_cache import ImageCache
+
+# ids of pyramids: prefix of the keys in the shared tile cache
+_pyramid_ids = itertools.count()
+
+
+class Viewport:
+    """
+    画像1枚分の表示範囲(中心, 倍率)を管理するクラス。倍率は表示画素/元画素。
+    倍率の下限は表示サイズにフィットする倍率とし、表示範囲は画像内に制限する。
+    """
+
+    def __init__(self, img_h: int, img_w: int, view_h: int, view_w: int, max_scale: float = 32.0):
+        """
+        :param img_h: 元画像の高さ
+        :param img_w: 元画像の幅
+        :param view_h: 表示高さ
+        :param view_w: 表示幅
+        :param max_scale: 倍率の上限
+        """
+        self.img_h = img_h
+        self.img_w = img_w
+        self.view_h = view_h
+        self.view_w = view_w
+
+        self.fit_scale = min(view_h / img_h, view_w / img_w)
+        self.max_scale = max(max_scale, self.fit_scale)
+
+        self.scale = self.fit_scale
+        self.cx = img_w / 2
+        self.cy = img_h / 2
+
+    def fit(self) -> None:
+        self.scale = self.fit_scale
+        self.cx = self.img_w / 2
+        self.cy = self.img_h / 2
+
+    def is_fit(self) -> bool:
+        return self.scale <= self.fit_scale
+
+    def get_state(self):
+        return self.cx, self.cy, self.scale
+
+    def set_state(self, cx, cy, scale) -> None:
+        """
+        中心(元画像の座標)と倍率を設定。範囲外の場合は制限する
+        """
+        _scale = min(scale, self.max_scale)
+        if _scale <= self.fit_scale:
+            self.fit()
+            return
+
+        self.scale = _scale
+        self.cx = cx
+        self.cy = cy
+        self._clamp()
+
+    def fit_rect(self, x0, y0, x1, y1) -> None:
+        """
+        矩形(元画像の座標)が収まるように設定
+        """
+        _w = max(abs(x1 - x0), 1)
+        _h = max(abs(y1 - y0), 1)
+        self.set_state((x0 + x1) / 2, (y0 + y1) / 2, min(self.view_h / _h, self.view_w / _w))
+
+    def get_origin(self):
+        """
+        表示範囲の左上(元画像の座標)
+        """
+        if self.is_fit():
+            return 0.0, 0.0
+        return self.cx - self.view_w / 2 / self.scale, self.cy - self.view_h / 2 / self.scale
+
+    def gui2org(self, gui_x, gui_y):
+        _ox, _oy = self.get_origin()
+        return _ox + gui_x / self.scale, _oy + gui_y / self.scale
+
+    def org2gui(self, x, y):
+        _ox, _oy = self.get_origin()
+        return (x - _ox) * self.scale, (y - _oy) * self.scale
+
+    def zoom_at(self, gui_x, gui_y, factor: float) -> None:
+        """
+        表示位置(gui_x, gui_y)の画素を固定して拡大/縮小
+        """
+        _x, _y = self.gui2org(gui_x, gui_y)
+
+        _scale = min(max(self.scale * factor, self.fit_scale), self.max_scale)
+        if _scale <= self.fit_scale:
+            self.fit()
+            return
+
+        self.scale = _scale
+        self.cx = _x - gui_x / _scale + self.view_w / 2 / _scale
+        self.cy = _y - gui_y / _scale + self.view_h / 2 / _scale
+        self._clamp()
+
+    def pan(self, gui_dx, gui_dy) -> None:
+        """
+        表示範囲を移動[表示画素]
+        """
+        if self.is_fit():
+            return
+
+        self.cx -= gui_dx / self.scale
+        self.cy -= gui_dy / self.scale
+        self._clamp()
+
+    def _clamp(self):
+        _half_w = self.view_w / 2 / self.scale
+        _half_h = self.view_h / 2 / self.scale
+        self.cx = min(max(self.cx, _half_w), max(self.img_w - _half_w, _half_w))
+        self.cy = min(max(self.cy, _half_h), max(self.img_h - _half_h, _half_h))
+
+
+class TilePyramid:
+    """
+    多重解像度のタイル画像。レベルkは元画像の1/2^k。
+    レベル0は元画像(numpy配列またはLazyImage)の表示範囲をそのまま参照し、
+    レベル1以上のタイルは1つ下のレベルから作成して共有のキャッシュに保持する。
+    描画時は倍率に合ったレベルの表示範囲のタイルのみ使用する。
+    """
+
+    def __init__(self, img, cache: ImageCache, tile_size: int = 256, key=None):
+        """
+        :param img: 元画像(numpy配列またはLazyImage)
+        :param cache: タイルのキャッシュ
+        :param tile_size: タイルサイズ[pix]
+        :param key: 元画像のキー。同じ画像のピラミッドはタイルを共有する。Noneの場合はこのインスタンスのみ
+        """
+        self.img = img
+        self.cache = cache
+        self.tile_size = tile_size
+        if key is None:
+            key = next(_pyramid_ids)
+        self.key = ('pyramid', key, tile_size)
+
+        self.shapes = [tuple(img.shape[:2])]
+        while max(self.shapes[-1]) > tile_size:
+            _h, _w = self.shapes[-1]
+            self.shapes.append(((_h + 1) // 2, (_w + 1) // 2))
+
+    def get_level(self, scale: float) -> int:
+        """
+        倍率scaleの描画に使用するレベル: 1/2^k >= scaleとなる最大のk
+        """
+        _level = 0
+        while _level + 1 < len(self.shapes) and 2 ** (_level + 1) * scale <= 1:
+            _level += 1
+        return _level
+
+    def read_region(self, level: int, y0: int, y1: int, x0: int, x1: int) -> np.array:
+        if level == 0:
+            return np.asarray(self.img[y0:y1, x0:x1])
+
+        _size = self.tile_size
+        img = None
+        for _ty in range(y0 // _size, -(-y1 // _size)):
+            for _tx in range(x0 // _size, -(-x1 // _size)):
+                _tile = self.get_tile(level, _ty, _tx)
+                if img is None:
+                    img = np.empty((y1 - y0, x1 - x0) + _tile.shape[2:], dtype=_tile.dtype)
+
+                _cy0 = _ty * _size
+                _cx0 = _tx * _size
+                _sy0 = max(y0, _cy0)
+                _sy1 = min(y1, _cy0 + _size)
+                _sx0 = max(x0, _cx0)
+                _sx1 = min(x1, _cx0 + _size)
+
+                img[_sy0 - y0:_sy1 - y0, _sx0 - x0:_sx1 - x0] = \
+                    _tile[_sy0 - _cy0:_sy1 - _cy0, _sx0 - _cx0:_sx1 - _cx0]
+        return img
+
+    def get_tile(self, level: int, ty: int, tx: int) -> np.array:
+        _key = self.key + (level, ty, tx)
+        tile = self.cache.get(_key)
+        if tile is not None:
+            return tile
+
+        _size = self.tile_size
+        _h, _w = self.shapes[level]
+        _prev_h, _prev_w = self.shapes[level - 1]
+        y0 = ty * _size
+        y1 = min(y0 + _size, _h)
+        x0 = tx * _size
+        x1 = min(x0 + _size, _w)
+
+        _src = self.read_region(level - 1, 2 * y0, min(2 * y1, _prev_h), 2 * x0, min(2 * x1, _prev_w))
+        tile = cv2.resize(_src, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+
+        self.cache.put(_key, tile)
+        return tile
+
+    def render(self, viewport: Viewport) -> np.array:
+        """
+        表示範囲を描画(表示サイズ)。拡大時は最近傍、縮小時は線形補間
+
+        :param viewport: 表示範囲
+        :return: 表示画像
+        """
+        _level = self.get_level(viewport.scale)
+        _factor = 2 ** _level
+        _scale = viewport.scale * _factor
+        _h, _w = self.shapes[_level]
+
+        # visible region at the level
+        _ox, _oy = viewport.get_origin()
+        _ox /= _factor
+        _oy /= _factor
+        x0 = min(max(int(math.floor(_ox)), 0), _w - 1)
+        y0 = min(max(int(math.floor(_oy)), 0), _h - 1)
+        x1 = min(int(math.ceil(_ox + viewport.view_w / _scale)) + 1, _w)
+        y1 = min(int(math.ceil(_oy + viewport.view_h / _scale)) + 1, _h)
+
+        _img = self.read_region(_level, y0, y1, x0, x1)
+
+        # view pixel g shows level pixel floor(origin + g / scale), same as Viewport.gui2org
+        _mat = np.float32([[_scale, 0, (x0 - _ox + 0.5) * _scale],
+                           [0, _scale, (y0 - _oy + 0.5) * _scale]])
+        _interpolation = cv2.INTER_NEAREST if _scale >= 1 else cv2.INTER_LINEAR
+        img = cv2.warpAffine(_img, _mat, (viewport.view_w, viewport.view_h),
+                             flags=_interpolation, borderMode=cv2.BORDER_REPLICATE)
+        return img
+
+
+if __name__ == '__main__':
+    pass